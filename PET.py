@@ -1,17 +1,130 @@
 import sys
 import os
 import random
+import time
+import bisect
+import gc
+import math
 import json
+import marshal
+import queue
+import re
+import threading
+import argparse
+import ctypes
+import hashlib
+import mmap
+import struct
+import weakref
+import zipfile
+from collections import OrderedDict, deque, namedtuple
 from pathlib import Path
-from PyQt5 import QtWidgets, QtGui, QtCore
+from PyQt5 import QtWidgets, QtGui, QtCore, sip
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QPixmap, QPalette, QBrush
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError, APITimeoutError
 from PyQt5.QtCore import QThread, pyqtSignal
 
+try:
+    import numpy as np
+except ImportError:  # numpy 可选：缺失时不裁剪透明边缘
+    np = None
+
+
+# 启用软件OpenGL渲染（解决显卡兼容问题）；DESKPET_SOFTWARE_GL=0 时使用显卡驱动
+if os.environ.get('DESKPET_SOFTWARE_GL', '1') == '1':
+    QtCore.QCoreApplication.setAttribute(QtCore.Qt.AA_UseSoftwareOpenGL)
+
+# 动画状态图：每个动作由若干阶段组成
+#   start  : 起始阶段
+#   then   : 动作结束后接着播放的动作（None 表示关闭窗口），默认回到 idle
+#   reward : 动作完整结束时的好感度奖励（FAVOR_REWARDS 中的键）
+# 阶段字段：
+#   path     : 帧目录
+#   interval : 文件名未标注时长时的默认帧间隔（ms），默认100
+#   loop     : True 时循环播放直到被中断
+#   next     : 播放一遍后进入的阶段；缺省表示动作结束
+#   stop     : 被中断时跳转的阶段；缺省表示直接回到待机
+ANIMATION_GRAPH = {
+    'startup': {
+        'start': 'A',
+        'stages': {
+            'A': {'path': r"mod\0000_core\pet\vup\StartUP\Happy"},
+        },
+    },
+    'idle': {
+        'start': 'B',
+        'stages': {
+            'B': {'path': r"mod\0000_core\pet\vup\BDay\B", 'loop': True},
+        },
+    },
+    'study': {
+        'start': 'A',
+        'reward': 'transform',
+        'stages': {
+            'A': {'path': r"mod\0000_core\pet\vup\WORK\Study\A_Nomal", 'interval': 70, 'next': 'B'},
+            'B': {'path': r"mod\0000_core\pet\vup\WORK\Study\B_1_Nomal", 'interval': 70, 'loop': True, 'stop': 'C'},
+            'C': {'path': r"mod\0000_core\pet\vup\WORK\Study\C_Nomal", 'interval': 70},
+        },
+    },
+    'work': {
+        'start': 'A',
+        'reward': 'pipi',
+        'stages': {
+            'A': {'path': r"mod\0000_core\pet\vup\WORK\WorkTWO\A_Nomal", 'next': 'B'},
+            'B': {'path': r"mod\0000_core\pet\vup\WORK\WorkTWO\B_2_Nomal", 'loop': True, 'stop': 'C'},
+            'C': {'path': r"mod\0000_core\pet\vup\WORK\WorkTWO\C_Nomal"},
+        },
+    },
+    'exercise': {
+        'start': 'A',
+        'reward': 'exercise',
+        'stages': {
+            'A': {'path': r"mod\0000_core\pet\vup\WORK\RopeSkipping\Happy\A", 'next': 'B'},
+            'B': {'path': r"mod\0000_core\pet\vup\WORK\RopeSkipping\Happy\B\1", 'loop': True, 'stop': 'C'},
+            'C': {'path': r"mod\0000_core\pet\vup\WORK\RopeSkipping\Happy\C"},
+        },
+    },
+    'eat': {
+        'start': 'A',
+        'stages': {
+            'A': {'path': r"mod\0000_core\pet\vup\Eat\Nomal\back_lay"},
+        },
+    },
+    'snack': {
+        'start': 'A',
+        'then': 'sleep',
+        'stages': {
+            'A': {'path': r"D:\数据科学与大数据技术\大二下课程\数据分析与应用\final\all_pet\pet\vup\Eat\Happy\back_lay"},
+        },
+    },
+    'sleep': {
+        'start': 'A',
+        'stages': {
+            'A': {'path': r"mod\0000_core\pet\vup\Sleep\A_Happy", 'next': 'B', 'stop': 'C'},
+            'B': {'path': r"mod\0000_core\pet\vup\Sleep\B_Nomal", 'loop': True, 'stop': 'C'},
+            'C': {'path': r"mod\0000_core\pet\vup\Sleep\C_PoorCondition", 'interval': 130},  # 唤醒
+        },
+    },
+    'shutdown': {
+        'start': 'A',
+        'then': None,
+        'stages': {
+            'A': {'path': r"mod\0000_core\pet\vup\Shutdown\Happy_1"},
+        },
+    },
+}
 
-# 启用软件OpenGL渲染（解决显卡兼容问题）
-QtCore.QCoreApplication.setAttribute(QtCore.Qt.AA_UseSoftwareOpenGL)
+# 状态图动作 -> DeskPet 上对应的菜单方法（用于 then 跳转）
+ACTION_METHODS = {
+    'idle': 'startIdle',
+    'study': 'transform',
+    'work': 'pipi',
+    'exercise': 'exercise',
+    'eat': 'eating',
+    'sleep': 'sleep',
+    'shutdown': 'gracefulExit',
+}
 
 FAVOR_REWARDS = {
     'exercise': 3,    # 完成运动
@@ -21,33 +134,2781 @@ FAVOR_REWARDS = {
     'clone': -10       # 分身消耗好感
 }
 
+# 宠物逻辑区域大小（素材原始画布按比例缩放到该区域内，窗口只覆盖其中的非透明部分）
+PET_SIZE = (1000, 1000)
+# vup.lps 中触摸区域等坐标所在的宠物区域边长
+LPS_AREA = 500
+# 触摸区域按优先级判断（捏脸区域与头部区域有重叠）：(区域名, vup.lps 中的行名)
+TOUCH_REGIONS = (('pinch', 'pinch'), ('head', 'touchhead'), ('body', 'touchbody'))
+
+# 绘制后端：raster（QPainter，默认）/ opengl（纹理）/ auto；opengl 不可用时自动回退 raster
+# OpenGL 纹理上传与绘制还没有在真实GL环境中测过，auto 暂时不选 opengl，需显式指定
+RENDER_BACKEND = os.environ.get('DESKPET_RENDER', 'raster')
+# 群体模式（DESKPET_SWARM=1）：所有宠物画在同一个全屏穿透窗口里，窗口数量不随分身增加
+SWARM_MODE = os.environ.get('DESKPET_SWARM', '0') == '1'
+# 按 vup.lps 的 move: 定义自由移动（DESKPET_MOVE=0 关闭）
+MOVE_ENABLED = os.environ.get('DESKPET_MOVE', '1') == '1'
+
+# [DEBUG] 输出（DESKPET_DEBUG=1 开启）；控制台输出在 Windows 上开销不小，默认关闭
+DEBUG_ENABLED = os.environ.get('DESKPET_DEBUG', '0') == '1'
+# 运行时指标（DESKPET_METRICS=1 开启）；关闭时不接入任何计时逻辑
+METRICS_ENABLED = os.environ.get('DESKPET_METRICS', '0') == '1'
+# 退出时把指标写入该JSON文件（可选）
+METRICS_DUMP = os.environ.get('DESKPET_METRICS_DUMP')
+
+if DEBUG_ENABLED:
+    def debug(message):
+        print(f"[DEBUG] {message}")
+else:
+    def debug(message):
+        pass
+
+# mod 根目录与其清单文件（记录各动画目录的帧，避免每次切换动作都扫描目录）
+MOD_DIR = os.environ.get('DESKPET_MOD_DIR', 'mod')
+MANIFEST_PATH = Path(os.environ.get('DESKPET_MANIFEST', Path.home() / ".deskpet_manifest.json"))
+# 监视 mod 目录，编辑帧文件后运行中的宠物自动换上新帧（供 mod 作者调试用，默认关闭）
+HOT_RELOAD = os.environ.get('DESKPET_HOT_RELOAD', '0') == '1'
+
+# 解码帧缓存 / 缩放合成帧缓存上限（MB），可通过环境变量覆盖
+FRAME_CACHE_MB = int(os.environ.get('DESKPET_FRAME_CACHE_MB', 512))
+SCALED_CACHE_MB = int(os.environ.get('DESKPET_SCALED_CACHE_MB', 256))
+
+
+class FrameCache:
+    """进程级帧缓存（按动画路径或元组键索引，按字节预算LRU淘汰）
+
+    多个动画引用同一帧对象（见 FrameStore）时，该帧只计一次字节数
+    """
+
+    def __init__(self, budget_mb):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> [帧列表, {帧cacheKey: 字节数}]
+        self._refs = {}  # 帧cacheKey -> [引用该帧的条目数, 字节数]
+
+    @staticmethod
+    def normalize(path):
+        """统一路径写法（兼容Windows风格的反斜杠路径）"""
+        return os.path.normcase(os.path.normpath(path.replace('\\', '/')))
+
+    def _key(self, path):
+        return self.normalize(path) if isinstance(path, str) else path
+
+    @staticmethod
+    def frame_bytes(frame):
+        return frame.width() * frame.height() * frame.depth() // 8
+
+    def keys(self):
+        return list(self._entries)
+
+    def contains(self, path):
+        """只判断是否已缓存（不计入命中统计，不刷新LRU顺序）"""
+        return self._key(path) in self._entries
+
+    def peek(self, path):
+        """取帧列表但不计入命中统计、不刷新LRU顺序，未缓存返回None"""
+        entry = self._entries.get(self._key(path))
+        return entry[0] if entry is not None else None
+
+    def get(self, path):
+        """命中时返回帧列表并刷新LRU顺序，未命中返回None"""
+        key = self._key(path)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, path, frames):
+        """登记帧列表（直接持有该列表对象，None 表示尚未填充的帧）"""
+        key = self._key(path)
+        shared = {}
+        for f in frames:
+            if f is not None:
+                shared.setdefault(f.cacheKey(), self.frame_bytes(f))
+        self.discard(path)
+        if sum(shared.values()) > self.budget_bytes:
+            return  # 单个动画超出预算，不缓存
+        for frame_key, nbytes in shared.items():
+            self._ref(frame_key, nbytes)
+        self._entries[key] = [frames, shared]
+        self._evict()
+
+    def add(self, path, frame):
+        """已登记的帧列表被逐帧填充时登记新帧（其他条目已引用的同一帧不重复计数）"""
+        entry = self._entries.get(self._key(path))
+        if entry is None or frame.cacheKey() in entry[1]:
+            return
+        nbytes = self.frame_bytes(frame)
+        entry[1][frame.cacheKey()] = nbytes
+        self._ref(frame.cacheKey(), nbytes)
+        self._evict()
+
+    def _ref(self, frame_key, nbytes):
+        ref = self._refs.setdefault(frame_key, [0, nbytes])
+        if ref[0] == 0:
+            self.total_bytes += nbytes
+        ref[0] += 1
+
+    def discard(self, path):
+        entry = self._entries.pop(self._key(path), None)
+        if entry is not None:
+            self._release(entry)
+
+    def _release(self, entry):
+        for frame_key in entry[1]:
+            ref = self._refs[frame_key]
+            ref[0] -= 1
+            if ref[0] == 0:
+                self.total_bytes -= ref[1]
+                del self._refs[frame_key]
+
+    def set_budget(self, budget_mb):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self._refs.clear()
+        self.total_bytes = 0
+
+    def _evict(self):
+        while self.total_bytes > self.budget_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._release(entry)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'frames': len(self._refs),
+            'bytes': self.total_bytes,
+            'budget_bytes': self.budget_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class FrameStore:
+    """按像素内容去重的帧仓库：内容相同的帧只保留一份QPixmap，动画帧列表引用同一对象
+
+    只持有弱引用，帧的生命周期仍由引用它的动画（缓存）决定
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._frames = weakref.WeakValueDictionary()  # 内容键 -> QPixmap
+
+    @staticmethod
+    def digest(image):
+        """帧内容键（尺寸、格式与像素哈希），可在工作线程中计算"""
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        return (image.width(), image.height(), int(image.format()),
+                hashlib.blake2b(bits, digest_size=16).digest())
+
+    def intern(self, key, image):
+        """返回内容键对应的共享QPixmap，首次出现时由 image 转换得到（须在GUI线程调用）"""
+        pixmap = self._frames.get(key) if key is not None else None
+        if pixmap is not None:
+            self.hits += 1
+            return pixmap
+        self.misses += 1
+        pixmap = QtGui.QPixmap.fromImage(image)
+        if key is not None:
+            self._frames[key] = pixmap
+        return pixmap
+
+    def clear(self):
+        self._frames.clear()
+
+    def stats(self):
+        return {
+            'unique_frames': len(self._frames),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def dedup_report(root):
+    """统计 root 下所有动画按内容去重的效果（帧按运行时方式解码、裁剪后计算）"""
+    seen = {}
+    animations = {}
+    total_frames = total_bytes = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort(key=natural_key)
+        keys = []
+        for name in sorted_frame_files(dirpath):
+            image = QtGui.QImage(os.path.join(dirpath, name))
+            if image.isNull():
+                continue
+            image, _, _ = trim_image(image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied))
+            key = FrameStore.digest(image)
+            nbytes = image.sizeInBytes()
+            seen.setdefault(key, [nbytes, set()])[1].add(dirpath)
+            keys.append(key)
+            total_frames += 1
+            total_bytes += nbytes
+        if keys:
+            animations[os.path.relpath(dirpath, root).replace(os.sep, '/')] = keys
+
+    unique_bytes = sum(nbytes for nbytes, _ in seen.values())
+    per_animation = {}
+    for rel, keys in animations.items():
+        per_animation[rel] = {
+            'frames': len(keys),
+            'unique': len(set(keys)),
+            'shared_with_other_animations': sum(1 for k in set(keys) if len(seen[k][1]) > 1),
+        }
+    return {
+        'root': root,
+        'animations': len(animations),
+        'frames': total_frames,
+        'unique_frames': len(seen),
+        'dedup_ratio': total_frames / len(seen) if seen else 1.0,
+        'bytes': total_bytes,
+        'unique_bytes': unique_bytes,
+        'saved_bytes': total_bytes - unique_bytes,
+        'per_animation': per_animation,
+    }
+
+
+class FrameList(list):
+    """帧列表，附带每帧显示时长（毫秒，0 表示文件名未标注）、
+    裁剪后在原始画布中的偏移、原始画布尺寸、点击遮罩、来源帧引用，以及所有帧的并集包围盒"""
+
+    def __init__(self, frames=(), durations=None, offsets=None, canvas=None, masks=None):
+        super().__init__(frames)
+        self.durations = list(durations) if durations is not None else [0] * len(self)
+        self.offsets = list(offsets) if offsets is not None else [(0, 0)] * len(self)
+        self.masks = list(masks) if masks is not None else [None] * len(self)
+        self.sources = [None] * len(self)
+        self.canvas = canvas
+        self.box = QtCore.QRect()
+        for frame, offset in zip(self, self.offsets):
+            self._grow(frame, offset)
+        if self.canvas is None and len(self):
+            self.canvas = (self[0].width(), self[0].height())
+
+    def add(self, frame, duration, offset=(0, 0), canvas=None, mask=None, source=None):
+        self.append(frame)
+        self.durations.append(duration)
+        self.offsets.append(offset)
+        self.masks.append(mask)
+        self.sources.append(source)
+        if self.canvas is None:
+            self.canvas = canvas or (frame.width(), frame.height())
+        self._grow(frame, offset)
+
+    def mask(self, index):
+        """第 index 帧的点击遮罩；加载时未计算（同步加载的精灵包、备用图像）的在首次使用时计算一次"""
+        mask = self.masks[index]
+        if mask is None:
+            image = self[index].toImage().convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+            mask = self.masks[index] = AlphaMask.fromImage(image)
+        return mask
+
+    def _grow(self, frame, offset):
+        self.box = self.box.united(QtCore.QRect(offset[0], offset[1], frame.width(), frame.height()))
+
+
+def alpha_view(image):
+    """ARGB32 / 预乘格式 QImage 的 alpha 通道 numpy 视图（不复制）"""
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    rows = np.frombuffer(ptr, np.uint8).reshape(image.height(), image.bytesPerLine())
+    channel = 3 if sys.byteorder == 'little' else 0
+    return rows[:, channel:image.width() * 4:4]
+
+
+def alpha_bounds(alpha):
+    """单帧 alpha 数组（H×W）中非透明像素的包围盒 (x, y, w, h)，全透明返回None"""
+    mask = alpha != 0
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+def trim_image(image):
+    """裁掉透明边缘，返回 (裁剪后的QImage, x, y)；没有 numpy 时原样返回"""
+    if np is None:
+        return image, 0, 0
+    box = alpha_bounds(alpha_view(image))
+    if box is None:
+        return image.copy(0, 0, 1, 1), 0, 0
+    x, y, w, h = box
+    if (w, h) == (image.width(), image.height()):
+        return image, 0, 0
+    return image.copy(x, y, w, h), x, y
+
+
+class AlphaMask:
+    """帧的点击遮罩：按 CELL×CELL 像素分块，块内有像素 alpha 超过 THRESHOLD 即可点击，按位压缩保存
+
+    1000×1000 的帧约 8KB；查询只是一次下标运算，不接触像素数据
+    """
+    CELL = 4
+    THRESHOLD = 16  # 阴影、抗锯齿边缘等几乎透明的像素也允许穿透
+    __slots__ = ('width', 'height', 'stride', 'bits')
+
+    def __init__(self, width, height, stride, bits):
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.bits = bits
+
+    @classmethod
+    def fromImage(cls, image):
+        """由预乘格式 QImage 计算遮罩；没有 numpy 时返回 None（整个窗口都可点击）"""
+        if np is None or image.isNull():
+            return None
+        alpha = alpha_view(image) > cls.THRESHOLD
+        cell = cls.CELL
+        h, w = alpha.shape
+        pad_h, pad_w = -h % cell, -w % cell
+        if pad_h or pad_w:
+            alpha = np.pad(alpha, ((0, pad_h), (0, pad_w)))
+        cells = alpha.reshape((h + pad_h) // cell, cell, (w + pad_w) // cell, cell).any(axis=(1, 3))
+        packed = np.packbits(cells, axis=1)
+        return cls(cells.shape[1], cells.shape[0], packed.shape[1], packed.tobytes())
+
+    def contains(self, x, y):
+        """帧像素坐标 (x, y) 处是否可点击"""
+        col = int(x) // self.CELL
+        row = int(y) // self.CELL
+        if x < 0 or y < 0 or col >= self.width or row >= self.height:
+            return False
+        return bool(self.bits[row * self.stride + (col >> 3)] & (0x80 >> (col & 7)))
+
+
+_DURATION_RE = re.compile(r'_(\d+)\.png$', re.IGNORECASE)
+
+
+def frame_duration(filename):
+    """从帧文件名读取显示时长，例如 B_000_125.png -> 125ms；未标注返回0"""
+    match = _DURATION_RE.search(filename)
+    return int(match.group(1)) if match else 0
+
+
+_ASSET_SEPARATOR_RE = re.compile(r'[\\/]+')
+
+
+def asset_key(path, root=MOD_DIR):
+    """动画路径 -> 统一的键：相对 mod 目录、以 / 分隔的小写形式，并去掉 mod 内的 file/ 层级，
+    因此 r"mod\\0000_core\\pet\\vup\\BDay\\B" 与 mod/0000_core/file/pet/vup/BDay/B 得到同一个键；
+    不在 mod 目录下的绝对路径返回 None"""
+    path = str(path)
+    root = os.path.abspath(root)
+    if os.path.isabs(path):
+        try:
+            path = os.path.relpath(path, root)
+        except ValueError:  # Windows 上不在同一驱动器
+            return None
+        if path.startswith('..'):
+            return None
+        parts = _ASSET_SEPARATOR_RE.split(path)
+    else:
+        parts = [p for p in _ASSET_SEPARATOR_RE.split(path) if p and p != '.']
+        if parts and parts[0].lower() == os.path.basename(root).lower():
+            parts = parts[1:]
+    if len(parts) > 1 and parts[1].lower() == 'file':
+        del parts[1]
+    return '/'.join(parts).lower()
+
+
+def natural_key(name):
+    """自然排序键（B_2 排在 B_10 之前）"""
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r'(\d+)', name)]
+
+
+def sorted_frame_files(path):
+    """列出目录中的PNG帧并按帧序排序（os.listdir 本身不保证顺序）"""
+    return sorted((f for f in os.listdir(path) if f.lower().endswith('.png')), key=natural_key)
+
+
+# 精灵包中的一帧：所属包、帧序号、显示时长(ms)、裁剪偏移、原始画布尺寸
+BundleFrame = namedtuple('BundleFrame', 'bundle index duration x y canvas')
+
+
+class SpriteBundle:
+    """预解码精灵包：离线把 mod 目录编译为单个文件，运行时内存映射、零拷贝包装为 QImage
+
+    文件布局（本机字节序）：
+        头部  magic(8s) version(I) flags(I) index_offset(Q) index_size(Q) sha256(32s)
+        像素  每帧 width*height*4 字节，按64字节对齐；帧已裁掉透明边缘，内容相同的帧只存一份
+        索引  UTF-8 JSON：{"frames": [[offset, w, h], ...],
+                          "animations": {相对目录: {"frames": [帧序号...], "durations": [ms...],
+                                                    "offsets": [[x, y]...], "canvas": [W, H],
+                                                    "sources": [[PNG文件名, 字节, 修改时间ns]...]}}}
+
+    每个动画首次用到时对比源目录中PNG的文件名、大小与修改时间，不一致（PNG已修改）时该动画不再从包中读取；
+    源目录不存在（只分发了精灵包）时直接使用。DESKPET_BUNDLE_VERIFY=1 时打开包会校验 sha256
+    """
+    MAGIC = b'PETSPR\x00\x01'
+    VERSION = 4
+    HEADER = struct.Struct('<8sIIQQ32s')
+    FLAG_PREMULTIPLIED = 1
+    FLAG_BIG_ENDIAN = 2
+    ALIGN = 64
+    SUFFIX = '.petbundle'
+
+    def __init__(self, path, root=None):
+        self.path = path
+        self.root = root if root is not None else path[:-len(self.SUFFIX)]
+        with open(path, 'rb') as f:
+            # ACCESS_COPY：私有映射，页面与文件缓存共享，QImage 可直接指向其中
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, flags, index_offset, index_size, digest = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"不支持的精灵包格式（请重新编译）：{path}")
+        if bool(flags & self.FLAG_BIG_ENDIAN) != (sys.byteorder == 'big'):
+            raise ValueError(f"精灵包字节序与本机不一致：{path}")
+        self.flags = flags
+        self.digest = digest.hex()
+        self.format = (QtGui.QImage.Format_ARGB32_Premultiplied if flags & self.FLAG_PREMULTIPLIED
+                       else QtGui.QImage.Format_ARGB32)
+        self._index = (index_offset, index_size)
+        index = json.loads(self._mm[index_offset:index_offset + index_size].decode('utf-8'))
+        self.frames = index['frames']
+        self.animations = {}
+        self._sources = {}  # 键 -> (相对目录, 编译时的源PNG)
+        self._fresh = {}    # 键 -> 是否与源目录一致（首次用到时检查）
+        for rel, entry in index['animations'].items():
+            key = self.key(os.path.join(self.root, rel))
+            self._sources[key] = (rel, {tuple(source) for source in entry['sources']})
+            canvas = tuple(entry['canvas'])
+            self.animations[key] = [BundleFrame(self, i, d, x, y, canvas)
+                                    for i, d, (x, y) in zip(entry['frames'], entry['durations'],
+                                                           entry['offsets'])]
+        self._anchor = ctypes.c_char.from_buffer(self._mm)
+        self._base = ctypes.addressof(self._anchor)
+
+    @staticmethod
+    def key(path):
+        """与 mod 清单相同的动画键（兼容有无 file/ 层级的两种写法），mod 目录以外的包按完整路径"""
+        return asset_key(path) or FrameCache.normalize(path)
+
+    def lookup(self, path):
+        """返回动画目录对应的帧列表（BundleFrame），不在包内或已过期返回None"""
+        key = self.key(path)
+        frames = self.animations.get(key)
+        if frames and not self.isFresh(key):
+            return None
+        return frames
+
+    def isFresh(self, key):
+        fresh = self._fresh.get(key)
+        if fresh is None:
+            rel, sources = self._sources[key]
+            folder = self.root if rel == '.' else os.path.join(self.root, *rel.split('/'))
+            try:
+                current = set()
+                for entry in os.scandir(folder):
+                    if entry.name.lower().endswith('.png') and entry.is_file():
+                        st = entry.stat()
+                        current.add((entry.name, st.st_size, st.st_mtime_ns))
+            except OSError:
+                current = sources
+            fresh = self._fresh[key] = current == sources
+            if not fresh:
+                print(f"[WARNING] 精灵包中的动画已过期，改为读取PNG（请重新编译精灵包）：{folder}")
+        return fresh
+
+    def invalidate(self, path):
+        """源目录有变化：该动画下次用到时重新检查"""
+        self._fresh.pop(self.key(path), None)
+
+    def verify(self):
+        """按编译时的顺序重算像素与索引的 sha256，与头部记录比较"""
+        digest = hashlib.sha256()
+        for offset, width, height in self.frames:
+            digest.update(self._mm[offset:offset + width * height * 4])
+        index_offset, index_size = self._index
+        digest.update(self._mm[index_offset:index_offset + index_size])
+        return digest.hexdigest() == self.digest
+
+    def image(self, index):
+        """零拷贝：返回直接指向映射内存的 QImage"""
+        offset, width, height = self.frames[index]
+        return QtGui.QImage(sip.voidptr(self._base + offset), width, height, width * 4, self.format)
+
+    @classmethod
+    def compile(cls, root, out_path=None, premultiply=True):
+        """把 root 下所有含PNG的目录编译为一个精灵包，返回统计信息"""
+        out_path = out_path or root.rstrip('/\\') + cls.SUFFIX
+        fmt = QtGui.QImage.Format_ARGB32_Premultiplied if premultiply else QtGui.QImage.Format_ARGB32
+        frames = []
+        stored = {}  # 内容键 -> 帧序号
+        references = 0
+        animations = {}
+        digest = hashlib.sha256()
+        tmp_path = out_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\0' * cls.HEADER.size)
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort(key=natural_key)
+                names = sorted((n for n in filenames if n.lower().endswith('.png')), key=natural_key)
+                indices = []
+                durations = []
+                offsets = []
+                sources = []
+                canvas = None
+                for name in names:
+                    st = os.stat(os.path.join(dirpath, name))
+                    sources.append([name, st.st_size, st.st_mtime_ns])
+                    image = QtGui.QImage(os.path.join(dirpath, name))
+                    if image.isNull():
+                        print(f"[WARNING] 加载失败：{os.path.join(dirpath, name)}")
+                        continue
+                    canvas = canvas or [image.width(), image.height()]
+                    # 逐帧裁剪，不同动画中内容相同的帧裁剪结果一致，可按内容去重
+                    image, x, y = trim_image(image.convertToFormat(fmt))
+                    key = FrameStore.digest(image)
+                    if key not in stored:
+                        data = image.constBits().asstring(image.sizeInBytes())
+                        f.write(b'\0' * (-f.tell() % cls.ALIGN))
+                        stored[key] = len(frames)
+                        frames.append([f.tell(), image.width(), image.height()])
+                        f.write(data)
+                        digest.update(data)
+                    indices.append(stored[key])
+                    durations.append(frame_duration(name))
+                    offsets.append([x, y])
+                if not indices:
+                    continue
+                references += len(indices)
+                rel = os.path.relpath(dirpath, root).replace(os.sep, '/')
+                animations[rel] = {'frames': indices, 'durations': durations,
+                                   'offsets': offsets, 'canvas': canvas, 'sources': sources}
+
+            index = json.dumps({'frames': frames, 'animations': animations},
+                               ensure_ascii=False).encode('utf-8')
+            index_offset = f.tell()
+            f.write(index)
+            digest.update(index)
+            flags = (cls.FLAG_PREMULTIPLIED if premultiply else 0) | \
+                    (cls.FLAG_BIG_ENDIAN if sys.byteorder == 'big' else 0)
+            f.seek(0)
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, flags, index_offset, len(index),
+                                    digest.digest()))
+        os.replace(tmp_path, out_path)
+        return {
+            'bundle': out_path,
+            'animations': len(animations),
+            'frames': references,
+            'unique_frames': len(frames),
+            'bytes': os.path.getsize(out_path),
+            'sha256': digest.hexdigest(),
+        }
+
+
+class BundleRegistry:
+    """已加载的精灵包（首次查询时扫描 mod 目录下的 *.petbundle）
+
+    设置环境变量 DESKPET_BUNDLES=0 可禁用，始终走PNG解码路径
+    """
+
+    def __init__(self, mod_dir=MOD_DIR):
+        self.mod_dir = mod_dir
+        self.enabled = os.environ.get('DESKPET_BUNDLES', '1') != '0'
+        self.verify = os.environ.get('DESKPET_BUNDLE_VERIFY', '0') == '1'
+        self.bundles = None
+
+    def add(self, bundle):
+        if self.bundles is None:
+            self.bundles = []
+        self.bundles.append(bundle)
+
+    def scan(self):
+        self.bundles = []
+        if not os.path.isdir(self.mod_dir):
+            return
+        for name in sorted(os.listdir(self.mod_dir)):
+            if not name.endswith(SpriteBundle.SUFFIX):
+                continue
+            try:
+                bundle = SpriteBundle(os.path.join(self.mod_dir, name))
+                if self.verify and not bundle.verify():
+                    raise ValueError("sha256 校验失败（文件已损坏，请重新编译）")
+                self.bundles.append(bundle)
+                debug(f"已映射精灵包：{name}")
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] 精灵包加载失败：{name} ({e})")
+
+    def lookup(self, path):
+        if not self.enabled:
+            return None
+        if self.bundles is None:
+            self.scan()
+        for bundle in self.bundles:
+            frames = bundle.lookup(path)
+            if frames:
+                return frames
+        return None
+
+    def invalidate(self, path):
+        for bundle in self.bundles or ():
+            bundle.invalidate(path)
+
+
+SPRITE_BUNDLES = BundleRegistry()
+
+
+# 压缩包中的一帧：所属来源、成员名
+AssetFrame = namedtuple('AssetFrame', 'source name')
+
+
+def frame_name(frame):
+    """帧引用（文件路径或 AssetFrame）的文件名部分，用于读取帧时长"""
+    return frame.name if isinstance(frame, AssetFrame) else frame
+
+
+def load_frame_image(frame):
+    """按帧引用读取 QImage：文件路径直接由 Qt 读取，AssetFrame 从所属来源读取"""
+    if isinstance(frame, AssetFrame):
+        return frame.source.image(frame.name)
+    return QtGui.QImage(frame)
+
+
+class DirectorySource:
+    """目录中的PNG帧（帧引用即文件路径）"""
+
+    def listFrames(self, path):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(path)
+        return [os.path.join(path, f) for f in sorted_frame_files(path)]
+
+
+class ZipSource:
+    """zip 压缩包（.zlps）中的PNG帧
+
+    打开时只读一次中央目录，建立 目录 -> 成员 索引；帧按需随机读取单个成员并在内存中解码，
+    不解压到磁盘，也不读取未播放的动画
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # ZipFile 在各线程间共享同一个文件句柄，内部加锁按偏移读取，可在解码线程中并发使用
+        self.zip = zipfile.ZipFile(path)
+        self.index = {}
+        for info in self.zip.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.png'):
+                continue
+            folder, _, name = info.filename.rpartition('/')
+            self.index.setdefault(folder, []).append(info.filename)
+        for members in self.index.values():
+            members.sort(key=lambda member: natural_key(member.rpartition('/')[2]))
+        self.reads = 0
+        self.bytesRead = 0
+        self._lock = threading.Lock()
+
+    def listFrames(self, inner):
+        members = self.index.get(inner.replace('\\', '/').strip('/'))
+        if members is None:
+            raise FileNotFoundError(f"{self.path}: {inner}")
+        return [AssetFrame(self, member) for member in members]
+
+    def read(self, name):
+        data = self.zip.read(name)
+        with self._lock:
+            self.reads += 1
+            self.bytesRead += len(data)
+        return data
+
+    def image(self, name):
+        return QtGui.QImage.fromData(self.read(name), 'PNG')
+
+    def stats(self):
+        return {
+            'members': sum(len(members) for members in self.index.values()),
+            'folders': len(self.index),
+            'reads': self.reads,
+            'bytes_read': self.bytesRead,
+        }
+
+
+class AssetSources:
+    """按动画路径选择帧来源：路径中某一级是 .zlps / .zip 文件时从压缩包读取，否则按目录读取
+
+    例如 mod/0000_core/file/expression.zlps/NO.1 表示压缩包中的 NO.1 目录；压缩包在首次用到时打开并建立索引
+    """
+    ARCHIVE_SUFFIXES = ('.zlps', '.zip')
+    _SEPARATOR_RE = re.compile(r'[\\/]')
+
+    def __init__(self):
+        self.directory = DirectorySource()
+        self.archives = {}
+        self._lock = threading.Lock()
+
+    def archive(self, path):
+        with self._lock:
+            source = self.archives.get(path)
+            if source is None:
+                source = self.archives[path] = ZipSource(path)
+                debug(f"已索引压缩包：{path}（{source.stats()['members']} 帧）")
+            return source
+
+    def resolve(self, path):
+        """(来源, 来源内路径)"""
+        lowered = path.lower()
+        if any(suffix in lowered for suffix in self.ARCHIVE_SUFFIXES):
+            for match in self._SEPARATOR_RE.finditer(path + '/'):
+                prefix = path[:match.start()]
+                if prefix.lower().endswith(self.ARCHIVE_SUFFIXES) and os.path.isfile(prefix):
+                    return self.archive(prefix), path[match.end():]
+        return self.directory, path
+
+    def listFrames(self, path):
+        """按帧序列出动画的帧引用；动画不存在时抛出 FileNotFoundError"""
+        source, inner = self.resolve(path)
+        return source.listFrames(inner)
+
+
+ASSET_SOURCES = AssetSources()
+
+
+class ModManifest:
+    """mod 目录的清单：一次扫描记录每个动画目录的帧（文件名、时长、尺寸、大小）与子目录，保存到磁盘
+
+    启动时只对每个目录 stat 一次，修改时间变了的目录才重新扫描；之后按动画路径取帧不再访问文件系统。
+    动画路径统一为相对 mod 目录、以 / 分隔的小写形式，并去掉 mod 内的 file/ 层级，
+    因此 r"mod\\0000_core\\pet\\vup\\BDay\\B" 与 mod/0000_core/file/pet/vup/BDay/B 指向同一个动画。
+    只改写文件内容而不增删文件不会改变目录修改时间，这种情况需要删除清单文件重新扫描
+    （或开启热重载，由 ModWatcher 按文件变化调用 update）
+    """
+    VERSION = 2
+    MOODS = ('happy', 'nomal', 'poorcondition', 'ill')
+
+    def __init__(self, root=MOD_DIR, path=MANIFEST_PATH):
+        self.root = os.path.abspath(root)
+        self.path = Path(path)
+        self.dirs = None      # 相对目录 -> {'mtime': ns, 'subdirs': [...], 'frames': [[文件名, 时长, 宽, 高, 字节, 修改时间], ...]}
+        self.paths = {}       # 动画路径 -> 相对目录
+        self.variants = {}    # 动画名 -> [(心情, 阶段, 动画路径), ...]
+        self._files = {}
+        self.rescanned = 0
+
+    def normalize(self, path):
+        """动画路径 -> 清单中的键"""
+        return asset_key(path, self.root)
+
+    @classmethod
+    def describe(cls, key):
+        """从动画路径推断 (动画名, 心情, 阶段)：如 pet/vup/work/study/b_1_nomal -> ('work.study', 'nomal', 'B')"""
+        parts = key.split('/')
+        if 'pet' in parts and parts.index('pet') + 2 <= len(parts):
+            parts = parts[parts.index('pet') + 2:]
+        mood = stage = None
+        names = []
+        for i, part in enumerate(parts):
+            tokens = part.split('_')
+            rest = []
+            for j, token in enumerate(tokens):
+                if token in cls.MOODS and mood is None:
+                    mood = token
+                elif i == len(parts) - 1 and j == 0 and token in ('a', 'b', 'c'):
+                    stage = token.upper()
+                elif not token.isdigit():
+                    rest.append(token)
+            if rest:
+                names.append('_'.join(rest))
+        return '.'.join(names), mood, stage
+
+    def ensure(self):
+        if self.dirs is None:
+            self.refresh()
+
+    def refresh(self):
+        """校验并更新清单：未变化的目录沿用记录，变化的目录重新扫描，结束后有变化才写盘"""
+        stored = self._read()
+        self.dirs = {}
+        self.rescanned = 0
+        if os.path.isdir(self.root):
+            self._visit('', stored)
+        self._index()
+        if self.rescanned or len(self.dirs) != len(stored):
+            self.save()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] mod 清单无法读取，将重新扫描：{self.path} ({e})")
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return {}
+        return data.get('roots', {}).get(self.root, {})
+
+    def save(self):
+        data = {'version': self.VERSION, 'roots': {}}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                old = json.load(f)
+            if isinstance(old, dict) and old.get('version') == self.VERSION:
+                data['roots'] = old.get('roots', {})
+        except (OSError, ValueError):
+            pass
+        data['roots'][self.root] = self.dirs
+        try:
+            atomic_write(self.path, json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        except OSError as e:
+            print(f"[WARNING] 无法保存 mod 清单：{self.path} ({e})")
+
+    def _visit(self, rel, stored):
+        full = self._folder(rel)
+        try:
+            mtime = os.stat(full).st_mtime_ns
+        except OSError:
+            return
+        entry = stored.get(rel)
+        if entry is None or entry.get('mtime') != mtime:
+            entry = self._scan(full, mtime)
+            self.rescanned += 1
+        self.dirs[rel] = entry
+        for name in entry['subdirs']:
+            self._visit(f'{rel}/{name}' if rel else name, stored)
+
+    @staticmethod
+    def _png_size(path):
+        """读取PNG文件头中的宽高，无法识别时返回 (0, 0)"""
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(24)
+        except OSError:
+            return 0, 0
+        if len(head) < 24 or not head.startswith(b'\x89PNG\r\n\x1a\n') or head[12:16] != b'IHDR':
+            return 0, 0
+        return struct.unpack('>II', head[16:24])
+
+    def _scan(self, full, mtime):
+        subdirs = []
+        frames = []
+        try:
+            entries = list(os.scandir(full))
+        except OSError:
+            entries = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.name.lower().endswith('.png'):
+                    width, height = self._png_size(entry.path)
+                    st = entry.stat()
+                    frames.append([entry.name, frame_duration(entry.name), width, height, st.st_size, st.st_mtime_ns])
+            except OSError:
+                continue
+        subdirs.sort(key=natural_key)
+        frames.sort(key=lambda frame: natural_key(frame[0]))
+        return {'mtime': mtime, 'subdirs': subdirs, 'frames': frames}
+
+    def update(self, folders):
+        """重新扫描给定目录（完整路径）并写盘，返回 {动画路径: 内容变化或新增的帧文件路径集合}
+
+        消失的目录连同子目录一起移出清单，新出现的子目录整棵扫描；只删除了帧的动画对应空集合
+        """
+        self.ensure()
+        changes = {}
+        for full in folders:
+            rel = os.path.relpath(full, self.root)
+            if rel.startswith('..'):
+                continue
+            rel = '' if rel == '.' else rel.replace(os.sep, '/')
+            if not os.path.isdir(full):
+                self._drop(rel, changes)
+                continue
+            old = self.dirs.get(rel)
+            try:
+                entry = self._scan(full, os.stat(full).st_mtime_ns)
+            except OSError:
+                continue
+            self.dirs[rel] = entry
+            before = {frame[0]: frame for frame in old['frames']} if old is not None else {}
+            changed = {os.path.join(full, frame[0]) for frame in entry['frames'] if before.get(frame[0]) != frame}
+            if changed or len(before) != len(entry['frames']):
+                changes[self.normalize(rel)] = changed
+            known = old['subdirs'] if old is not None else []
+            for name in known:
+                if name not in entry['subdirs']:
+                    self._drop(f'{rel}/{name}' if rel else name, changes)
+            for name in entry['subdirs']:
+                child = f'{rel}/{name}' if rel else name
+                if child in self.dirs:
+                    continue
+                added = set(self.dirs)
+                self._visit(child, {})
+                for sub in self.dirs.keys() - added:
+                    if self.dirs[sub]['frames']:
+                        changes[self.normalize(sub)] = set(self._framePaths(sub))
+        self._index()
+        self.save()
+        return changes
+
+    def _drop(self, rel, changes):
+        """目录已删除：连同子目录移出清单"""
+        for gone in [r for r in self.dirs if not rel or r == rel or r.startswith(rel + '/')]:
+            if self.dirs.pop(gone)['frames']:
+                changes[self.normalize(gone)] = set()
+
+    def watchPaths(self):
+        """热重载需要监视的 (目录, 帧文件) 完整路径：目录变化发现增删，文件变化发现原地改写"""
+        self.ensure()
+        folders = []
+        files = []
+        for rel in self.dirs:
+            folders.append(self._folder(rel))
+            files.extend(self._framePaths(rel))
+        return folders, files
+
+    def _folder(self, rel):
+        return os.path.join(self.root, *rel.split('/')) if rel else self.root
+
+    def _framePaths(self, rel):
+        folder = self._folder(rel)
+        return [os.path.join(folder, frame[0]) for frame in self.dirs[rel]['frames']]
+
+    def _index(self):
+        self.paths = {}
+        self.variants = {}
+        self._files = {}
+        for rel, entry in self.dirs.items():
+            if entry['frames']:
+                key = self.normalize(rel)
+                self.paths[key] = rel
+                name, mood, stage = self.describe(key)
+                self.variants.setdefault(name, []).append((mood, stage, key))
+
+    def entry(self, path):
+        """动画目录的清单记录；不在清单中时返回 None"""
+        self.ensure()
+        key = self.normalize(path)
+        rel = self.paths.get(key) if key is not None else None
+        return self.dirs[rel] if rel is not None else None
+
+    def frames(self, path):
+        """按帧序的帧文件路径；不在清单中时返回 None（调用方回退到直接读取目录）"""
+        self.ensure()
+        key = self.normalize(path)
+        rel = self.paths.get(key) if key is not None else None
+        if rel is None:
+            return None
+        files = self._files.get(rel)
+        if files is None:
+            files = self._files[rel] = self._framePaths(rel)
+        return files
+
+    def stats(self):
+        self.ensure()
+        return {
+            'dirs': len(self.dirs),
+            'animations': len(self.paths),
+            'frames': sum(len(entry['frames']) for entry in self.dirs.values()),
+            'bytes': sum(frame[4] for entry in self.dirs.values() for frame in entry['frames']),
+            'rescanned': self.rescanned,
+        }
+
+
+MOD_MANIFEST = ModManifest()
+
+
+# 所有DeskPet实例共享同一份帧缓存
+FRAME_CACHE = FrameCache(FRAME_CACHE_MB)
+FRAME_STORE = FrameStore()
+# 按 (动画, 窗口尺寸, DPR) 缓存缩放并居中合成后的帧，定时器每帧只需直接贴图
+SCALED_CACHE = FrameCache(SCALED_CACHE_MB)
+# (原帧cacheKey, 缩放比例, DPR) -> 缩放帧：多个动画共用的帧只缩放一次、在缩放缓存中只计一次
+SCALED_FRAMES = weakref.WeakValueDictionary()
+
+
+class Histogram:
+    """固定桶的毫秒直方图（记录一次只做一次二分查找）"""
+    BOUNDS = (1, 2, 4, 8, 16, 33, 50, 100, 250, 1000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, pct):
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100
+        seen = 0
+        for bound, n in zip(self.BOUNDS + (self.max,), self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        labels = [f"<={b}" for b in self.BOUNDS] + [f">{self.BOUNDS[-1]}"]
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class PetMetrics:
+    """单个宠物的运行时指标：帧耗时、帧延迟、迟到/丢帧、各动画加载耗时
+
+    只在 METRICS_ENABLED 时创建；未创建时调度器与宠物不做任何计时
+    """
+    LATE_MS = 8  # 定时器晚于截止时间超过该值记为迟到帧
+
+    def __init__(self, pet):
+        self.pet = pet
+        self.frameTime = Histogram()  # 每次 updateAnimation 的耗时
+        self.frameLag = Histogram()   # 定时器触发时间相对截止时间的延迟
+        self.lateFrames = 0
+        self.loads = {}  # 动画 -> {'count', 'cache_hits', 'last_ms', 'max_ms', 'total_ms'}
+        self._loading = {}
+
+    def frameLate(self, lag):
+        self.frameLag.add(lag)
+        if lag > self.LATE_MS:
+            self.lateFrames += 1
+
+    def loadStarted(self, key, cached):
+        entry = self.loads.setdefault(key, {'count': 0, 'cache_hits': 0, 'last_ms': 0.0,
+                                            'max_ms': 0.0, 'total_ms': 0.0})
+        entry['count'] += 1
+        if cached:
+            entry['cache_hits'] += 1
+        else:
+            self._loading[key] = time.perf_counter()
+
+    def loadFinished(self, key):
+        start = self._loading.pop(key, None)
+        if start is None:
+            return
+        ms = (time.perf_counter() - start) * 1000
+        entry = self.loads[key]
+        entry['last_ms'] = ms
+        entry['max_ms'] = max(entry['max_ms'], ms)
+        entry['total_ms'] += ms
+
+    @staticmethod
+    def threadStats():
+        """线程数（按需统计，遍历对象开销较大，不在热路径调用）"""
+        pool = FrameLoader.decodePool()
+        qthreads = [o for o in gc.get_objects() if isinstance(o, QThread)]
+        return {
+            'python_threads': threading.active_count(),
+            'decode_pool_active': pool.activeThreadCount(),
+            'decode_pool_max': pool.maxThreadCount(),
+            'qthreads': len(qthreads),
+            'qthreads_running': sum(1 for t in qthreads if t.isRunning()),
+        }
+
+    def snapshot(self):
+        return {
+            'frame_time': self.frameTime.to_dict(),
+            'frame_lag': self.frameLag.to_dict(),
+            'late_frames': self.lateFrames,
+            'dropped_frames': self.pet.scheduler.skippedFrames,
+            'loads': self.loads,
+            'frame_cache': FRAME_CACHE.stats(),
+            'scaled_cache': SCALED_CACHE.stats(),
+            'frame_store': FRAME_STORE.stats(),
+            'clock': AnimationClock.instance().stats(),
+            'threads': self.threadStats(),
+        }
+
+    def summary(self):
+        """叠加层显示的简短文本"""
+        frame = self.frameTime
+        return (f"帧耗时 p50 {frame.percentile(50):.1f}ms p95 {frame.percentile(95):.1f}ms "
+                f"max {frame.max:.1f}ms\n"
+                f"迟到 {self.lateFrames}  丢帧 {self.pet.scheduler.skippedFrames}\n"
+                f"帧缓存 {FRAME_CACHE.total_bytes / 2 ** 20:.0f}MB  "
+                f"缩放缓存 {SCALED_CACHE.total_bytes / 2 ** 20:.0f}MB\n"
+                f"解码线程 {FrameLoader.decodePool().activeThreadCount()}")
+
+
+class MetricsOverlay(QtWidgets.QLabel):
+    """跟随宠物的指标叠加层（半透明小窗，每半秒刷新）"""
+
+    def __init__(self, pet):
+        super().__init__()
+        self.pet = pet
+        self.setWindowFlags(QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint |
+                            QtCore.Qt.Tool | QtCore.Qt.WindowTransparentForInput)
+        self.setStyleSheet("background-color: rgba(0,0,0,160); color: #7CFC00;"
+                           "font: 11px Consolas; padding: 4px;")
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(500)
+        self.refresh()
+
+    def refresh(self):
+        self.setText(self.pet.metrics.summary())
+        self.adjustSize()
+        self.move(self.pet.x(), max(0, self.pet.y() - self.height()))
+
+
+class _LoaderSignals(QtCore.QObject):
+    """工作线程 -> GUI线程 的信号通道"""
+    listed = pyqtSignal(int, list)
+    decoded = pyqtSignal(int, int, QtGui.QImage, object)  # token, 帧序号, 帧, (x, y, 画布尺寸, 内容键, 点击遮罩)
+    failed = pyqtSignal(int, str)
+
+
+class _ListTask(QtCore.QRunnable):
+    """后台列出动画目录（或压缩包中的目录）中的PNG帧"""
+
+    def __init__(self, signals, token, path, cancelled):
+        super().__init__()
+        self.signals = signals
+        self.token = token
+        self.path = path
+        self.cancelled = cancelled
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        try:
+            files = ASSET_SOURCES.listFrames(self.path)
+        except FileNotFoundError:
+            self.signals.failed.emit(self.token, f"目录不存在：\n{self.path}")
+            return
+        except (OSError, zipfile.BadZipFile) as e:
+            self.signals.failed.emit(self.token, f"发生异常：\n{str(e)}")
+            return
+        if not files:
+            self.signals.failed.emit(self.token, "目录中没有PNG文件")
+            return
+        self.signals.listed.emit(self.token, files)
+
+
+class _DecodeTask(QtCore.QRunnable):
+    """后台解码单帧为QImage（预乘格式并裁掉透明边缘，GUI线程转QPixmap时无需再转换），
+    同时计算去重用的内容键"""
+
+    def __init__(self, signals, token, index, file, cancelled):
+        super().__init__()
+        self.signals = signals
+        self.token = token
+        self.index = index
+        self.file = file
+        self.cancelled = cancelled
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        if isinstance(self.file, BundleFrame):
+            # 精灵包：无需解码，编译时已裁剪并去重，帧序号即内容键
+            image = self.file.bundle.image(self.file.index)
+            placement = (self.file.x, self.file.y, self.file.canvas,
+                         (self.file.bundle.path, self.file.index), None)
+        else:
+            image = load_frame_image(self.file)
+            placement = (0, 0, (image.width(), image.height()), None, None)
+        if not image.isNull():
+            image = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+            if not isinstance(self.file, BundleFrame):
+                image, x, y = trim_image(image)
+                placement = (x, y, placement[2], FrameStore.digest(image), None)
+            placement = placement[:4] + (AlphaMask.fromImage(image),)
+        else:
+            print(f"[WARNING] 加载失败：{frame_name(self.file)}")
+        if not self.cancelled.is_set():
+            self.signals.decoded.emit(self.token, self.index, image, placement)
+
+
+class FrameLoader(QtCore.QObject):
+    """后台帧加载器：线程池并行解码，按帧序交付到GUI线程"""
+    frameReady = pyqtSignal(int, QtGui.QPixmap, int)  # 帧序号, 帧, 时长(ms)
+    loaded = pyqtSignal(str, object)                  # 路径, 全部帧(FrameList)
+    failed = pyqtSignal(str, str)                # 路径, 错误信息
+
+    _pool = None
+
+    @classmethod
+    def decodePool(cls):
+        """所有加载器共享的解码线程池
+
+        不使用 QThreadPool.globalInstance()：Qt 内部的大图格式转换会占用全局线程池并同步等待，
+        若全局线程被等待GIL的解码任务占满会互相卡死
+        """
+        if cls._pool is None:
+            cls._pool = QtCore.QThreadPool()
+            cls._pool.setMaxThreadCount(max(2, QtCore.QThread.idealThreadCount() - 1))
+        return cls._pool
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = self.decodePool()
+        self._signals = _LoaderSignals(self)
+        self._signals.listed.connect(self._onListed)
+        self._signals.decoded.connect(self._onDecoded)
+        self._signals.failed.connect(self._onFailed)
+        self._token = 0
+        self._cancelled = None
+        self._path = None
+        self._slots = []
+        self._durations = []
+        self._files = []
+        self._reuse = {}
+        self.frames = FrameList()
+        self._next = 0
+
+    def load(self, path, reuse=None):
+        """开始加载（会取消尚未完成的上一次加载）
+
+        reuse 为 {帧引用: (帧, 偏移, 画布尺寸, 点击遮罩)}，列出的帧直接沿用，不再解码（热重载时只解码改动的帧）
+        """
+        self.cancel()
+        self._token += 1
+        self._cancelled = threading.Event()
+        self._path = path
+        self._slots = []
+        self._durations = []
+        self._files = []
+        self._reuse = reuse or {}
+        self.frames = FrameList()
+        self._next = 0
+        bundled = SPRITE_BUNDLES.lookup(path)
+        if bundled:
+            self._onListed(self._token, bundled)  # 精灵包索引已含帧序与时长，无需扫描目录
+            return
+        files = MOD_MANIFEST.frames(path)
+        if files:
+            self._onListed(self._token, files)  # mod 清单中已有帧序，无需扫描目录
+            return
+        self.pool.start(_ListTask(self._signals, self._token, path, self._cancelled), 1 << 20)
+
+    def cancel(self):
+        if self._cancelled is not None:
+            self._cancelled.set()
+        self._cancelled = None
+        self._slots = []
+
+    def isLoading(self):
+        return self._cancelled is not None
+
+    def _isCurrent(self, token):
+        return token == self._token and self._cancelled is not None
+
+    def _onListed(self, token, files):
+        if not self._isCurrent(token):
+            return
+        self._slots = [None] * len(files)
+        self._files = files
+        self._durations = [f.duration if isinstance(f, BundleFrame) else frame_duration(frame_name(f))
+                           for f in files]
+        for index, file in enumerate(files):
+            kept = self._reuse.get(file)
+            if kept is not None:
+                pixmap, (x, y), canvas, mask = kept
+                self._slots[index] = (pixmap, (x, y, canvas, None, mask))
+                continue
+            # 靠前的帧优先解码，首帧就绪即可开始播放
+            task = _DecodeTask(self._signals, token, index, file, self._cancelled)
+            self.pool.start(task, len(files) - index)
+        if self._reuse:
+            self._deliver(token)
+
+    def _onDecoded(self, token, index, image, placement):
+        if not self._isCurrent(token):
+            return
+        self._slots[index] = (image, placement)
+        self._deliver(token)
+
+    def _deliver(self, token):
+        # 按顺序交付连续就绪的帧
+        while self._next < len(self._slots) and self._slots[self._next] is not None:
+            image, (x, y, canvas, key, mask) = self._slots[self._next]
+            self._slots[self._next] = True
+            self._next += 1
+            if image.isNull():
+                continue
+            # 沿用的旧帧已是 QPixmap
+            pixmap = image if isinstance(image, QtGui.QPixmap) else FRAME_STORE.intern(key, image)
+            duration = self._durations[self._next - 1]
+            self.frames.add(pixmap, duration, (x, y), canvas, mask, self._files[self._next - 1])
+            self.frameReady.emit(len(self.frames) - 1, pixmap, duration)
+            if not self._isCurrent(token):
+                return  # 回调中发起了新的加载
+
+        if self._next == len(self._slots):
+            path, frames = self._path, self.frames
+            self._cancelled = None
+            if frames:
+                FRAME_CACHE.put(path, frames)
+                self.loaded.emit(path, frames)
+            else:
+                self.failed.emit(path, "所有PNG文件加载失败")
+
+    def _onFailed(self, token, message):
+        if not self._isCurrent(token):
+            return
+        path = self._path
+        self._cancelled = None
+        self.failed.emit(path, message)
+
+
+class AnimationClock(QtCore.QObject):
+    """全局动画时钟：所有宠物（含分身）的帧调度共用一个定时器
+
+    每次唤醒推进所有到期的调度器（它们的重绘请求在同一轮事件循环中合并绘制），
+    没有到期的调度器不会被调用；截止时间相差不到 SLACK_MS 的调度器合并到同一次唤醒。
+    窗口移动也经由时钟合并：每个窗口只记录最新目标位置，唤醒结束时统一 move 一次；
+    唤醒之外的移动（拖动）最多延迟 MOVE_FLUSH_MS 合并提交
+    """
+    SLACK_MS = 4
+    MOVE_FLUSH_MS = 16
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self._onTimeout)
+        self.clock = QtCore.QElapsedTimer()
+        self.clock.start()
+        self.deadlines = {}  # 调度器 -> 下一帧截止时间（ms，时钟启动起算）
+        self.pendingMoves = {}  # 窗口 -> 目标位置
+        self.wakeups = 0
+        self.advanced = 0
+        self.moveRequests = 0
+        self.movesApplied = 0
+        self._dispatching = False
+        self._moveTimer = QtCore.QTimer(self)
+        self._moveTimer.setSingleShot(True)
+        self._moveTimer.setTimerType(QtCore.Qt.PreciseTimer)
+        self._moveTimer.timeout.connect(self.flushMoves)
+
+    def now(self):
+        return self.clock.elapsed()
+
+    def schedule(self, scheduler, deadline):
+        self.deadlines[scheduler] = deadline
+        if not self._dispatching:
+            self._arm()
+
+    def cancel(self, scheduler):
+        if self.deadlines.pop(scheduler, None) is not None and not self.deadlines:
+            self.timer.stop()
+
+    def moveWidget(self, widget, pos):
+        """请求把 widget 移到 pos（父控件坐标），同一窗口的多次请求只保留最后一次"""
+        self.pendingMoves[widget] = QtCore.QPoint(pos)
+        self.moveRequests += 1
+        if not self._dispatching and not self._moveTimer.isActive():
+            self._moveTimer.start(self.MOVE_FLUSH_MS)
+
+    def pendingPos(self, widget):
+        """widget 尚未提交的目标位置，没有时返回 None"""
+        return self.pendingMoves.get(widget)
+
+    def cancelMove(self, widget):
+        self.pendingMoves.pop(widget, None)
+
+    def flushMoves(self):
+        self._moveTimer.stop()
+        moves, self.pendingMoves = self.pendingMoves, {}
+        for widget, pos in moves.items():
+            if not sip.isdeleted(widget) and widget.pos() != pos:
+                widget.move(pos)
+                self.movesApplied += 1
+
+    def _arm(self):
+        if not self.deadlines:
+            self.timer.stop()
+            return
+        wait = max(0, min(self.deadlines.values()) - self.now())
+        if not self.timer.isActive() or wait < self.timer.remainingTime():
+            self.timer.start(wait)
+
+    def _onTimeout(self):
+        now = self.now()
+        horizon = now + self.SLACK_MS
+        due = [s for s, deadline in self.deadlines.items() if deadline <= horizon]
+        self.wakeups += 1
+        self._dispatching = True
+        try:
+            for scheduler in due:
+                # 前面的回调可能已停止或重新调度了它
+                deadline = self.deadlines.get(scheduler)
+                if deadline is None or deadline > horizon:
+                    continue
+                del self.deadlines[scheduler]
+                if sip.isdeleted(scheduler):
+                    continue
+                self.advanced += 1
+                scheduler._onTick(now, horizon)
+        finally:
+            self._dispatching = False
+        if self.pendingMoves:
+            self.flushMoves()
+        self.timer.stop()
+        self._arm()
+
+    def stats(self):
+        return {
+            'schedulers': len(self.deadlines),
+            'wakeups': self.wakeups,
+            'advanced': self.advanced,
+            'move_requests': self.moveRequests,
+            'moves_applied': self.movesApplied,
+        }
+
+
+class FrameScheduler(QtCore.QObject):
+    """按绝对截止时间推进帧：读取每帧时长，漂移自动补偿，落后时跳帧（由全局 AnimationClock 唤醒）"""
+    frameChanged = pyqtSignal(int)   # 当前应显示的帧序号
+    sequenceFinished = pyqtSignal()  # 播放完一遍（循环模式每遍触发一次）
+
+    MAX_LAG_MS = 1000  # 落后超过该值（如系统休眠）时直接重新对齐，不再逐帧追赶
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.clock = AnimationClock.instance()
+        self.durations = []
+        self.complete = True
+        self.loop = True
+        self.index = 0
+        self.deadline = 0
+        self.active = False
+        self.waiting = False
+        self.skippedFrames = 0
+        self.metrics = None  # PetMetrics，开启指标时由宠物设置
+        self._generation = 0
+
+    def start(self, durations, complete=True, loop=True):
+        """从第0帧开始播放；durations 可在加载过程中继续增长"""
+        self._generation += 1
+        self.durations = durations
+        self.complete = complete
+        self.loop = loop
+        self.index = 0
+        self.active = True
+        self.waiting = False
+        self.deadline = self.clock.now() + self._duration(0)
+        self.frameChanged.emit(0)
+        self._schedule()
+
+    def stop(self):
+        self._generation += 1
+        self.active = False
+        self.waiting = False
+        self.clock.cancel(self)
+
+    def isActive(self):
+        return self.active
+
+    def notifyFrames(self, complete):
+        """后台加载交付了新帧；若之前因缺帧停住则从现在起继续"""
+        self.complete = complete
+        if self.active and self.waiting:
+            self.waiting = False
+            self.deadline = max(self.deadline, self.clock.now())
+            self._schedule()
+
+    def _duration(self, index):
+        return max(1, self.durations[index])
+
+    def _schedule(self):
+        if self.active and not self.waiting:
+            self.clock.schedule(self, self.deadline)
+
+    def _onTick(self, now, horizon):
+        """时钟唤醒：now 为当前时间，截止时间不晚于 horizon 的帧都视为到期"""
+        generation = self._generation
+        if self.metrics is not None:
+            self.metrics.frameLate(max(0, now - self.deadline))
+        if now - self.deadline > self.MAX_LAG_MS:
+            self.deadline = now
+
+        changed = False
+        wrapped = False
+        while horizon >= self.deadline:
+            nextIndex = self.index + 1
+            if nextIndex >= len(self.durations):
+                if not self.complete:
+                    self.waiting = True  # 下一帧尚未解码，停在当前帧
+                    break
+                if not self.loop:
+                    self.active = False
+                    if changed:
+                        self.frameChanged.emit(self.index)
+                    if generation == self._generation:
+                        self.sequenceFinished.emit()
+                    return
+                nextIndex = 0
+                wrapped = True
+            if changed:
+                self.skippedFrames += 1
+            self.index = nextIndex
+            self.deadline += self._duration(nextIndex)
+            changed = True
+
+        if changed:
+            self.frameChanged.emit(self.index)
+        if wrapped and generation == self._generation:
+            self.sequenceFinished.emit()
+        if generation == self._generation:
+            self._schedule()
+
+
+class FramePreloader(QtCore.QObject):
+    """后台预加载：依次把动画解码进共享帧缓存，不影响当前播放"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.loader = FrameLoader(self)
+        self.loader.loaded.connect(self._loadNext)
+        self.loader.failed.connect(self._loadNext)
+        self.queue = []
+        self.current = None
+
+    def preload(self, paths):
+        """替换待预加载队列（已缓存或正在加载的路径会被跳过）"""
+        current = FrameCache.normalize(self.current) if self.current else None
+        self.queue = [p for p in paths
+                      if not FRAME_CACHE.contains(p) and FrameCache.normalize(p) != current]
+        if self.current is None:
+            self._loadNext()
+
+    def discard(self, path):
+        """路径已由前台加载接手：从队列移除，正在预加载则取消"""
+        key = FrameCache.normalize(path)
+        self.queue = [p for p in self.queue if FrameCache.normalize(p) != key]
+        if self.current is not None and FrameCache.normalize(self.current) == key:
+            self.loader.cancel()
+            self._loadNext()
+
+    def cancel(self):
+        self.queue = []
+        self.current = None
+        self.loader.cancel()
+
+    def _loadNext(self, *args):
+        self.current = None
+        while self.queue:
+            path = self.queue.pop(0)
+            if not FRAME_CACHE.contains(path):
+                self.current = path
+                self.loader.load(path)
+                return
+
+
+class ModWatcher(QtCore.QObject):
+    """mod 目录热重载：监视清单中的目录与帧文件，把变化映射到具体动画和帧，只重新解码改动的帧
+
+    编辑器保存时常在短时间内写多个文件，变化去抖 DEBOUNCE_MS 后一起处理（持续写入时最多推迟 MAX_DELAY_MS）；
+    新帧列表在后台拼好后替换共享帧缓存，正在循环播放该动画的宠物在播完当前一遍时换上新帧
+    """
+    DEBOUNCE_MS = 300
+    MAX_DELAY_MS = 2000
+    reloaded = pyqtSignal(str, object)  # 动画路径, 新的全部帧(FrameList)
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, manifest=MOD_MANIFEST):
+        super().__init__()
+        self.manifest = manifest
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._onChanged)
+        self.watcher.fileChanged.connect(self._onFileChanged)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.apply)
+        self.pending = set()
+        self.firstChange = None
+        self.pets = weakref.WeakSet()
+        self.loaders = {}  # 动画路径 -> FrameLoader
+        self.reusing = {}  # 动画路径 -> 沿用的帧引用
+        self.reloads = 0
+        self.decodedFrames = 0
+        self.reusedFrames = 0
+        self._sync()
+
+    def addPet(self, pet):
+        self.pets.add(pet)
+
+    def removePet(self, pet):
+        self.pets.discard(pet)
+
+    def _sync(self):
+        """按清单调整监视列表（新目录、新帧加入；被编辑器整体替换的文件 Qt 会停止监视，需重新加入）"""
+        folders, files = self.manifest.watchPaths()
+        watched = set(self.watcher.directories()) | set(self.watcher.files())
+        wanted = set(folders) | set(files)
+        stale = watched - wanted
+        if stale:
+            self.watcher.removePaths(list(stale))
+        missing = [p for p in folders + files if p not in watched and os.path.exists(p)]
+        if missing:
+            self.watcher.addPaths(missing)
+
+    def _onChanged(self, folder):
+        # 精灵包中的同一动画下次用到时重新核对源PNG（已改动的不再从包中读取）
+        SPRITE_BUNDLES.invalidate(folder)
+        self.pending.add(folder)
+        now = time.monotonic()
+        if self.firstChange is None:
+            self.firstChange = now
+        remaining = self.MAX_DELAY_MS - (now - self.firstChange) * 1000
+        self.timer.start(int(max(0, min(self.DEBOUNCE_MS, remaining))))
+
+    def _onFileChanged(self, path):
+        self._onChanged(os.path.dirname(path))
+
+    def apply(self):
+        """处理积累的变化：更新清单，找出受影响的已缓存或正在播放的动画并后台重新加载"""
+        self.timer.stop()
+        folders, self.pending = self.pending, set()
+        self.firstChange = None
+        changes = self.manifest.update(sorted(folders))
+        self._sync()
+        if not changes:
+            return
+        debug(f"mod 文件变化：{len(changes)} 个动画")
+        targets = {}  # 动画路径 -> 旧帧列表（沿用其中未改动的帧）
+        for path in FRAME_CACHE.keys():
+            if isinstance(path, str) and self.manifest.normalize(path) in changes:
+                targets[path] = FRAME_CACHE.peek(path)
+        for pet in list(self.pets):
+            path = pet.animationKey
+            if path is not None and path not in targets and self.manifest.normalize(path) in changes:
+                targets[path] = pet.images if pet.imagesComplete else None
+        for path, old in targets.items():
+            self.reload(path, old, changes[self.manifest.normalize(path)])
+
+    def reload(self, path, old=None, changed=()):
+        """后台重新加载动画：old 中来源帧不在 changed 里的直接沿用"""
+        reuse = {}
+        if old is not None:
+            for i, source in enumerate(old.sources):
+                if source is not None and source not in changed:
+                    reuse[source] = (old[i], old.offsets[i], old.canvas, old.masks[i])
+        loader = self.loaders.get(path)
+        if loader is None:
+            loader = self.loaders[path] = FrameLoader(self)
+            loader.loaded.connect(self._onLoaded)
+            loader.failed.connect(self._onFailed)
+        self.reusing[path] = reuse
+        loader.load(path, reuse)
+
+    def _onLoaded(self, path, frames):
+        reuse = self.reusing.pop(path, {})
+        reused = sum(1 for source in frames.sources if source in reuse)
+        self.reloads += 1
+        self.reusedFrames += reused
+        self.decodedFrames += len(frames) - reused
+        key = FrameCache.normalize(path)
+        # 按旧帧合成的缩放帧作废（正在播放的宠物仍持有自己的那份，换帧时重新取）
+        for scaledKey in SCALED_CACHE.keys():
+            if scaledKey[0] == key:
+                SCALED_CACHE.discard(scaledKey)
+        for pet in list(self.pets):
+            if pet.animationKey == key:
+                pet.queueImages(frames)
+        debug(f"已热重载：{path}（重新解码 {len(frames) - reused} 帧，沿用 {reused} 帧）")
+        self.reloaded.emit(path, frames)
+
+    def _onFailed(self, path, message):
+        self.reusing.pop(path, None)
+        print(f"[WARNING] 热重载失败，继续使用旧帧：{path} ({message})")
+
+    def stats(self):
+        return {
+            'watched': len(self.watcher.directories()) + len(self.watcher.files()),
+            'reloads': self.reloads,
+            'decoded_frames': self.decodedFrames,
+            'reused_frames': self.reusedFrames,
+        }
+
+
+class AnimationEngine(QtCore.QObject):
+    """按 ANIMATION_GRAPH 驱动动作的阶段切换，并预加载下一个可达阶段"""
+    actionFinished = pyqtSignal(str)  # 动作完整播放结束
+    actionFailed = pyqtSignal(str)    # 动作资源加载失败
+
+    def __init__(self, pet, graph=None, preloader=None):
+        super().__init__(pet)
+        self.pet = pet
+        self.graph = graph if graph is not None else ANIMATION_GRAPH
+        # 分身共用本体的预加载器（预加载结果进入共享帧缓存）
+        self.preloader = preloader if preloader is not None else FramePreloader(self)
+        self.action = None
+        self.stage = None
+
+    def play(self, action):
+        """从起始阶段开始播放动作"""
+        self.action = action
+        self._enter(self.graph[action]['start'])
+
+    def stop(self):
+        """中断当前动作：有 stop 路由则跳转过去并返回True，否则返回False"""
+        if self.action is None:
+            return False
+        route = self._stageDef(self.stage).get('stop')
+        if route is None:
+            return False
+        self._enter(route)
+        return True
+
+    def cancel(self):
+        self.action = None
+        self.stage = None
+        if self.preloader.parent() is self:
+            self.preloader.cancel()
+
+    def _stageDef(self, stage):
+        return self.graph[self.action]['stages'][stage]
+
+    def _enter(self, stage):
+        self.stage = stage
+        stageDef = self._stageDef(stage)
+        path = stageDef['path']
+        self.preloader.discard(path)
+        onFinished = None if stageDef.get('loop') else self._onStageFinished
+        self.pet.playImages(path, stageDef.get('interval', 100), onFinished,
+                            onFailed=self._onStageFailed)
+        self.preloader.preload(self._reachablePaths(stageDef))
+
+    def _reachablePaths(self, stageDef):
+        """当前阶段播放时可能接着进入的阶段（next / stop / 结束后的动作）"""
+        entry = self.graph[self.action]
+        paths = []
+        for route in (stageDef.get('next'), stageDef.get('stop')):
+            if route is not None:
+                paths.append(entry['stages'][route]['path'])
+        if stageDef.get('next') is None and not stageDef.get('loop'):
+            then = entry.get('then', 'idle')
+            if then is not None:
+                thenEntry = self.graph[then]
+                paths.append(thenEntry['stages'][thenEntry['start']]['path'])
+        return paths
+
+    def _onStageFinished(self):
+        route = self._stageDef(self.stage).get('next')
+        if route is not None:
+            self._enter(route)
+            return
+        action = self.action
+        self.action = None
+        self.actionFinished.emit(action)
+
+    def _onStageFailed(self):
+        action = self.action
+        self.cancel()
+        self.actionFailed.emit(action)
+
+
+class MovementEngine(QtCore.QObject):
+    """按 vup.lps 的 move: 定义在屏幕上走动、爬行、攀爬与下落
+
+    待机时每隔一段随机时间，从触发条件（到屏幕可用区域各边的距离）与当前状态都满足的定义中随机选一个；
+    移动中每推进一帧（共享动画时钟的唤醒）前进 SpeedX/SpeedY，检查条件不满足或走完
+    Distance 遍动画即停止。位置变化经由 AnimationClock 合并，每次唤醒每个窗口只移动一次。
+    坐标与 vup.lps 一致，以 LPS_AREA 为宠物区域边长
+    """
+    # 触发/检查条件（TriggerType / CheckType）：X 表示到该边的距离小于给定值，X_GREATER 表示大于
+    LEFT, RIGHT, TOP, BOTTOM = 1, 2, 4, 8
+    LEFT_GREATER, RIGHT_GREATER, TOP_GREATER, BOTTOM_GREATER = 16, 32, 64, 128
+    EDGES = (('left', LEFT, LEFT_GREATER), ('right', RIGHT, RIGHT_GREATER),
+             ('top', TOP, TOP_GREATER), ('bottom', BOTTOM, BOTTOM_GREATER))
+    # 允许的宠物状态（ModeType）
+    MODE_FLAGS = {'happy': 2, 'nomal': 4, 'poorcondition': 8, 'ill': 16}
+    IDLE_MS = (8000, 20000)  # 待机多久后尝试移动（随机）
+
+    moveStarted = pyqtSignal(str)   # move 定义的 graph
+    moveFinished = pyqtSignal(str)
+
+    def __init__(self, pet, moves):
+        super().__init__(pet)
+        self.pet = pet
+        self.moves = list(moves)
+        self.enabled = bool(self.moves)
+        self.current = None
+        self.steps = 0
+        self.clock = AnimationClock.instance()
+        self._idleTimer = QtCore.QTimer(self)
+        self._idleTimer.setSingleShot(True)
+        self._idleTimer.timeout.connect(self._onIdle)
+        self.rearm()
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled and bool(self.moves)
+        if not self.enabled:
+            self.stop()
+            self._idleTimer.stop()
+        else:
+            self.rearm()
+
+    def rearm(self):
+        if self.enabled and self.current is None:
+            self._idleTimer.start(random.randint(*self.IDLE_MS))
+
+    def isMoving(self):
+        return self.current is not None
+
+    def unit(self):
+        """vup.lps 的一个单位对应的像素数"""
+        return self.pet.petSize.width() / LPS_AREA
+
+    def _petArea(self, pos=None):
+        """宠物区域（窗口未裁剪时的范围）的全局坐标矩形"""
+        pet = self.pet
+        pos = pos if pos is not None else pet.targetPos()
+        parent = pet.parentWidget()
+        if parent is not None:
+            pos = parent.mapToGlobal(pos)
+        return QtCore.QRect(pos - pet.contentOffset, pet.petSize)
+
+    def _screenRect(self, area):
+        screen = QtWidgets.QApplication.screenAt(area.center()) or QtWidgets.QApplication.primaryScreen()
+        return screen.availableGeometry()
+
+    def distances(self, pos=None):
+        """宠物区域到屏幕可用区域四边的距离（vup.lps 单位）"""
+        area = self._petArea(pos)
+        screen = self._screenRect(area)
+        unit = self.unit()
+        return {
+            'left': (area.left() - screen.left()) / unit,
+            'right': (screen.right() - area.right()) / unit,
+            'top': (area.top() - screen.top()) / unit,
+            'bottom': (screen.bottom() - area.bottom()) / unit,
+        }
+
+    @classmethod
+    def matches(cls, flags, limits, distances):
+        for edge, less, greater in cls.EDGES:
+            limit = limits.get(edge, 0)
+            if flags & less and distances[edge] > limit:
+                return False
+            if flags & greater and distances[edge] < limit:
+                return False
+        return True
+
+    def candidates(self):
+        mode = self.MODE_FLAGS.get(self.pet.petMode(), 0)
+        distances = self.distances()
+        return [move for move in self.moves
+                if (not move.mode_type or move.mode_type & mode)
+                and self.matches(move.trigger_type, move.trigger, distances)]
+
+    def _onIdle(self):
+        pet = self.pet
+        if pet.engine.action == 'idle' and not pet.dragging and pet.isVisible():
+            moves = self.candidates()
+            if moves:
+                self.start(random.choice(moves))
+                return
+        self.rearm()
+
+    def start(self, move):
+        self.current = move
+        self.steps = max(1, int(move.distance)) * max(1, len(self.pet.images))
+        self._locate(move)
+        debug(f"开始移动：{move.graph}（{self.steps} 步）")
+        self.moveStarted.emit(move.graph)
+
+    def _locate(self, move):
+        """LocateType：先贴到对应屏幕边缘（宠物区域越出边缘 LocateLength）"""
+        side = str(move.locate_type).lower()
+        if side not in ('left', 'right', 'top', 'bottom'):
+            return
+        area = self._petArea()
+        screen = self._screenRect(area)
+        length = round(move.locate_length * self.unit())
+        if side == 'left':
+            dx, dy = screen.left() - length - area.left(), 0
+        elif side == 'right':
+            dx, dy = screen.right() + length - area.right(), 0
+        elif side == 'top':
+            dx, dy = 0, screen.top() - length - area.top()
+        else:
+            dx, dy = 0, screen.bottom() + length - area.bottom()
+        self.pet.moveTo(self.pet.targetPos() + QtCore.QPoint(dx, dy))
+
+    def step(self, *args):
+        """前进一步（接在帧调度器的 frameChanged 上）"""
+        move = self.current
+        if move is None:
+            return
+        pet = self.pet
+        if pet.dragging or pet.engine.action != 'idle' or self.steps <= 0:
+            self.stop()
+            return
+        unit = self.unit()
+        target = pet.targetPos() + QtCore.QPoint(round(move.speed_x * unit), round(move.speed_y * unit))
+        if not self.matches(move.check_type, move.check, self.distances(target)):
+            self.stop()
+            return
+        pet.moveTo(target)
+        self.steps -= 1
+
+    def stop(self):
+        move = self.current
+        if move is None:
+            return
+        self.current = None
+        self.steps = 0
+        debug(f"停止移动：{move.graph}")
+        self.moveFinished.emit(move.graph)
+        self.rearm()
+
+
+def atomic_write(path, data):
+    """先写同目录临时文件并落盘，再原子替换；写到一半崩溃也不会损坏原文件"""
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _WriteTask(QtCore.QRunnable):
+    """后台写配置文件"""
+
+    def __init__(self, path, text):
+        super().__init__()
+        self.path = path
+        self.text = text
+
+    def run(self):
+        try:
+            atomic_write(self.path, self.text.encode('utf-8'))
+        except OSError as e:
+            print(f"[ERROR] 保存配置失败：{self.path} ({e})")
+
+
+class ConfigStore(QtCore.QObject):
+    """JSON配置的内存副本：读写都在内存中，修改后延迟合并为一次写盘
+
+    写盘在单线程的后台线程池中按提交顺序执行；flush(wait=True) 会等到已提交的写入全部完成
+    """
+    DEBOUNCE_MS = 1000
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = Path(path)
+        self.data = self._read()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+        self._dirty = False
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(lambda: self.flush(wait=True))
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] 配置文件无法读取，使用默认值：{self.path} ({e})")
+            return {}
+        if not isinstance(data, dict):
+            print(f"[WARNING] 配置文件格式不正确，使用默认值：{self.path}")
+            return {}
+        return data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, fields):
+        changed = {k: v for k, v in fields.items() if k not in self.data or self.data[k] != v}
+        if not changed:
+            return
+        self.data.update(changed)
+        self._dirty = True
+        # 不重置已在计时的定时器：持续修改时最多延迟 DEBOUNCE_MS 写一次
+        if not self._timer.isActive():
+            self._timer.start(self.DEBOUNCE_MS)
+
+    def flush(self, wait=False):
+        """把未保存的修改交给后台写入；wait=True 时阻塞到写入完成（退出前调用）"""
+        self._timer.stop()
+        if self._dirty:
+            self._dirty = False
+            text = json.dumps(self.data, ensure_ascii=False, indent=2)
+            self.pool.start(_WriteTask(self.path, text))
+        if wait:
+            self.pool.waitForDone()
+
+
 class FavorabilityManager:
     CONFIG_PATH = Path.home() / ".deskpet_config.json"
+    DEFAULT_FAVORABILITY = 100
+    _store = None
+
+    @classmethod
+    def store(cls):
+        """当前 CONFIG_PATH 对应的配置（路径被修改时重新读取）"""
+        if cls._store is None or cls._store.path != Path(cls.CONFIG_PATH):
+            if cls._store is not None:
+                cls._store.flush(wait=True)
+            cls._store = ConfigStore(cls.CONFIG_PATH)
+        return cls._store
+
+    @classmethod
+    def get(cls, key, default=None):
+        return cls.store().get(key, default)
+
+    @classmethod
+    def set(cls, key, value):
+        cls.store().set(key, value)
 
     @classmethod
     def load_favorability(cls):
-        try:
-            with open(cls.CONFIG_PATH, 'r') as f:
-                return 100
-                #return json.load(f).get('favorability', 0)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return 100  # 默认值
+        value = cls.get('favorability', cls.DEFAULT_FAVORABILITY)
+        return value if type(value) is int else cls.DEFAULT_FAVORABILITY
 
     @classmethod
     def save_favorability(cls, value):
-        config = {'favorability': max(0, value)}  # 保证不低于0
-        with open(cls.CONFIG_PATH, 'w') as f:
-            json.dump(config, f)
+        cls.set('favorability', max(0, value))  # 保证不低于0
+
+    @classmethod
+    def flush(cls, wait=True):
+        if cls._store is not None:
+            cls._store.flush(wait)
+
+
+# 宠物定义（vup.lps）；按顺序取第一个存在的文件
+PET_LPS_PATHS = (
+    os.environ.get('DESKPET_LPS'),
+    os.path.join(MOD_DIR, '0000_core', 'file', 'pet', 'vup.lps'),
+    os.path.join(MOD_DIR, '0000_core', 'pet', 'vup.lps'),
+)
+# LPS 解析结果缓存文件
+LPS_CACHE_PATH = Path(os.environ.get('DESKPET_LPS_CACHE', Path.home() / ".deskpet_lps.cache"))
+
+# LPS 行格式：名称#信息:|键#值:|键#值:|文本
+#   /stop /tab /n /r /id /com /! 分别转义 :| 制表符 换行 回车 # , /
+LpsLine = namedtuple('LpsLine', 'name info subs text')  # subs: ((键, 值), ...)
+_LPS_ESCAPES = {'/stop': ':|', '/tab': '\t', '/n': '\n', '/r': '\r', '/id': '#', '/com': ',', '/!': '/'}
+_LPS_ESCAPE_RE = re.compile(r'/(?:stop|tab|id|com|n|r|!)')
+
+
+def lps_unescape(text):
+    if '/' not in text:
+        return text
+    return _LPS_ESCAPE_RE.sub(lambda m: _LPS_ESCAPES[m.group(0)], text)
+
+
+def parse_lps_line(line):
+    """解析一行；空行与 // 开头的注释行返回 None
+
+    键和名称驻留（sys.intern）：同一份 mod 里反复出现，驻留后内存与缓存文件中都只保存一份
+    """
+    line = line.strip()
+    if not line or line.startswith('//'):
+        return None
+    parts = line.split(':|')
+    name, _, info = parts[0].partition('#')
+    intern = sys.intern
+    subs = [(intern(key), value) for key, _, value in [part.partition('#') for part in parts[1:-1] if part]]
+    text = parts[-1] if len(parts) > 1 else ''
+    if '/' in line:
+        # 多数行没有转义，整行检查一次即可跳过逐值替换
+        info, text = lps_unescape(info), lps_unescape(text)
+        subs = [(key, lps_unescape(value)) for key, value in subs]
+    return LpsLine(intern(name), info, tuple(subs), text)
+
+
+def iter_lps(lines):
+    """逐行解析（lines 可以是打开的文本文件），产出 LpsLine"""
+    for line in lines:
+        record = parse_lps_line(line)
+        if record is not None:
+            yield record
+
+
+def lps_number(value, default=0):
+    """LPS 中的数值以文本保存；无法转换时返回 default"""
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def lps_fields(line):
+    """一行的键值对，键统一小写（同一份文件中 Graph/graph 混用）；值仍为文本（颜色等不能当数值）"""
+    return {key.lower(): value for key, value in line.subs}
+
+
+class LpsCache:
+    """LPS 解析结果的持久缓存：{绝对路径: (大小, 修改时间ns, 内容哈希, 行元组)}，marshal 序列化
+
+    大小与修改时间一致直接命中；修改时间变了但内容哈希相同（复制、解压）也算命中，只是要读一遍文件
+    """
+    MAGIC = b'DPLC'
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = None
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def _header(self):
+        # marshal 格式随解释器版本变化，版本不一致时整体失效
+        return self.MAGIC + struct.pack('<HH', self.VERSION, marshal.version) + \
+            sys.implementation.cache_tag.encode('ascii').ljust(16, b'\0')
+
+    def _load(self):
+        self.entries = {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+        header = self._header()
+        if not data.startswith(header):
+            return
+        try:
+            entries = marshal.loads(data[len(header):])
+        except (EOFError, ValueError, TypeError):
+            print(f"[WARNING] LPS 缓存已损坏，将重新解析：{self.path}")
+            return
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    def lookup(self, path, st, data=None):
+        """命中时返回行元组；data 为已读取的文件内容（可选）"""
+        if self.entries is None:
+            self._load()
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != st.st_size:
+            return None
+        if entry[1] != st.st_mtime_ns:
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            if hashlib.blake2b(data, digest_size=16).digest() != entry[2]:
+                return None
+            self.entries[path] = (st.st_size, st.st_mtime_ns) + entry[2:]
+            self.dirty = True
+        return entry[3]
+
+    def store(self, path, st, data, lines):
+        if self.entries is None:
+            self._load()
+        self.entries[path] = (st.st_size, st.st_mtime_ns,
+                              hashlib.blake2b(data, digest_size=16).digest(), lines)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        # 顺便清理已经不存在的文件
+        entries = {path: entry for path, entry in self.entries.items() if os.path.exists(path)}
+        try:
+            atomic_write(self.path, self._header() + marshal.dumps(entries))
+            self.dirty = False
+        except OSError as e:
+            print(f"[WARNING] 无法写入 LPS 缓存：{self.path} ({e})")
+
+
+LPS_CACHE = LpsCache(LPS_CACHE_PATH)
+
+
+def load_lps(path, cache=LPS_CACHE):
+    """读取并解析 LPS 文件，返回 LpsLine 列表；cache 为 None 时不使用缓存（不自动保存缓存）"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    raw = cache.lookup(path, st) if cache is not None else None
+    if raw is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        raw = tuple(iter_lps(data.decode('utf-8-sig').splitlines()))
+        if cache is not None:
+            cache.misses += 1
+            # marshal 只接受内置类型，缓存中保存普通元组
+            cache.store(path, st, data, tuple(tuple(line) for line in raw))
+        return list(raw)
+    cache.hits += 1
+    return [LpsLine._make(line) for line in raw]
+
+
+def load_mod_definitions(root, cache=LPS_CACHE):
+    """解析目录下全部 .lps 文件：{相对路径: [LpsLine, ...]}，结束后保存一次缓存
+
+    期间暂停循环垃圾回收：一次创建数十万个元组会反复触发回收，而这些对象都不会成环
+    """
+    result = {}
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith('.lps'):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        result[os.path.relpath(path, root)] = load_lps(path, cache)
+                    except (OSError, UnicodeDecodeError) as e:
+                        print(f"[WARNING] 无法读取 {path}：{e}")
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if cache is not None:
+        cache.save()
+    return result
+
+
+TouchArea = namedtuple('TouchArea', 'x y w h')  # 宠物定义坐标系（500x500）中的矩形
+
+
+def _touch_area(fields):
+    return TouchArea(*(lps_number(fields.get(k)) for k in ('px', 'py', 'sw', 'sh')))
+
+WorkDef = namedtuple('WorkDef', 'type name graph money_base food drink feeling time finish_bonus level_limit fields')
+MoveDef = namedtuple('MoveDef', 'graph locate_type locate_length trigger_type trigger check_type check '
+                                'speed_x speed_y distance mode_type')
+
+
+class PetDefinition:
+    """vup.lps 中的宠物定义：触摸区域、工作、移动、各状态时长与生日布局"""
+    SIDES = ('left', 'right', 'top', 'bottom')
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.name = self.intro = self.path = self.petname = ''
+        self.tags = []
+        self.touch = {}       # touchhead/touchbody/pinch -> TouchArea
+        self.raised = {}      # 提起时的区域：状态(happy/nomal/...) -> TouchArea
+        self.raisePoint = {}  # 提起时的抓取点：状态 -> (x, y)
+        self.works = []
+        self.moves = []
+        self.durations = {}
+        self.bday = {}
+        for line in lines:
+            kind = line.name.lower()
+            if kind == 'pet':
+                self.name = line.info
+                subs = dict(line.subs)
+                self.intro = subs.get('intor', '')
+                self.path = subs.get('path', '')
+                self.petname = subs.get('petname', '')
+            elif kind == 'tag':
+                self.tags = [tag for tag in line.info.split(',') if tag]
+            elif kind in ('touchhead', 'touchbody', 'pinch'):
+                fields = lps_fields(line)
+                self.touch[kind] = _touch_area(fields)
+            elif kind == 'touchraised':
+                for mode, values in self._byMode(lps_fields(line)).items():
+                    self.raised[mode] = _touch_area(values)
+            elif kind == 'raisepoint':
+                for mode, values in self._byMode(lps_fields(line)).items():
+                    self.raisePoint[mode] = (lps_number(values.get('x')), lps_number(values.get('y')))
+            elif kind == 'work':
+                self.works.append(self._work(lps_fields(line)))
+            elif kind == 'move':
+                self.moves.append(self._move(lps_fields(line)))
+            elif kind == 'duration':
+                self.durations.update((k, lps_number(v)) for k, v in lps_fields(line).items())
+            elif kind == 'bday':
+                self.bday.update(lps_fields(line))
+
+    @staticmethod
+    def _byMode(fields):
+        """happy_px -> {'happy': {'px': ...}}"""
+        modes = {}
+        for key, value in fields.items():
+            mode, _, name = key.rpartition('_')
+            if mode:
+                modes.setdefault(mode, {})[name] = value
+        return modes
+
+    @staticmethod
+    def _work(fields):
+        return WorkDef(
+            fields.get('type', ''), fields.get('name', ''), fields.get('graph', ''),
+            lps_number(fields.get('moneybase')), lps_number(fields.get('strengthfood')),
+            lps_number(fields.get('strengthdrink')), lps_number(fields.get('feeling')),
+            lps_number(fields.get('time')), lps_number(fields.get('finishbonus')),
+            lps_number(fields.get('levellimit')), fields)
+
+    @classmethod
+    def _move(cls, fields):
+        return MoveDef(
+            fields.get('graph', ''), fields.get('locatetype', ''), lps_number(fields.get('locatelength')),
+            lps_number(fields.get('triggertype')),
+            {side: lps_number(fields['trigger' + side]) for side in cls.SIDES if 'trigger' + side in fields},
+            lps_number(fields.get('checktype')),
+            {side: lps_number(fields['check' + side]) for side in cls.SIDES if 'check' + side in fields},
+            lps_number(fields.get('speedx')), lps_number(fields.get('speedy')),
+            lps_number(fields.get('distance')), lps_number(fields.get('modetype')))
+
+
+def load_pet_definition(paths=PET_LPS_PATHS, cache=LPS_CACHE):
+    """读取宠物定义；找不到文件时返回 None"""
+    for path in paths:
+        if path and os.path.isfile(path):
+            try:
+                lines = load_lps(path, cache)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"[WARNING] 无法读取宠物定义 {path}：{e}")
+                return None
+            if cache is not None:
+                cache.save()
+            return PetDefinition(lines)
+    print(f"[WARNING] 找不到宠物定义文件：{'、'.join(p for p in paths if p)}")
+    return None
+
+
+class PetRenderWidget(QtWidgets.QWidget):
+    """宠物绘制层（raster 后端）：paintEvent 中把当前帧画到其偏移处，帧切换只请求重绘新旧两帧覆盖的区域"""
+    backend = 'raster'
+    failed = pyqtSignal()  # 后端初始化失败，需要换用 raster（raster 后端不会触发）
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)  # 鼠标事件仍交给宠物窗口
+        self.frame = None
+        self.frameRect = QtCore.QRect()
+
+    def setFrame(self, pixmap, offset):
+        """切换当前帧（只保存引用，不分配像素图）"""
+        if pixmap is self.frame and offset == self.frameRect.topLeft():
+            return
+        dpr = pixmap.devicePixelRatio()
+        rect = QtCore.QRect(offset.x(), offset.y(),
+                            round(pixmap.width() / dpr), round(pixmap.height() / dpr))
+        dirty = rect.united(self.frameRect)
+        self.frame = pixmap
+        self.frameRect = rect
+        self.update(dirty)
+
+    def clear(self):
+        self.update(self.frameRect)
+        self.frame = None
+        self.frameRect = QtCore.QRect()
+
+    def paintEvent(self, event):
+        if self.frame is None:
+            return
+        painter = QtGui.QPainter(self)
+        painter.drawPixmap(self.frameRect.topLeft(), self.frame)
+        painter.end()
+
+
+# OpenGL 常量（只用到这几个，不引入 PyOpenGL）
+GL_BLEND = 0x0BE2
+GL_COLOR_BUFFER_BIT = 0x4000
+GL_ONE = 1
+GL_SRC_ALPHA = 0x0302
+GL_ONE_MINUS_SRC_ALPHA = 0x0303
+
+_GL_INFO = False  # 未探测
+
+
+def probe_opengl():
+    """探测能否创建带alpha通道的OpenGL上下文（结果缓存），不可用返回None"""
+    global _GL_INFO
+    if _GL_INFO is not False:
+        return _GL_INFO
+    _GL_INFO = None
+    fmt = QtGui.QSurfaceFormat()
+    fmt.setAlphaBufferSize(8)
+    context = QtGui.QOpenGLContext()
+    context.setFormat(fmt)
+    surface = QtGui.QOffscreenSurface()
+    surface.setFormat(fmt)
+    surface.create()
+    if not context.create() or not surface.isValid() or not context.makeCurrent(surface):
+        return None
+    try:
+        profile = QtGui.QOpenGLVersionProfile()
+        profile.setVersion(2, 0)
+        gl = context.versionFunctions(profile)
+        if gl is not None and gl.initializeOpenGLFunctions():
+            version = context.format().version()
+            _GL_INFO = {
+                'version': f"{version[0]}.{version[1]}",
+                'renderer': gl.glGetString(0x1F01),  # GL_RENDERER
+            }
+    except (ImportError, RuntimeError) as e:
+        print(f"[WARNING] OpenGL 函数不可用：{e}")
+    finally:
+        context.doneCurrent()
+    return _GL_INFO
+
+
+class GLPetRenderWidget(QtWidgets.QOpenGLWidget):
+    """宠物绘制层（opengl 后端）：每个不同的帧只上传一次纹理，每帧只画一个纹理四边形"""
+    backend = 'opengl'
+    failed = pyqtSignal()  # 上下文或函数不可用，由宠物换用 raster 后端
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        fmt = QtGui.QSurfaceFormat()
+        fmt.setAlphaBufferSize(8)
+        self.setFormat(fmt)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setAttribute(QtCore.Qt.WA_AlwaysStackOnTop)  # 透明的GL层叠在半透明窗口上
+        self.frame = None
+        self.frameRect = QtCore.QRect()
+        self.gl = None
+        self.blitter = None
+        self.budget_bytes = int(SCALED_CACHE_MB * 1024 * 1024)
+        self.texture_bytes = 0
+        self.textures = OrderedDict()  # 帧cacheKey -> (QOpenGLTexture, 字节数)，按LRU淘汰
+
+    def setFrame(self, pixmap, offset):
+        if pixmap is self.frame and offset == self.frameRect.topLeft():
+            return
+        dpr = pixmap.devicePixelRatio()
+        self.frame = pixmap
+        self.frameRect = QtCore.QRect(offset.x(), offset.y(),
+                                      round(pixmap.width() / dpr), round(pixmap.height() / dpr))
+        self.update()
+
+    def clear(self):
+        self.frame = None
+        self.frameRect = QtCore.QRect()
+        self.update()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        QtCore.QTimer.singleShot(0, self._checkContext)
+
+    def _checkContext(self):
+        """上下文创建失败时 initializeGL 不会被调用，显示后检查一次"""
+        if not self.isValid() and self.gl is None:
+            print("[WARNING] OpenGL 上下文创建失败，回退到 raster")
+            self.failed.emit()
+
+    def initializeGL(self):
+        try:
+            profile = QtGui.QOpenGLVersionProfile()
+            profile.setVersion(2, 0)
+            self.gl = self.context().versionFunctions(profile)
+            if self.gl is None or not self.gl.initializeOpenGLFunctions():
+                raise RuntimeError("OpenGL 2.0 函数不可用")
+            self.blitter = QtGui.QOpenGLTextureBlitter()
+            if not self.blitter.create():
+                raise RuntimeError("纹理绘制器创建失败")
+        except (ImportError, RuntimeError) as e:
+            print(f"[WARNING] OpenGL 绘制初始化失败，回退到 raster：{e}")
+            self.gl = None
+            QtCore.QTimer.singleShot(0, self.failed.emit)
+            return
+        self.context().aboutToBeDestroyed.connect(self.releaseTextures)
+
+    def releaseTextures(self):
+        """释放纹理（需要上下文为当前）"""
+        self.makeCurrent()
+        for texture, _ in self.textures.values():
+            texture.destroy()
+        self.textures.clear()
+        self.texture_bytes = 0
+        if self.blitter is not None:
+            self.blitter.destroy()
+            self.blitter = None
+        self.doneCurrent()
+
+    def _texture(self, pixmap):
+        key = pixmap.cacheKey()
+        entry = self.textures.get(key)
+        if entry is not None:
+            self.textures.move_to_end(key)
+            return entry[0]
+        texture = QtGui.QOpenGLTexture(pixmap.toImage(), QtGui.QOpenGLTexture.DontGenerateMipMaps)
+        texture.setMinMagFilters(QtGui.QOpenGLTexture.Linear, QtGui.QOpenGLTexture.Linear)
+        texture.setWrapMode(QtGui.QOpenGLTexture.ClampToEdge)
+        nbytes = pixmap.width() * pixmap.height() * 4
+        self.textures[key] = (texture, nbytes)
+        self.texture_bytes += nbytes
+        while self.texture_bytes > self.budget_bytes and len(self.textures) > 1:
+            _, (old, old_bytes) = self.textures.popitem(last=False)
+            old.destroy()
+            self.texture_bytes -= old_bytes
+        return texture
+
+    def paintGL(self):
+        if self.gl is None:
+            return
+        gl = self.gl
+        gl.glClearColor(0, 0, 0, 0)
+        gl.glClear(GL_COLOR_BUFFER_BIT)
+        if self.frame is None:
+            return
+        texture = self._texture(self.frame)
+        # 纹理为非预乘alpha，颜色按alpha混合、alpha按预乘规则累加，结果为Qt合成所需的预乘格式
+        gl.glEnable(GL_BLEND)
+        gl.glBlendFuncSeparate(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+        self.blitter.bind()
+        target = QtGui.QOpenGLTextureBlitter.targetTransform(QtCore.QRectF(self.frameRect), self.rect())
+        self.blitter.blit(texture.textureId(), target, QtGui.QOpenGLTextureBlitter.OriginTopLeft)
+        self.blitter.release()
+
+
+RENDER_BACKENDS = {'raster': PetRenderWidget, 'opengl': GLPetRenderWidget}
+
+
+def create_render_widget(parent, backend=None):
+    """按配置创建绘制层；opengl 不可用时回退到 raster"""
+    backend = backend or RENDER_BACKEND
+    if backend == 'opengl':
+        info = probe_opengl()
+        if info is not None:
+            debug(f"使用 OpenGL 绘制：{info}")
+            return GLPetRenderWidget(parent)
+        print("[WARNING] OpenGL 不可用，回退到 raster 绘制")
+    elif backend not in ('raster', 'auto'):
+        print(f"[WARNING] 未知的绘制后端：{backend}，使用 raster")
+    return PetRenderWidget(parent)
+
+
+class InputPassthrough(QtCore.QObject):
+    """透明像素点击穿透
+
+    鼠标移到透明像素上时让窗口不再接收输入（WindowTransparentForInput，不重建窗口），点击直接落到下层窗口；
+    穿透期间低频轮询光标位置，回到不透明像素或离开窗口时恢复。平时不轮询，也不随帧切换重建 setMask
+    """
+    POLL_MS = 50
+
+    def __init__(self, window, hitTest):
+        super().__init__(window)
+        self.window = window
+        self.hitTest = hitTest  # hitTest(全局坐标) -> 是否落在不透明像素上
+        self.active = False
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(self.POLL_MS)
+        self._timer.timeout.connect(self._poll)
+
+    def check(self, globalPos):
+        if not self.active and not self.hitTest(globalPos):
+            self.setActive(True)
+
+    def setActive(self, active):
+        if active == self.active:
+            return
+        handle = self.window.windowHandle()
+        if handle is None:
+            return
+        handle.setFlag(QtCore.Qt.WindowTransparentForInput, active)
+        self.active = active
+        if active:
+            self._timer.start()
+        else:
+            self._timer.stop()
+
+    def _poll(self):
+        pos = QtGui.QCursor.pos()
+        if not self.window.frameGeometry().contains(pos) or self.hitTest(pos):
+            self.setActive(False)
+
+
+class SwarmOverlay(QtWidgets.QWidget):
+    """群体模式的共享窗口：覆盖整个虚拟桌面的无边框、置顶、透明窗口
+
+    每个宠物是它的一个子控件（坐标即屏幕坐标减去窗口原点），所有宠物共用一个后备缓冲区，
+    各自的局部重绘由 Qt 合并后一次提交。窗口遮罩只包含各宠物的区域，遮罩外的点击穿透到下层窗口，
+    遮罩内的拖动、右键菜单仍由对应的宠物处理
+    """
+    MASK_GRID = 32  # 遮罩按网格对齐并留出余量，宠物小幅移动时遮罩不变，不必每帧 setMask
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None or sip.isdeleted(cls._instance):
+            cls._instance = cls()
+        return cls._instance
 
-class DeskPet(QtWidgets.QLabel):
     def __init__(self):
-        super().__init__()
-        print("[DEBUG] 宠物对象已创建")  # DEBUG: 对象创建检测
+        super().__init__(None, QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint)
+        self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
+        self.setWindowTitle("DeskPet")
+        self.setGeometry(QtWidgets.QApplication.primaryScreen().virtualGeometry())
+        self.pets = []
+        self._closing = False
+        self._region = None  # 上次设置的遮罩
+        # 同一轮事件中多次移动/缩放只重算一次遮罩
+        self._maskTimer = QtCore.QTimer(self)
+        self._maskTimer.setSingleShot(True)
+        self._maskTimer.timeout.connect(self.updateInputRegion)
+        self.passthrough = InputPassthrough(self, self.isOpaqueAtGlobal)
+        # 接入、拔出显示器或调整排列后，窗口重新覆盖整个虚拟桌面
+        app = QtWidgets.QApplication.instance()
+        app.screenAdded.connect(self._onScreenAdded)
+        app.screenRemoved.connect(self.fitVirtualDesktop)
+        for screen in app.screens():
+            screen.virtualGeometryChanged.connect(self.fitVirtualDesktop)
+
+    def _onScreenAdded(self, screen):
+        screen.virtualGeometryChanged.connect(self.fitVirtualDesktop)
+        self.fitVirtualDesktop()
+
+    def fitVirtualDesktop(self, *args):
+        """按当前虚拟桌面调整窗口，宠物保持原来的屏幕位置"""
+        screen = QtWidgets.QApplication.primaryScreen()
+        if screen is None:
+            return
+        geometry = screen.virtualGeometry()
+        if geometry == self.geometry():
+            return
+        delta = self.pos() - geometry.topLeft()
+        self.setGeometry(geometry)
+        for pet in self.pets:
+            pet.moveTo(pet.targetPos() + delta)
+        self._region = None
+        self.scheduleInputRegion()
+
+    def addPet(self, pet):
+        self.pets.append(pet)
+        self.scheduleInputRegion()
+
+    def removePet(self, pet):
+        if pet in self.pets:
+            self.pets.remove(pet)
+        if not self.pets:
+            if not self._closing:
+                self.close()
+        else:
+            self.scheduleInputRegion()
+
+    def scheduleInputRegion(self):
+        if not self._maskTimer.isActive():
+            self._maskTimer.start(0)
+
+    def isOpaqueAtGlobal(self, globalPos):
+        """光标处最上层的宠物在该点是否不透明（Qt 也只把事件交给最上层的子控件）"""
+        widget = self.childAt(self.mapFromGlobal(globalPos))
+        while widget is not None and widget not in self.pets:
+            widget = widget.parentWidget()
+        return widget is not None and widget.isOpaqueAtGlobal(globalPos)
+
+    def inputRegion(self):
+        """可见宠物窗口区域（已按内容包围盒收缩）外扩到 MASK_GRID 网格后的并集
+
+        多出的边缘不会挡住点击：光标处没有宠物时 InputPassthrough 照常开启穿透
+        """
+        grid = self.MASK_GRID
+        region = QtGui.QRegion()
+        for pet in self.pets:
+            if pet.isVisibleTo(self):
+                rect = pet.geometry()
+                left = (rect.left() - grid // 2) // grid * grid
+                top = (rect.top() - grid // 2) // grid * grid
+                right = (rect.right() + grid // 2) // grid * grid + grid
+                bottom = (rect.bottom() + grid // 2) // grid * grid + grid
+                region = region.united(QtGui.QRegion(left, top, right - left, bottom - top))
+        return region
+
+    def updateInputRegion(self):
+        region = self.inputRegion()
+        if region.isEmpty():
+            # 空遮罩等于取消遮罩（整个窗口拦截点击），没有可见宠物时直接隐藏窗口
+            self._region = None
+            self.hide()
+            return
+        if region != self._region:
+            self._region = region
+            self.setMask(region)
+        if not self.isVisible():
+            self.show()
+
+    def closeEvent(self, event):
+        self._closing = True
+        for pet in list(self.pets):
+            pet.close()
+        super().closeEvent(event)
+
+
+class DeskPet(QtWidgets.QLabel):
+    touched = pyqtSignal(str)  # 左键按下时命中的触摸区域：head / body / pinch
+
+    def __init__(self, origin=None):
+        """origin 不为空时创建分身：与本体共享帧缓存、预加载器与好感度，只拥有自己的窗口与动画进度
+
+        群体模式下宠物不是独立窗口，而是共享窗口 SwarmOverlay 的子控件
+        """
+        self.overlay = SwarmOverlay.instance() if SWARM_MODE else None
+        super().__init__(self.overlay)
+        debug("宠物对象已创建")  # DEBUG: 对象创建检测
+        self.mainPet = origin.mainPet if origin is not None else self
         self.childPets = []
         self.isDragging = False
         self.change = False
+        if self.isClone():
+            # 分身不播放启动动画，直接进入待机
+            self.is_first_idle = False
+            self.startup_played = True
+            self.definition = self.mainPet.definition
+            self.chatMemory = self.mainPet.chatMemory
+        else:
+            self._favorability = FavorabilityManager.load_favorability()
+            self.definition = load_pet_definition()
+            self.chatMemory = ConversationMemory()
         self.initUI()
-        self.favorability = FavorabilityManager.load_favorability()
+
+    def isClone(self):
+        return self.mainPet is not self
+
+    @property
+    def favorability(self):
+        """好感度保存在本体上，分身读写的都是本体的值"""
+        return self.mainPet._favorability
+
+    @favorability.setter
+    def favorability(self, value):
+        self.mainPet._favorability = value
 
     def initUI(self):
         # 临时测试背景色（注释掉透明背景）
@@ -57,52 +2918,316 @@ class DeskPet(QtWidgets.QLabel):
 
         self.setWindowFlags(QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint)
         self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
-        self.setGeometry(100, 100, 1000, 1000)  # DEBUG: 移动到屏幕左上角
-        print(f"[DEBUG] 窗口初始位置：{self.geometry()}")
+        self.setGeometry(100, 100, *PET_SIZE)  # DEBUG: 移动到屏幕左上角
+        debug(f"窗口初始位置：{self.geometry()}")
+        # 窗口只覆盖宠物区域中的非透明部分；contentOffset 为窗口相对宠物区域左上角的偏移
+        self.petSize = QtCore.QSize(*PET_SIZE)
+        self.contentOffset = QtCore.QPoint(0, 0)
+        self.contentScale = 1.0
+        # 共享窗口整体走 raster 合成，群体模式下不创建GL子控件
+        self.renderer = create_render_widget(self, 'raster' if self.overlay is not None else None)
+        self.renderer.setGeometry(self.rect())
+        self.renderer.failed.connect(self._onRendererFailed)
 
         self.currentAction = self.startIdle
-        self.timer = QtCore.QTimer(self)
-        self.timer.timeout.connect(self.updateAnimation)
+        # 按帧时长调度，整段播放完毕由 sequenceFinished 通知（替代按帧数估算的 singleShot）
+        self.scheduler = FrameScheduler(self)
+        self.metrics = PetMetrics(self) if METRICS_ENABLED else None
+        self.metricsOverlay = None
+        if self.metrics is not None:
+            self.scheduler.metrics = self.metrics
+            self.scheduler.frameChanged.connect(self._timedUpdateAnimation)
+        else:
+            self.scheduler.frameChanged.connect(self.updateAnimation)
+        self.scheduler.sequenceFinished.connect(self._onSequenceFinished)
+
+        # 后台帧加载
+        self.images = FrameList()
+        self.frameDurations = []
+        self.imagesComplete = False
+        self.currentImage = 0
+        self.frameInterval = 100
+        self.loopPlayback = True
+        self.animationKey = None
+        self.scaledKey = None
+        self.scaledFrames = None
+        self.pendingImages = None  # 热重载得到的新帧，播完当前一遍时换上
+        self.stageCallback = None
+        self.failCallback = None
+        self.frameLoader = FrameLoader(self)
+        self.frameLoader.frameReady.connect(self._onFrameReady)
+        self.frameLoader.loaded.connect(self._onImagesLoaded)
+        self.frameLoader.failed.connect(self._onImagesFailed)
+
+        # 动作由状态图驱动，阶段切换时不再重连定时器
+        self.engine = AnimationEngine(
+            self, preloader=self.mainPet.engine.preloader if self.isClone() else None)
+        self.engine.actionFinished.connect(self._onActionFinished)
+        self.engine.actionFailed.connect(self._onActionFailed)
+        self.movement = MovementEngine(self, self.definition.moves if self.definition is not None else ())
+        self.movement.setEnabled(MOVE_ENABLED)
+        self.scheduler.frameChanged.connect(self.movement.step)
+        if HOT_RELOAD:
+            ModWatcher.instance().addPet(self)
 
         self.startIdle()
         self.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.showMenu)
         self.setMouseTracking(True)
         self.dragging = False
+        self.lastTouch = None
+        self._touchRects = None
+        if self.overlay is not None:
+            self.overlay.addPet(self)
+            self.passthrough = self.overlay.passthrough
+        else:
+            self.passthrough = InputPassthrough(self, self.isOpaqueAtGlobal)
 
     def showEvent(self, event):
         """DEBUG: 窗口显示事件检测"""
-        print("[DEBUG] 窗口已显示")
+        debug("窗口已显示")
         super().showEvent(event)
+        if self.overlay is not None:
+            self.overlay.scheduleInputRegion()
+        # 移到不同DPI的屏幕时需要重新合成缩放帧
+        handle = self.windowHandle()
+        if handle is not None and not getattr(self, '_screenHooked', False):
+            handle.screenChanged.connect(self.invalidateScaledFrames)
+            self._screenHooked = True
+
+    def _onRendererFailed(self):
+        """绘制后端运行时初始化失败：换用 raster 并重绘当前帧
+
+        Qt5 中顶层窗口一旦含有过GL子控件就一直走GL合成，因此主要依靠创建前的 probe_opengl；
+        这里是探测通过但实际初始化失败时的兜底，并让之后创建的分身直接使用 raster
+        """
+        global _GL_INFO
+        old = self.renderer
+        if old.backend == 'raster':
+            return
+        _GL_INFO = None
+        old.hide()
+        self.renderer = PetRenderWidget(self)
+        self.renderer.setGeometry(self.rect())
+        self.renderer.show()
+        old.deleteLater()
+        if self.images:
+            self.updateAnimation()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        if self.overlay is not None:
+            self.overlay.scheduleInputRegion()
+
+    def moveEvent(self, event):
+        super().moveEvent(event)
+        if self.overlay is not None:
+            self.overlay.scheduleInputRegion()
+
+    def resizeEvent(self, event):
+        self.renderer.setGeometry(self.rect())
+        super().resizeEvent(event)
+        if self.overlay is not None:
+            self.overlay.scheduleInputRegion()
+
+    def invalidateScaledFrames(self, *args):
+        """缩放比例或DPI变化后，下一帧按新的 (缩放比例, DPR) 取缩放帧"""
+        self.scaledKey = None
+        self.scaledFrames = None
+
+    def contentRect(self):
+        """当前动画非透明部分在宠物区域中的位置（原始画布按比例缩放并居中到宠物区域）"""
+        images = self.images
+        if not images or not images.canvas:
+            self.contentScale = 1.0
+            return QtCore.QRect(QtCore.QPoint(0, 0), self.petSize)
+        cw, ch = images.canvas
+        scale = min(self.petSize.width() / cw, self.petSize.height() / ch)
+        left = (self.petSize.width() - cw * scale) / 2
+        top = (self.petSize.height() - ch * scale) / 2
+        box = self.contentBox()
+        x = int(left + box.x() * scale)
+        y = int(top + box.y() * scale)
+        right = math.ceil(left + (box.x() + box.width()) * scale)
+        bottom = math.ceil(top + (box.y() + box.height()) * scale)
+        self.contentScale = scale
+        return QtCore.QRect(x, y, max(1, right - x), max(1, bottom - y))
+
+    def contentBox(self):
+        """窗口对应的画布区域：加载完成后是全部帧的包围盒，加载中先占满整个画布，避免每来一帧就改一次窗口大小"""
+        images = self.images
+        if self.imagesComplete:
+            return images.box
+        cw, ch = images.canvas
+        return QtCore.QRect(0, 0, cw, ch)
+
+    def _updateContentGeometry(self):
+        """按内容包围盒收缩窗口，并保持宠物在屏幕上的位置不变"""
+        scale = self.contentScale
+        rect = self.contentRect()
+        if self.contentScale != scale:
+            self.invalidateScaledFrames()
+        if rect.topLeft() == self.contentOffset and rect.size() == self.size():
+            return
+        origin = self.targetPos() - self.contentOffset
+        self.contentOffset = rect.topLeft()
+        # 尺寸与位置必须同时生效，不走合并移动
+        AnimationClock.instance().cancelMove(self)
+        self.setFixedSize(rect.size())
+        self.move(origin + rect.topLeft())
+
+    def scaledFrame(self, index):
+        """取按内容缩放比例缩放后的裁剪帧（每个 (动画, 缩放比例, DPR) 只缩放一次）"""
+        if self.scaledFrames is None:
+            self.scaledKey = (self.animationKey, self.contentScale, self.devicePixelRatioF())
+            self.scaledFrames = SCALED_CACHE.get(self.scaledKey)
+            if self.scaledFrames is None:
+                self.scaledFrames = []
+                SCALED_CACHE.put(self.scaledKey, self.scaledFrames)
+
+        frames = self.scaledFrames
+        if index < len(frames) and frames[index] is not None:
+            return frames[index]
+
+        frame = self.images[index]
+        if index >= len(frames):
+            frames.extend([None] * (index + 1 - len(frames)))
+        # 同一共享帧（同一动画中重复出现或多个动画共用）按同一比例只缩放一次
+        _, scale, dpr = self.scaledKey
+        sourceKey = (frame.cacheKey(), scale, dpr)
+        scaled = SCALED_FRAMES.get(sourceKey)
+        if scaled is None:
+            scaled = self._scaleFrame(frame)
+            SCALED_FRAMES[sourceKey] = scaled
+        frames[index] = scaled
+        # 与原帧共享像素数据时已计入帧缓存，不额外计入
+        if scaled.cacheKey() != frame.cacheKey():
+            SCALED_CACHE.add(self.scaledKey, scaled)
+        return scaled
+
+    def _scaleFrame(self, frame):
+        """按内容缩放比例与DPR缩放裁剪帧（比例为1时直接共享原帧）"""
+        dpr = self.devicePixelRatioF()
+        scale = self.contentScale * dpr
+        size = QtCore.QSize(max(1, round(frame.width() * scale)), max(1, round(frame.height() * scale)))
+        if size == frame.size():
+            scaled = QtGui.QPixmap(frame)
+        else:
+            scaled = frame.scaled(size, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation)
+        scaled.setDevicePixelRatio(dpr)
+        return scaled
+
+    def frameOffset(self, index):
+        """第 index 帧在窗口中的位置（逻辑像素）"""
+        dx, dy = self.images.offsets[index]
+        box = self.contentBox()
+        scale = self.contentScale
+        return QtCore.QPoint(round((dx - box.x()) * scale), round((dy - box.y()) * scale))
+
+    def targetPos(self):
+        """窗口位置，包含尚未提交的合并移动"""
+        pos = AnimationClock.instance().pendingPos(self)
+        return pos if pos is not None else self.pos()
+
+    def moveTo(self, pos):
+        """经由动画时钟合并的移动（拖动、自由移动），每次唤醒只 move 一次"""
+        AnimationClock.instance().moveWidget(self, pos)
+
+    def petMode(self):
+        """vup.lps 中的宠物状态，由好感度决定"""
+        if self.favorability >= 80:
+            return 'happy'
+        if self.favorability >= 30:
+            return 'nomal'
+        return 'poorcondition'
+
+    def isOpaqueAt(self, pos):
+        """窗口坐标 pos 处当前帧是否不透明（查预先计算的点击遮罩）
+
+        后台加载中还没有可显示的帧时，窗口范围内都按不透明处理，仍可拖动和右键
+        """
+        if not self.rect().contains(pos):
+            return False
+        images = self.images
+        index = self.currentImage
+        if not images or index >= len(images):
+            return True
+        mask = images.mask(index)
+        if mask is None:
+            return True
+        offset = self.frameOffset(index)
+        scale = self.contentScale
+        return mask.contains((pos.x() - offset.x()) / scale, (pos.y() - offset.y()) / scale)
+
+    def isOpaqueAtGlobal(self, globalPos):
+        return self.isOpaqueAt(self.mapFromGlobal(globalPos))
+
+    def touchRegion(self, pos):
+        """窗口坐标 pos 所在的触摸区域（vup.lps 的 touchhead / touchbody / pinch），都不在时返回 None"""
+        if self._touchRects is None:
+            self._touchRects = []
+            touch = self.definition.touch if self.definition is not None else {}
+            sx = self.petSize.width() / LPS_AREA
+            sy = self.petSize.height() / LPS_AREA
+            for region, key in TOUCH_REGIONS:
+                area = touch.get(key)
+                if area is not None:
+                    self._touchRects.append((region, QtCore.QRect(
+                        round(area.x * sx), round(area.y * sy), round(area.w * sx), round(area.h * sy))))
+        point = pos + self.contentOffset  # 宠物区域坐标
+        for region, rect in self._touchRects:
+            if rect.contains(point):
+                return region
+        return None
 
     def loadImages(self, path):
-        """增强版图片加载（带错误处理）"""
+        """同步图片加载（带错误处理，优先读取共享帧缓存）"""
+        cached = FRAME_CACHE.get(path)
+        if cached is not None:
+            return cached
+
+        bundled = SPRITE_BUNDLES.lookup(path)
+        if bundled:
+            images = FrameList(
+                [FRAME_STORE.intern((f.bundle.path, f.index), f.bundle.image(f.index)) for f in bundled],
+                [f.duration for f in bundled],
+                [(f.x, f.y) for f in bundled],
+                bundled[0].canvas)
+            FRAME_CACHE.put(path, images)
+            return images
+
         try:
-            # DEBUG: 路径存在性检查
-            if not os.path.exists(path):
+            # DEBUG: 路径存在性检查（目录或压缩包中的目录）
+            try:
+                files = MOD_MANIFEST.frames(path) or ASSET_SOURCES.listFrames(path)
+            except FileNotFoundError:
                 QtWidgets.QMessageBox.critical(self, "路径错误", f"目录不存在：\n{path}")
                 return []
 
             # DEBUG: 图片文件检测
-            files = [f for f in os.listdir(path) if f.lower().endswith('.png')]
-            print(f"[DEBUG] 在 {path} 中找到 {len(files)} 张PNG图片")
+            debug(f"在 {path} 中找到 {len(files)} 张PNG图片")
 
             if not files:
                 QtWidgets.QMessageBox.critical(self, "图片错误", "目录中没有PNG文件")
                 return []
 
             # DEBUG: 图片加载验证
-            images = []
+            images = FrameList()
             for f in files:
-                img_path = os.path.join(path, f)
-                pixmap = QtGui.QPixmap(img_path)
-                if pixmap.isNull():
-                    print(f"[WARNING] 加载失败：{img_path}")
+                image = load_frame_image(f)
+                if image.isNull():
+                    print(f"[WARNING] 加载失败：{frame_name(f)}")
                     continue
-                images.append(pixmap)
+                canvas = (image.width(), image.height())
+                image = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+                image, x, y = trim_image(image)
+                pixmap = FRAME_STORE.intern(FrameStore.digest(image), image)
+                images.add(pixmap, frame_duration(frame_name(f)), (x, y), canvas, AlphaMask.fromImage(image))
 
             if not images:
                 QtWidgets.QMessageBox.critical(self, "图片错误", "所有PNG文件加载失败")
+            else:
+                FRAME_CACHE.put(path, images)
 
             return images
 
@@ -110,6 +3235,91 @@ class DeskPet(QtWidgets.QLabel):
             QtWidgets.QMessageBox.critical(self, "加载错误", f"发生异常：\n{str(e)}")
             return []
 
+    def playImages(self, path, interval, onFinished=None, onFailed=None):
+        """切换动画：缓存命中立即播放，否则后台解码，首帧就绪即开始播放
+
+        interval 为文件名未标注时长时的默认帧间隔；
+        传入 onFinished 时只播放一遍并在结束后回调，否则循环播放；
+        onFailed 在加载失败时调用
+        """
+        self.frameLoader.cancel()
+        self.scheduler.stop()
+        self.stageCallback = onFinished
+        self.failCallback = onFailed
+        self.frameInterval = interval
+        self.loopPlayback = onFinished is None
+        self.currentImage = 0
+        self.pendingImages = None
+        self.animationKey = FrameCache.normalize(path)
+        self.invalidateScaledFrames()
+
+        cached = FRAME_CACHE.get(path)
+        if self.metrics is not None:
+            self.metrics.loadStarted(self.animationKey, cached is not None)
+        if cached is not None:
+            self.images = cached
+            self.frameDurations = [d or interval for d in cached.durations]
+            self.imagesComplete = True
+            self._updateContentGeometry()
+            self._startPlayback()
+        else:
+            self.frameDurations = []
+            self.imagesComplete = False
+            self.frameLoader.load(path)
+            self.images = self.frameLoader.frames  # 帧由加载器逐帧追加
+
+    def _startPlayback(self):
+        self.scheduler.start(self.frameDurations, self.imagesComplete, self.loopPlayback)
+
+    def queueImages(self, frames):
+        """热重载：当前动画的新帧列表。循环播放时播完这一遍再换，仍在加载中则直接换上"""
+        if self.imagesComplete:
+            self.pendingImages = frames
+            return
+        self.frameLoader.cancel()
+        self._swapImages(frames)
+
+    def _swapImages(self, frames):
+        self.pendingImages = None
+        self.images = frames
+        self.frameDurations = [d or self.frameInterval for d in frames.durations]
+        self.imagesComplete = True
+        self.currentImage = 0
+        self.invalidateScaledFrames()
+        self._updateContentGeometry()
+        self._startPlayback()
+
+    def _onSequenceFinished(self):
+        if self.loopPlayback:
+            if self.pendingImages is not None:
+                self._swapImages(self.pendingImages)
+            return
+        callback, self.stageCallback = self.stageCallback, None
+        if callback is not None:
+            callback()
+
+    def _onFrameReady(self, index, pixmap, duration):
+        self.frameDurations.append(duration or self.frameInterval)
+        if index == 0:
+            self._updateContentGeometry()
+            self._startPlayback()
+        else:
+            self.scheduler.notifyFrames(False)
+
+    def _onImagesLoaded(self, path, frames):
+        if self.metrics is not None:
+            self.metrics.loadFinished(self.animationKey)
+        self.imagesComplete = True
+        self._updateContentGeometry()
+        self.scheduler.notifyFrames(True)
+
+    def _onImagesFailed(self, path, message):
+        print(f"[ERROR] 动画加载失败：{path}")
+        QtWidgets.QMessageBox.critical(self, "加载错误", message)
+        callback, self.failCallback = self.failCallback, None
+        if callback is not None:
+            callback()
+
     # def updateAnimation(self):
     #     """增强版动画更新（适配大尺寸图片）"""
     #     if not self.images:
@@ -155,6 +3365,8 @@ class DeskPet(QtWidgets.QLabel):
     #  ========= 菜单 ======================================================================================
 
     def showMenu(self, position):
+        if not self.isOpaqueAt(position):
+            return
         menu = QtWidgets.QMenu()
         favor_action = menu.addAction(f"当前好感度: {self.favorability} ❤")
         favor_action.setEnabled(False)
@@ -180,7 +3392,16 @@ class DeskPet(QtWidgets.QLabel):
         child_menu = menu.addMenu("小彩蛋")
         child_menu.addAction("开发者的Q/A", self.starttalk)
         # child_menu.addAction("小游戏", self.transform)
+        if self.metrics is not None:
+            debug_menu = menu.addMenu("性能指标")
+            debug_menu.addAction("隐藏叠加层" if self.metricsOverlay else "显示叠加层",
+                                 self.toggleMetricsOverlay)
+            debug_menu.addAction("导出JSON", self.exportMetrics)
         menu.addSeparator()
+        if self.movement.moves:
+            move_action = menu.addAction("自由移动", self.movement.setEnabled)
+            move_action.setCheckable(True)
+            move_action.setChecked(self.movement.enabled)
         menu.addAction("开始聊天", self.start_chat)  # 新增聊天入口
         menu.addAction("停止", self.startIdle)
         menu.addAction("隐藏", self.minimizeWindow)
@@ -188,14 +3409,44 @@ class DeskPet(QtWidgets.QLabel):
 
         menu.exec_(self.mapToGlobal(position))
 
+    #  ========= 动作调度 ==================================================================================
+
+    def playAction(self, name, action=None):
+        """按动画状态图播放动作（action 为菜单判断用的当前动作方法）"""
+        if action is not None:
+            self.currentAction = action
+        self.engine.play(name)
+
+    def stopAction(self):
+        """中断当前动作：有结束阶段则播放结束阶段，否则直接回到待机"""
+        if not self.engine.stop():
+            self.scheduler.stop()
+            self.startIdle()
+
+    def _onActionFinished(self, name):
+        entry = ANIMATION_GRAPH[name]
+        then = entry.get('then', 'idle')
+        if then is None:
+            self.close()
+            return
+        getattr(self, ACTION_METHODS[then])()
+        if entry.get('reward'):
+            self._update_favorability(entry['reward'])
+
+    def _onActionFailed(self, name):
+        print(f"[ERROR] 动作 {name} 资源加载失败")
+        if name == 'startup':
+            self.skipStartupAnimation()
+        elif name == 'idle':
+            self.useFallbackImages()
+        elif name == 'shutdown':
+            self.close()
+        else:
+            self.startIdle()
+
     #  ========= 零食，已被注释 ==============================================================================
     def Snack(self):
-        self.setFixedSize(1000, 1000)
-        self.currentAction = self.sleep
-        self.images = self.loadImages(r"D:\数据科学与大数据技术\大二下课程\数据分析与应用\final\all_pet\pet\vup\Eat\Happy\back_lay")
-        self.currentImage = 0
-        self.timer.start(100)
-        QtCore.QTimer.singleShot(len(self.images) * 100, self.sleep)
+        self.playAction('snack', self.sleep)
 
     #  ========= 待机动画 ==================================================================================
 
@@ -208,419 +3459,110 @@ class DeskPet(QtWidgets.QLabel):
 
         # 首次运行加载启动动画
         if self.is_first_idle and not self.startup_played:
-            print("[DEBUG] 首次进入待机，播放启动动画")
-            # startup_path = r"E:\Game\Steam\steamapps\common\VPet\mod\0000_core\pet\vup\StartUP\Happy_1"
-            startup_path = r"mod\0000_core\pet\vup\StartUP\Happy"
-            startup_images = self.loadImages(startup_path)
-
-            if startup_images:
-                # 临时替换为启动动画
-                self.images = startup_images
-                self.currentImage = 0
-                self.timer.start(100)
-
-                # 设置单次播放完成回调
-                QtCore.QTimer.singleShot(
-                    len(self.images) * 100,
-                    self.finishStartupAnimation
-                )
-                self.startup_played = True  # 标记已播放
-                return
-            else:
-                print("[WARNING] 启动动画加载失败，直接进入正常待机")
-
-        # 正常待机资源加载（原有逻辑）
-        path = r"mod\0000_core\pet\vup\BDay\B"
-        self.images = self.loadImages(path)
-
-        if not self.images:
-            print("[DEBUG] 使用备用测试图像")
-            self.images = [QtGui.QPixmap(100, 100) for _ in range(4)]
-            for i, pixmap in enumerate(self.images):
-                pixmap.fill(QtGui.QColor(i * 50, i * 50, i * 50))
+            debug("首次进入待机，播放启动动画")
+            self.startup_played = True  # 标记已播放
+            # 播放一遍后回到待机；加载失败则直接进入正常待机
+            self.playAction('startup')
+            return
 
-        # 初始化动画参数
-        self.setFixedSize(1000, 1000)
-        self.currentAction = self.startIdle
-        self.currentImage = 0
-        self.timer.start(100)
+        # 正常待机
+        self.playAction('idle', self.startIdle)
         self.is_first_idle = False  # 标记已完成首次运行
-        print("[DEBUG] 已启动待机动画")
+        debug("已启动待机动画")
+
+    def useFallbackImages(self):
+        """待机资源加载失败时使用备用测试图像"""
+        debug("使用备用测试图像")
+        self.images = FrameList([QtGui.QPixmap(100, 100) for _ in range(4)])
+        for i, pixmap in enumerate(self.images):
+            pixmap.fill(QtGui.QColor(i * 50, i * 50, i * 50))
+        self.frameDurations = [self.frameInterval] * len(self.images)
+        self.imagesComplete = True
+        self.loopPlayback = True
+        self.currentImage = 0
+        self.animationKey = 'fallback'
+        self.invalidateScaledFrames()
+        self._updateContentGeometry()
+        self._startPlayback()
 
-    def finishStartupAnimation(self):
-        """启动动画播放完成回调"""
-        print("[DEBUG] 启动动画播放完成，切换到正常待机")
-        self.timer.stop()
-        self.startIdle()  # 重新调用以加载正常待机动画
+    def skipStartupAnimation(self):
+        print("[WARNING] 启动动画加载失败，直接进入正常待机")
+        self.startIdle()
 
     def stopOtherActions(self):
-        self.timer.stop()
+        self.scheduler.stop()
         self.startIdle()
 
     #  ========= 学习 ======================================================================================
 
     def transform(self):
-        """学习动作（分三个阶段）"""
-        if not hasattr(self, 'transform_stage'):
-            self.transform_stage = 0  # 初始化学习阶段标记
-
-        stage_paths = [
-            r"mod\0000_core\pet\vup\WORK\Study\A_Nomal",  # 阶段0：开始学习
-            r"mod\0000_core\pet\vup\WORK\Study\B_1_Nomal",  # 阶段1：持续学习
-            r"mod\0000_core\pet\vup\WORK\Study\C_Nomal"  # 阶段2：结束学习
-        ]
-
-        self.setFixedSize(1000, 1000)
-        self.currentAction = self.transform
-        self.images = self.loadImages(stage_paths[self.transform_stage])
-
-        if not self.images:
-            print(f"[ERROR] 学习阶段{self.transform_stage}资源加载失败")
-            return
-
-        self.currentImage = 0
-        self.timer.start(70)
-
-        # 统一阶段控制逻辑
-        if self.transform_stage == 0:
-            QtCore.QTimer.singleShot(
-                len(self.images) * 70,
-                lambda: self.setTransformStage(1)
-            )
-        elif self.transform_stage == 1:
-            self.timer.timeout.disconnect()
-            self.timer.timeout.connect(self.transformLoopAnimation)
-        else:
-            QtCore.QTimer.singleShot(
-                len(self.images) * 70,
-                self.finishTransform
-            )
-
-    def setTransformStage(self, stage):
-        """设置学习阶段"""
-        self.transform_stage = stage
-        self.currentImage = 0  # 重置帧计数器
-        self.transform()
-
-    def transformLoopAnimation(self):
-        """学习循环动画"""
-        try:
-            self.currentImage = (self.currentImage + 1) % len(self.images)
-            scaled_pix = self.images[self.currentImage].scaled(
-                self.size(),
-                QtCore.Qt.KeepAspectRatio,
-                QtCore.Qt.SmoothTransformation
-            )
-            self.setPixmap(scaled_pix)
-        except Exception as e:
-            print(f"[TRANSFORM ERROR] {str(e)}")
-            self.stopLearning()
-
-    def finishTransform(self):
-        """结束学习"""
-        self.timer.stop()
-        self.transform_stage = 0
-        self.startIdle()
-        self._update_favorability('transform')  # 新增
+        """学习动作（开始 -> 循环学习 -> 结束）"""
+        self.playAction('study', self.transform)
 
     def stopLearning(self):
         """中断学习"""
         if self.currentAction == self.transform:
-            if self.transform_stage == 1:
-                self.timer.timeout.disconnect()
-                self.timer.timeout.connect(self.updateAnimation)
-                self.setTransformStage(2)
-            else:
-                self.timer.stop()
-                self.startIdle()
+            self.stopAction()
 
     #  ========= 工作 ======================================================================================
 
     def pipi(self):
-        """上班动作（分三个阶段）"""
-        if not hasattr(self, 'work_stage'):
-            self.work_stage = 0  # 初始化上班阶段标记
-
-        stage_paths = [
-            r"mod\0000_core\pet\vup\WORK\WorkTWO\A_Nomal",  # 阶段0：上班开始
-            r"mod\0000_core\pet\vup\WORK\WorkTWO\B_2_Nomal",  # 阶段1：上班进行
-            r"mod\0000_core\pet\vup\WORK\WorkTWO\C_Nomal"     # 阶段2：上班结束
-        ]
-
-        self.setFixedSize(1000, 1000)
-        self.currentAction = self.pipi
-        self.images = self.loadImages(stage_paths[self.work_stage])
-
-        if not self.images:
-            print(f"[ERROR] 上班阶段{self.work_stage}资源加载失败")
-            return
-
-        self.currentImage = 0
-        self.timer.start(100)
-
-        # 阶段控制逻辑
-        if self.work_stage == 0:
-            # 第一阶段：播放完毕后自动进入第二阶段
-            QtCore.QTimer.singleShot(
-                len(self.images) * 100,
-                lambda: self.setWorkStage(1)
-            )
-        elif self.work_stage == 1:
-            # 第二阶段：持续循环工作动画
-            self.timer.timeout.disconnect()
-            self.timer.timeout.connect(
-                lambda: self.workLoopAnimation()
-            )
-        # elif self.work_stage == 2:
-        #     # 确保使用标准动画更新
-        #     self.timer.timeout.disconnect()
-        #     self.timer.timeout.connect(self.updateAnimation)
-        else:
-            # 第三阶段：播放完毕后返回待机
-            QtCore.QTimer.singleShot(
-                len(self.images) * 100,
-                self.finishWork
-            )
-
-    def setWorkStage(self, stage):
-        """修复版阶段切换"""
-        self.work_stage = stage
-        # 重置动画计数器
-        self.currentImage = 0
-        # 重新加载资源
-        self.pipi()
-
-    def workLoopAnimation(self):
-        """工作循环动画"""
-        try:
-            self.currentImage = (self.currentImage + 1) % len(self.images)
-            self.setPixmap(self.images[self.currentImage])
-        except Exception as e:
-            print(f"[ERROR] 工作动画错误: {str(e)}")
-
-    def finishWork(self):
-        """结束工作"""
-        self.timer.stop()
-        self.work_stage = 0  # 重置阶段标记
-        self.startIdle()
-        self._update_favorability('pipi')  # 新增
+        """上班动作（开始 -> 循环工作 -> 结束）"""
+        self.playAction('work', self.pipi)
 
     def stopWork(self):
-        """修复版中断工作方法"""
+        """中断工作"""
         if self.currentAction == self.pipi:
-            if self.work_stage == 1:
-                # 停止当前动画循环
-                self.timer.timeout.disconnect()
-                # 重要：重新连接标准动画更新
-                self.timer.timeout.connect(self.updateAnimation)
-                # 强制刷新阶段状态
-                self.setWorkStage(2)
-            else:
-                self.timer.stop()
-                self.startIdle()
+            self.stopAction()
 
     #  ========= 运动 =====================================================================================
 
     def exercise(self):
-        """运动动作（分三个阶段）"""
-        if not hasattr(self, 'exercise_stage'):
-            self.exercise_stage = 0  # 初始化运动阶段标记
-
-        stage_paths = [
-            r"mod\0000_core\pet\vup\WORK\RopeSkipping\Happy\A",  # 阶段0：开始跳绳
-            r"mod\0000_core\pet\vup\WORK\RopeSkipping\Happy\B\1",  # 阶段1：持续跳绳
-            r"mod\0000_core\pet\vup\WORK\RopeSkipping\Happy\C"     # 阶段2：结束跳绳
-        ]
-
-        self.setFixedSize(1000, 1000)
-        self.currentAction = self.exercise
-        self.images = self.loadImages(stage_paths[self.exercise_stage])
-
-        if not self.images:
-            print(f"[ERROR] 运动阶段{self.exercise_stage}资源加载失败")
-            return
-
-        self.currentImage = 0
-        self.timer.start(100)
-
-        # 阶段控制逻辑
-        if self.exercise_stage == 0:
-            # 第一阶段：播放完毕后自动进入第二阶段
-            QtCore.QTimer.singleShot(
-                len(self.images) * 100,
-                lambda: self.setExerciseStage(1)
-            )
-        elif self.exercise_stage == 1:
-            # 第二阶段：持续循环运动动画
-            self.timer.timeout.disconnect()
-            self.timer.timeout.connect(
-                lambda: self.exerciseLoopAnimation()
-            )
-        else:
-            # 第三阶段：播放完毕后返回待机
-            QtCore.QTimer.singleShot(
-                len(self.images) * 100,
-                self.finishExercise
-            )
-
-    def setExerciseStage(self, stage):
-        """设置运动阶段"""
-        self.exercise_stage = stage
-        self.currentImage = 0
-        self.exercise()
-
-    def exerciseLoopAnimation(self):
-        """运动循环动画"""
-        try:
-            self.currentImage = (self.currentImage + 1) % len(self.images)
-            scaled_pix = self.images[self.currentImage].scaled(
-                self.size(),
-                QtCore.Qt.KeepAspectRatio,
-                QtCore.Qt.SmoothTransformation
-            )
-            self.setPixmap(scaled_pix)
-        except Exception as e:
-            print(f"[EXERCISE ERROR] {str(e)}")
-            self.stopExercise()
-
-    def finishExercise(self):
-        """结束运动"""
-        self.timer.stop()
-        self.exercise_stage = 0  # 重置阶段标记
-        self.startIdle()
-        self._update_favorability('exercise')  # 新增
+        """运动动作（开始 -> 循环跳绳 -> 结束）"""
+        self.playAction('exercise', self.exercise)
 
     def stopExercise(self):
         """中断运动"""
         if self.currentAction == self.exercise:
-            if self.exercise_stage == 1:  # 如果在运动阶段
-                self.timer.timeout.disconnect()
-                self.timer.timeout.connect(self.updateAnimation)
-                self.setExerciseStage(2)  # 进入结束阶段
-            else:
-                self.timer.stop()
-                self.startIdle()
+            self.stopAction()
 
     #  ========= 吃东西 ==================================================================================
 
     def eating(self):
-        self.setFixedSize(1000, 1000)
-        self.currentAction = self.eating
-        self.images = self.loadImages(r"mod\0000_core\pet\vup\Eat\Nomal\back_lay")
-        self.currentImage = 0
-        self.timer.start(100)
-        QtCore.QTimer.singleShot(len(self.images) * 100, self.startIdle)
+        self.playAction('eat', self.eating)
 
     #  ========= 睡觉 ===================================================================================
 
     def sleep(self):
-        """睡眠动作（分两个阶段）"""
-        if not hasattr(self, 'sleep_stage'):
-            self.sleep_stage = 0  # 初始化睡眠阶段标记
-
-        stage_paths = [
-            r"mod\0000_core\pet\vup\Sleep\A_Happy",  # 阶段0：入睡动画
-            r"mod\0000_core\pet\vup\Sleep\B_Nomal"  # 阶段1：持续睡眠
-        ]
-
-        self.setFixedSize(1000, 1000)
-        self.currentAction = self.sleep
-        self.images = self.loadImages(stage_paths[self.sleep_stage])
-
-        if not self.images:
-            print(f"[ERROR] 睡眠阶段{self.sleep_stage}资源加载失败")
-            return
-
-        self.currentImage = 0
-        self.timer.start(100)
-
-        # 阶段控制逻辑
-        if self.sleep_stage == 0:
-            # 播放完A_Happy后自动进入B_Nomal
-            QtCore.QTimer.singleShot(
-                len(self.images) * 100,
-                lambda: self.setSleepStage(1)
-            )
-        else:
-            # B_Nomal阶段持续循环
-            self.timer.timeout.disconnect()
-            self.timer.timeout.connect(
-                lambda: self.sleepLoopAnimation()
-            )
-
-    def setSleepStage(self, stage):
-        """设置睡眠阶段"""
-        self.sleep_stage = stage
-        self.sleep()
-
-    def sleepLoopAnimation(self):
-        """持续睡眠动画更新"""
-        try:
-            self.setPixmap(self.images[self.currentImage])
-            self.currentImage = (self.currentImage + 1) % len(self.images)
-        except IndexError:
-            print(f"[ERROR] 无效的帧索引：{self.currentImage}/{len(self.images)}")
-        self.repaint()
-
-    def stopOtherActions(self):
-        if self.currentAction == self.sleep:
-            self.sleep_stage = 0  # 新增重置标记
-            self.timer.timeout.disconnect()
-            self.timer.timeout.connect(self.updateAnimation)
-            self.timer.stop()
-            self.startIdle()
-        else:
-            self.timer.stop()
-            self.startIdle()
+        """睡眠动作（入睡 -> 持续睡眠，唤醒时播放醒来动画）"""
+        self.playAction('sleep', self.sleep)
 
     def WakeUp(self):
-        self.setFixedSize(1000, 1000)
-        self.images = self.loadImages(
-            r"mod\0000_core\pet\vup\Sleep\C_PoorCondition")
-        self.currentImage = 0
-        self.timer.start(130)
-        QtCore.QTimer.singleShot(len(self.images) * 130, self.finishWakeUp)
-
-    def finishWakeUp(self):
-        """唤醒完成时重置阶段标记"""
-        self.timer.stop()
-        self.sleep_stage = 0  # 新增重置标记
-        self.startIdle()
+        self.stopAction()
 
     #  ========= 退出程序 ===============================================================================
 
     def gracefulExit(self):
         """优雅退出方法（修复版）"""
-        # 加载关机动画资源
-        shutdown_path = r"mod\0000_core\pet\vup\Shutdown\Happy_1"
-        self.shutdown_images = self.loadImages(shutdown_path)
-
-        if not self.shutdown_images:
-            print("[WARNING] 关机动画加载失败，直接退出")
-            self.close()
-            return
-
         # 重置动画参数
         self.currentAction = self.gracefulExit
-        self.currentImage = 0
-        self.images = []  # 清空常规动画帧
 
         # 禁用用户交互
         self.setEnabled(False)
 
-        # 启动定时器（使用原有timer实例）
-        self.timer.start(100)
+        # 播放一遍关机动画后关闭；加载失败直接退出
+        self.playAction('shutdown')
 
     def forceClose(self):
         """强制关闭程序"""
-        self.timer.stop()
+        self.scheduler.stop()
         self.close()
 
     #  ========= 好感度 ===========
     def _update_favorability(self, action_type):
         delta = FAVOR_REWARDS.get(action_type, 0)
         self.favorability += delta
-        # 实时保存到文件
+        # 延迟合并写盘（后台线程），退出时统一落盘
         FavorabilityManager.save_favorability(self.favorability)
 
         # 好感度变化提示
@@ -645,13 +3587,27 @@ class DeskPet(QtWidgets.QLabel):
 
     def clonePet(self):
         if self.favorability >= 5:  # 分身需要5点好感
-            new_pet = DeskPet()
-            self.childPets.append(new_pet)
-            new_pet.show()
+            self.spawnClone()
             self._update_favorability('clone')
         else:
             QtWidgets.QMessageBox.warning(self, "提示", "好感度不足5点，无法创建分身！")
 
+    def spawnClone(self):
+        """创建分身（不扣好感度）
+
+        分身直接引用共享帧缓存中的帧与缩放帧，不复制像素数据，也不重新读取配置。
+        每个分身的额外内存约为：窗口后备缓冲区（宽×高×4字节×DPR²，待机动画约 2.5MB）
+        加上绘制层、加载器、调度器等少量 Qt 对象（<1MB），与已加载的动画数量无关；
+        群体模式下共用一个窗口的后备缓冲区，每个分身只剩后者
+        """
+        clone = DeskPet(self)
+        self.mainPet.childPets.append(clone)
+        # 放在当前宠物旁边（按宠物区域原点对齐，不受各自内容偏移影响）
+        origin = self.targetPos() - self.contentOffset + QtCore.QPoint(80, 40)
+        clone.move(origin + clone.contentOffset)
+        clone.show()
+        return clone
+
     #  ========= 其他 ===================================================================================
 
     def starttalk(self):
@@ -659,99 +3615,103 @@ class DeskPet(QtWidgets.QLabel):
         starttalk.show()
         self.childPets.append(starttalk)
 
+    #  ========= 性能指标 ================================================================================
+
+    def _timedUpdateAnimation(self, index=None):
+        """开启指标时替代 updateAnimation 接到调度器上，记录每帧耗时"""
+        start = time.perf_counter()
+        self.updateAnimation(index)
+        self.metrics.frameTime.add((time.perf_counter() - start) * 1000)
+
+    def toggleMetricsOverlay(self):
+        if self.metricsOverlay is None:
+            self.metricsOverlay = MetricsOverlay(self)
+            self.metricsOverlay.show()
+        else:
+            self.metricsOverlay.close()
+            self.metricsOverlay = None
+
+    def exportMetrics(self, path=None):
+        """把指标写入JSON文件，返回文件路径"""
+        path = path or f"deskpet_metrics_{os.getpid()}_{id(self):x}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.metrics.snapshot(), f, ensure_ascii=False, indent=2)
+        debug(f"指标已导出：{os.path.abspath(path)}")
+        return path
+
     def closeEvent(self, event):
-        FavorabilityManager.save_favorability(self.favorability)
-        for child in self.childPets:
+        if self.metrics is not None:
+            if METRICS_DUMP:
+                self.exportMetrics(METRICS_DUMP)
+            if self.metricsOverlay is not None:
+                self.metricsOverlay.close()
+        self.engine.cancel()
+        self.frameLoader.cancel()
+        self.scheduler.stop()
+        self.movement.setEnabled(False)
+        AnimationClock.instance().cancelMove(self)
+        if HOT_RELOAD:
+            ModWatcher.instance().removePet(self)
+        if self.isClone():
+            if self in self.mainPet.childPets:
+                self.mainPet.childPets.remove(self)
+        else:
+            FavorabilityManager.save_favorability(self.favorability)
+            FavorabilityManager.flush()
+        for child in list(self.childPets):
             child.close()
         super().closeEvent(event)
+        if self.overlay is not None:
+            self.overlay.removePet(self)
 
     def minimizeWindow(self):
-        self.showMinimized()
+        # 群体模式下最小化的是共享窗口（所有宠物一起）
+        self.window().showMinimized()
 
     def mousePressEvent(self, event):
+        if not self.isOpaqueAt(event.pos()):
+            # 光标没动而帧变了，按在了透明像素上：这次点击无法再交给下层窗口，之后的点击穿透
+            self.passthrough.setActive(True)
+            event.ignore()
+            return
         if event.button() == QtCore.Qt.LeftButton:
+            self.lastTouch = self.touchRegion(event.pos())
+            if self.lastTouch is not None:
+                debug(f"触摸：{self.lastTouch}")
+                self.touched.emit(self.lastTouch)
+            if self.overlay is not None:
+                self.raise_()  # 被拖动的宠物放到最上层
+            self.movement.stop()
             self.dragging = True
-            self.drag_position = event.globalPos() - self.pos()
+            self.drag_position = event.globalPos() - self.targetPos()
             self.prevAction = self.currentAction
             event.accept()
 
     def mouseMoveEvent(self, event):
         if QtCore.Qt.LeftButton and self.dragging:
-            self.move(event.globalPos() - self.drag_position)
+            # 原始鼠标事件很密集，合并后每帧最多移动一次窗口
+            self.moveTo(event.globalPos() - self.drag_position)
             event.accept()
+        else:
+            self.passthrough.check(event.globalPos())
 
     def mouseReleaseEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
             self.dragging = False
             event.accept()
 
-    def updateAnimation(self):
-        """增强版动画更新（兼容关机动画）"""
-        # 空值保护
-        if not self.images and self.currentAction != self.gracefulExit:
-            print("[WARNING] 没有可用的动画帧")
+    def updateAnimation(self, index=None):
+        """增强版动画更新（由调度器按帧时长驱动）"""
+        if index is not None:
+            self.currentImage = index
+        # 空值保护（后台加载中尚无帧）
+        if not self.images:
             return
 
         try:
-            # 关机动画特殊处理
-            if self.currentAction == self.gracefulExit and hasattr(self, 'shutdown_images'):
-                if self.currentImage >= len(self.shutdown_images):
-                    return
-
-                # 动态缩放处理
-                scaled_pix = self.shutdown_images[self.currentImage].scaled(
-                    self.size(),
-                    QtCore.Qt.KeepAspectRatio,
-                    QtCore.Qt.SmoothTransformation
-                )
-
-                # 创建透明画布
-                canvas = QtGui.QPixmap(self.size())
-                canvas.fill(QtCore.Qt.transparent)
-
-                # 居中绘制
-                painter = QtGui.QPainter(canvas)
-                painter.drawPixmap(
-                    (self.width() - scaled_pix.width()) // 2,
-                    (self.height() - scaled_pix.height()) // 2,
-                    scaled_pix
-                )
-                painter.end()
-
-                self.setPixmap(canvas)
-                self.currentImage += 1
-
-                # 播放完毕自动关闭
-                if self.currentImage >= len(self.shutdown_images):
-                    self.timer.stop()
-                    self.close()
-
-            # 其他动画正常处理流程
-            else:
-                window_size = self.size()
-
-                # 动态缩放图片
-                scaled_pix = self.images[self.currentImage].scaled(
-                    window_size,
-                    QtCore.Qt.KeepAspectRatio,
-                    QtCore.Qt.SmoothTransformation
-                )
-
-                # 创建透明画布
-                canvas = QtGui.QPixmap(window_size)
-                canvas.fill(QtCore.Qt.transparent)
-
-                # 居中绘制
-                painter = QtGui.QPainter(canvas)
-                painter.drawPixmap(
-                    (window_size.width() - scaled_pix.width()) // 2,
-                    (window_size.height() - scaled_pix.height()) // 2,
-                    scaled_pix
-                )
-                painter.end()
-
-                self.setPixmap(canvas)
-                self.currentImage = (self.currentImage + 1) % len(self.images)
+            # 缩放帧已缓存，这里只交给绘制层，由 paintEvent 在下次绘制时贴图
+            index = self.currentImage
+            self.renderer.setFrame(self.scaledFrame(index), self.frameOffset(index))
 
         except IndexError as e:
             print(f"[ERROR] 无效的帧索引：{self.currentImage}/{len(self.images) if self.images else 0}")
@@ -760,8 +3720,6 @@ class DeskPet(QtWidgets.QLabel):
             if self.currentAction == self.gracefulExit:
                 self.close()
 
-        self.repaint()
-
     def start_chat(self):
         """启动聊天窗口"""
         chat_window = AIPetChatWindow(self)  # 传入当前实例
@@ -771,39 +3729,347 @@ class DeskPet(QtWidgets.QLabel):
 
 # --- API入口（修改版）---
 
-# 在文件顶部新增以下类
-class APIWorker(QtCore.QObject):
-    finished = QtCore.pyqtSignal(str)
-    error = QtCore.pyqtSignal(str)
-
-    def __init__(self, system_prompt, user_input):
-        super().__init__()
-        self.system_prompt = system_prompt
-        self.user_input = user_input
+# 聊天接口（可改为本地替身地址测量延迟，见 benchmark.py chat）
+CHAT_BASE_URL = os.environ.get('DESKPET_CHAT_URL', "https://api.deepseek.com")
+CHAT_MODEL = os.environ.get('DESKPET_CHAT_MODEL', "deepseek-chat")
+CHAT_API_KEY = os.environ.get('DESKPET_CHAT_KEY', "sk-8a7ae85179684482ac03af2505166c50")
+CHAT_TIMEOUT = float(os.environ.get('DESKPET_CHAT_TIMEOUT', 30))  # 单次尝试的超时（秒）
+CHAT_CONTEXT_TOKENS = int(os.environ.get('DESKPET_CHAT_CONTEXT', 2000))  # 每次请求的上下文预算（估算token）
+
+
+def estimate_tokens(text):
+    """本地粗估token数：非ASCII字符（中文、表情等）每字约1个，ASCII每4个字符约1个"""
+    ascii_len = len(text.encode('ascii', 'ignore'))
+    return len(text) - ascii_len + (ascii_len + 3) // 4
+
+
+class ConversationMemory:
+    """聊天记忆：在token预算内带上之前的对话
+
+    系统提示（随好感度分档）每次都放在最前面，不参与压缩；最近的对话原样保留，
+    超出预算时最早的对话压成一行摘要（每条只留开头 SNIPPET_CHARS 个字），
+    摘要超过预算的 SUMMARY_SHARE 时丢弃最早的摘要行。只剩最近几条仍超预算（如一次贴了很长的文本）时，
+    先丢摘要，再从最早的一条起截短最近的对话，最后才整条丢弃。请求大小因此不随会话变长而增长
+    """
+    MESSAGE_OVERHEAD = 4  # 每条消息的角色、分隔符等
+    KEEP_RECENT = 4       # 至少原样保留的最近消息数
+    SNIPPET_CHARS = 40
+    SUMMARY_SHARE = 0.25
+    SUMMARY_HEADER = "之前聊过的内容（摘要）："
+
+    def __init__(self, budget=CHAT_CONTEXT_TOKENS):
+        self.budget = budget
+        self.turns = deque()    # (角色, 内容, token数)
+        self.turnTokens = 0
+        self.summary = deque()  # (摘要行, token数)
+        self.summaryTokens = 0
+        self.compacted = 0
+        self.dropped = 0
+        self.truncated = 0
+
+    def messages(self, system_prompt, user_input):
+        """本次请求的消息：系统提示 + 摘要 + 最近对话 + 本次输入（必要时先压缩旧对话）"""
+        fixed = (estimate_tokens(system_prompt) + estimate_tokens(user_input)
+                 + estimate_tokens(self.SUMMARY_HEADER) + 3 * self.MESSAGE_OVERHEAD)
+        self._compact(max(0, self.budget - fixed))
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.summary:
+            lines = '\n'.join(line for line, _ in self.summary)
+            messages.append({"role": "system", "content": f"{self.SUMMARY_HEADER}\n{lines}"})
+        messages.extend({"role": role, "content": content} for role, content, _ in self.turns)
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def record(self, user_input, reply):
+        """一轮对话成功后记入记忆"""
+        for role, content in (("user", user_input), ("assistant", reply)):
+            tokens = estimate_tokens(content) + self.MESSAGE_OVERHEAD
+            self.turns.append((role, content, tokens))
+            self.turnTokens += tokens
+
+    def _compact(self, limit):
+        while self.turnTokens + self.summaryTokens > limit and len(self.turns) > self.KEEP_RECENT:
+            role, content, tokens = self.turns.popleft()
+            self.turnTokens -= tokens
+            text = ' '.join(content.split())
+            if len(text) > self.SNIPPET_CHARS:
+                text = text[:self.SNIPPET_CHARS] + '…'
+            line = f"{'主人' if role == 'user' else '小橘'}：{text}"
+            lineTokens = estimate_tokens(line) + 1
+            self.summary.append((line, lineTokens))
+            self.summaryTokens += lineTokens
+            self.compacted += 1
+            while self.summary and self.summaryTokens > limit * self.SUMMARY_SHARE:
+                _, lineTokens = self.summary.popleft()
+                self.summaryTokens -= lineTokens
+                self.dropped += 1
+        if self.turnTokens + self.summaryTokens <= limit:
+            return
+        # 最近的对话本身就超预算：摘要先让位，再截短最近的对话
+        while self.summary and self.turnTokens + self.summaryTokens > limit:
+            _, lineTokens = self.summary.popleft()
+            self.summaryTokens -= lineTokens
+            self.dropped += 1
+        for i, (role, content, tokens) in enumerate(self.turns):
+            excess = self.turnTokens + self.summaryTokens - limit
+            if excess <= 0:
+                break
+            text = self._truncate(content, tokens - excess - self.MESSAGE_OVERHEAD)
+            if text == content:
+                continue
+            newTokens = estimate_tokens(text) + self.MESSAGE_OVERHEAD
+            self.turns[i] = (role, text, newTokens)
+            self.turnTokens -= tokens - newTokens
+            self.truncated += 1
+        while self.turns and self.turnTokens + self.summaryTokens > limit:
+            _, _, tokens = self.turns.popleft()
+            self.turnTokens -= tokens
+            self.dropped += 1
+
+    @staticmethod
+    def _truncate(text, tokens):
+        """截取 text 开头不超过 tokens 个token的部分（加省略号），放不下时只留省略号"""
+        if estimate_tokens(text) <= tokens:
+            return text
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if estimate_tokens(text[:mid] + '…') <= tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[:lo] + '…'
+
+    def tokens(self):
+        return self.turnTokens + self.summaryTokens
+
+    def clear(self):
+        self.turns.clear()
+        self.summary.clear()
+        self.turnTokens = self.summaryTokens = 0
+
+    def stats(self):
+        return {
+            'budget': self.budget,
+            'turns': len(self.turns),
+            'summary_lines': len(self.summary),
+            'tokens': self.tokens(),
+            'compacted': self.compacted,
+            'dropped': self.dropped,
+            'truncated': self.truncated,
+        }
+
+
+class ChatService(QtCore.QObject):
+    """全局聊天服务：一个常驻后台线程按提交顺序逐个执行请求，复用同一个 OpenAI 客户端（连接池）
+
+    每个请求有自己的超时；连接失败、超时、429 与 5xx 按指数退避重试 RETRIES 次（流式回复已开始输出后不再重试）；
+    cancel 后排队中的请求不再发送，已发出的请求结果被丢弃（退避等待立即结束，流式读取在收到下一段时停止；
+    正在进行的 create() 不会被打断，返回后才丢弃）。
+    流式请求每收到一段文本发出 delta，并记录首字延迟（TTFT）与每秒token数
+    """
+    delta = pyqtSignal(int, str)     # 请求ID, 新到的一段文本（流式）
+    finished = pyqtSignal(int, str)  # 请求ID, 完整回复
+    failed = pyqtSignal(int, str)    # 请求ID, 错误信息
+
+    RETRIES = 2
+    BACKOFF_S = 0.5
+
+    _instance = None
 
-    def run(self):
-        try:
-            client = OpenAI(
-                api_key="sk-8a7ae85179684482ac03af2505166c50",
-                base_url="https://api.deepseek.com"
-            )
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": self.user_input}
-                ]
-            )
-            self.finished.emit(response.choices[0].message.content)
-        except Exception as e:
-            self.error.emit(str(e))
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, base_url=CHAT_BASE_URL, model=CHAT_MODEL, api_key=CHAT_API_KEY, parent=None):
+        super().__init__(parent)
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.requests = 0
+        self.retries = 0
+        self.cancelled = 0
+        self.failures = 0
+        self.latency = Histogram()
+        self.ttft = Histogram()
+        self.timings = deque(maxlen=100)  # 最近请求的 {'id', 'ttft_ms', 'total_ms', 'tokens', 'tokens_per_s'}
+        self._client = None
+        self._queue = queue.Queue()
+        self._pending = {}  # 请求ID -> 取消标记
+        self._lock = threading.Lock()
+        self._nextId = 0
+        # 守护线程：退出时不必等待仍在进行的网络请求
+        self._thread = threading.Thread(target=self._serve, name='ChatService', daemon=True)
+        self._thread.start()
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.cancelAll)
+
+    def submit(self, messages, timeout=CHAT_TIMEOUT, stream=True):
+        """排队一个请求，返回请求ID；结果通过 delta（流式）与 finished / failed 信号按ID返回"""
+        with self._lock:
+            self._nextId += 1
+            requestId = self._nextId
+            cancelled = self._pending[requestId] = threading.Event()
+        self.requests += 1
+        self._queue.put((requestId, list(messages), timeout, stream, cancelled))
+        return requestId
+
+    def cancel(self, requestId):
+        with self._lock:
+            cancelled = self._pending.pop(requestId, None)
+        if cancelled is not None:
+            cancelled.set()
+            self.cancelled += 1
+
+    def cancelAll(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for cancelled in pending.values():
+            cancelled.set()
+        self.cancelled += len(pending)
+
+    def client(self):
+        """共享客户端（只在服务线程中使用）；重试由服务自己控制"""
+        if self._client is None:
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                  timeout=CHAT_TIMEOUT, max_retries=0)
+        return self._client
+
+    @staticmethod
+    def retryable(error):
+        if isinstance(error, APIConnectionError):  # 含超时
+            return True
+        return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+    def _serve(self):
+        while True:
+            requestId, messages, timeout, stream, cancelled = self._queue.get()
+            if cancelled.is_set():
+                continue
+            start = time.perf_counter()
+            try:
+                if stream:
+                    text = self._stream(requestId, messages, timeout, cancelled, start)
+                else:
+                    text = self._complete(messages, timeout, cancelled)
+            except Exception as e:
+                with self._lock:
+                    current = self._pending.pop(requestId, None) is not None
+                if current:
+                    self.failures += 1
+                    message = f"请求超时（{timeout:g} 秒）" if isinstance(e, APITimeoutError) else str(e)
+                    self.failed.emit(requestId, message)
+                continue
+            with self._lock:
+                current = self._pending.pop(requestId, None) is not None
+            if current and text is not None:
+                self.latency.add((time.perf_counter() - start) * 1000)
+                self.finished.emit(requestId, text)
+
+    def _complete(self, messages, timeout, cancelled):
+        """发送请求，可重试的错误按退避重试；期间被取消时返回 None"""
+        for attempt in range(self.RETRIES + 1):
+            try:
+                response = self.client().chat.completions.create(
+                    model=self.model, messages=messages, timeout=timeout)
+                return response.choices[0].message.content or ''
+            except Exception as e:
+                if attempt == self.RETRIES or not self.retryable(e) or cancelled.is_set():
+                    raise
+            self.retries += 1
+            if cancelled.wait(self.BACKOFF_S * 2 ** attempt * random.uniform(0.8, 1.2)):
+                return None
+
+    def _stream(self, requestId, messages, timeout, cancelled, start):
+        """流式请求：逐段发出 delta；尚未收到任何文本前的可重试错误按退避重试，被取消时返回 None"""
+        parts = []
+        first = None
+        tokens = 0
+        for attempt in range(self.RETRIES + 1):
+            try:
+                response = self.client().chat.completions.create(
+                    model=self.model, messages=messages, timeout=timeout, stream=True,
+                    stream_options={"include_usage": True})
+                with response:
+                    for chunk in response:
+                        if cancelled.is_set():
+                            return None
+                        if getattr(chunk, 'usage', None) is not None and chunk.usage.completion_tokens:
+                            tokens = chunk.usage.completion_tokens
+                        if not chunk.choices or not chunk.choices[0].delta.content:
+                            continue
+                        text = chunk.choices[0].delta.content
+                        if first is None:
+                            first = time.perf_counter()
+                        parts.append(text)
+                        self.delta.emit(requestId, text)
+                break
+            except Exception as e:
+                if parts or attempt == self.RETRIES or not self.retryable(e) or cancelled.is_set():
+                    raise
+            self.retries += 1
+            if cancelled.wait(self.BACKOFF_S * 2 ** attempt * random.uniform(0.8, 1.2)):
+                return None
+
+        end = time.perf_counter()
+        tokens = tokens or len(parts)  # 接口未返回用量时按收到的分段数估算
+        timing = {'id': requestId, 'ttft_ms': None, 'total_ms': (end - start) * 1000,
+                  'tokens': tokens, 'tokens_per_s': 0.0}
+        if first is not None:
+            timing['ttft_ms'] = (first - start) * 1000
+            self.ttft.add(timing['ttft_ms'])
+            if end > first and tokens > 1:
+                # 首字之后的生成速度（首字延迟单独统计）
+                timing['tokens_per_s'] = (tokens - 1) / (end - first)
+        self.timings.append(timing)
+        return ''.join(parts)
+
+    def timing(self, requestId):
+        """请求的流式耗时记录，没有时返回 None"""
+        for timing in reversed(self.timings):
+            if timing['id'] == requestId:
+                return timing
+        return None
+
+    def stats(self):
+        rates = [t['tokens_per_s'] for t in self.timings if t['tokens_per_s']]
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'cancelled': self.cancelled,
+            'failures': self.failures,
+            'queued': self._queue.qsize(),
+            'latency_ms': self.latency.to_dict(),
+            'ttft_ms': self.ttft.to_dict(),
+            'tokens_per_s_mean': sum(rates) / len(rates) if rates else 0.0,
+        }
 
 # --- AI聊天窗口（修改版）---
 class AIPetChatWindow(QtWidgets.QMainWindow):
-    def __init__(self, parent_pet):
+    STREAM_FLUSH_MS = 16  # 流式回复最多每帧刷新一次聊天记录
+
+    def __init__(self, parent_pet, chat=None):
         super().__init__()
         self.parent_pet = parent_pet  # 引用父级桌宠实例
-        self.thread = None  # 新增线程引用
+        self.memory = parent_pet.chatMemory  # 聊天记忆属于宠物，重新打开窗口后仍记得
+        self.pending_input = None
+        # 所有聊天窗口共用一个常驻的聊天服务，按请求ID认领各自的回复
+        self.chat = chat or ChatService.instance()
+        self.chat.delta.connect(self.on_api_delta)
+        self.chat.finished.connect(self.on_api_success)
+        self.chat.failed.connect(self.on_api_error)
+        self.chat_connected = True
+        self.request_id = None
+        # 流式回复：新到的文本先攒着，定时器到点时一次性插入，避免每个token都重新排版
+        self.streaming = False
+        self.stream_buffer = []
+        self.stream_updates = 0
+        self.stream_timer = QtCore.QTimer(self)
+        self.stream_timer.setSingleShot(True)
+        self.stream_timer.timeout.connect(self._flush_stream)
         self.init_ui()
 
     def init_ui(self):
@@ -888,41 +4154,67 @@ class AIPetChatWindow(QtWidgets.QMainWindow):
         # 显示用户消息
         self._append_message("你", user_input, "#4CAF50")
 
-        # 创建后台工作线程
-        self.thread = QtCore.QThread()
-        self.worker = APIWorker(
-            system_prompt=self.get_system_prompt(),
-            user_input=user_input
-        )
-        self.worker.moveToThread(self.thread)
-
-        # 连接信号
-        self.worker.finished.connect(self.on_api_success)
-        self.worker.error.connect(self.on_api_error)
-        self.thread.started.connect(self.worker.run)
-        self.thread.finished.connect(self.thread.deleteLater)
-
-        # 启动线程
-        self.thread.start()
-
-
-    def on_api_success(self, response):
+        # 带上预算内的聊天记忆，交给后台聊天服务排队发送
+        self.pending_input = user_input
+        self.request_id = self.chat.submit(self.memory.messages(self.get_system_prompt(), user_input))
+
+    def on_api_delta(self, request_id, text):
+        """流式回复的一段文本"""
+        if request_id != self.request_id:
+            return  # 其他窗口的请求
+        if not self.streaming:
+            self.streaming = True
+            self._append_message("小橘", "&#8203;", "#2196F3")  # 零宽占位，让后续文本沿用消息框格式
+        self.stream_buffer.append(text)
+        if not self.stream_timer.isActive():
+            self.stream_timer.start(self.STREAM_FLUSH_MS)
+
+    def _flush_stream(self):
+        """把攒下的文本一次插入到当前回复末尾"""
+        self.stream_timer.stop()
+        if not self.stream_buffer:
+            return
+        text = ''.join(self.stream_buffer)
+        self.stream_buffer = []
+        cursor = QtGui.QTextCursor(self.chat_history.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText(text)
+        scrollbar = self.chat_history.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+        self.stream_updates += 1
+
+    def on_api_success(self, request_id, response):
         """处理成功响应"""
-        self._append_message("小橘", response, "#2196F3")
+        if request_id != self.request_id:
+            return
+        if self.streaming:
+            self._flush_stream()
+        else:
+            self._append_message("小橘", response, "#2196F3")
+        self.memory.record(self.pending_input, response)
+        timing = self.chat.timing(request_id)
+        if timing is not None and timing['ttft_ms'] is not None:
+            debug(f"回复耗时：首字 {timing['ttft_ms']:.0f}ms，共 {timing['total_ms']:.0f}ms，"
+                  f"{timing['tokens']} token（{timing['tokens_per_s']:.1f} token/s）")
         self._update_favorability()
-        self.cleanup_thread()
+        self.reset_input()
 
-    def on_api_error(self, error_msg):
+    def on_api_error(self, request_id, error_msg):
         """处理错误"""
+        if request_id != self.request_id:
+            return
+        self._flush_stream()
         ai_response = f"出错了喵~ ({error_msg})"
         self._append_message("小橘", ai_response, "#2196F3")
-        self.cleanup_thread()
-
-    def cleanup_thread(self):
-        """清理线程资源"""
-        if self.thread and self.thread.isRunning():
-            self.thread.quit()
-            self.thread.wait()
+        self.reset_input()
+
+    def reset_input(self):
+        """请求结束，恢复输入（不再在GUI线程等待工作线程退出）"""
+        self.request_id = None
+        self.pending_input = None
+        self.streaming = False
+        self.stream_buffer = []
+        self.stream_timer.stop()
         self.user_entry.clear()
         self.user_entry.setEnabled(True)
         self.send_btn.setEnabled(True)
@@ -946,6 +4238,20 @@ class AIPetChatWindow(QtWidgets.QMainWindow):
         self.parent_pet.favorability += 1
         FavorabilityManager.save_favorability(self.parent_pet.favorability)
 
+    def closeEvent(self, event):
+        # 关闭窗口时取消尚未完成的请求
+        if self.request_id is not None:
+            self.chat.cancel(self.request_id)
+            self.reset_input()
+        # 聊天服务是进程级的，断开连接，关掉的窗口不再收到（并过滤）其他窗口的回复
+        if self.chat_connected:
+            self.chat_connected = False
+            self.chat.delta.disconnect(self.on_api_delta)
+            self.chat.finished.disconnect(self.on_api_success)
+            self.chat.failed.disconnect(self.on_api_error)
+        self.stream_timer.stop()
+        super().closeEvent(event)
+
 
 # 菜蛋APP
 class ChatApp(QtWidgets.QWidget):
@@ -978,17 +4284,52 @@ class ChatApp(QtWidgets.QWidget):
 
 # ... 保持原有聊天窗口代码不变 ...
 
+def compile_bundle_main(argv):
+    """命令行：python PET.py --compile-bundle mod/0000_core [-o 输出文件] [--no-premultiply]"""
+    parser = argparse.ArgumentParser(prog='PET.py --compile-bundle',
+                                     description='把 mod 目录编译为预解码精灵包')
+    parser.add_argument('root', help='mod 目录，例如 mod/0000_core')
+    parser.add_argument('-o', '--output', help='输出文件，默认 <root>.petbundle')
+    parser.add_argument('--no-premultiply', action='store_true', help='保存非预乘alpha像素')
+    args = parser.parse_args(argv)
+    _ = QtCore.QCoreApplication(sys.argv[:1])  # 解码图片需要应用对象，保持到函数返回
+    stats = SpriteBundle.compile(args.root, args.output, premultiply=not args.no_premultiply)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 0
+
+
+def dedup_report_main(argv):
+    """命令行：python PET.py --dedup-report mod/0000_core [-o 报告文件]"""
+    parser = argparse.ArgumentParser(prog='PET.py --dedup-report',
+                                     description='统计 mod 目录按帧内容去重可节省的内存')
+    parser.add_argument('root', help='mod 目录，例如 mod/0000_core')
+    parser.add_argument('-o', '--output', help='报告写入JSON文件')
+    args = parser.parse_args(argv)
+    _ = QtCore.QCoreApplication(sys.argv[:1])  # 解码图片需要应用对象，保持到函数返回
+    text = json.dumps(dedup_report(args.root), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--compile-bundle':
+        sys.exit(compile_bundle_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == '--dedup-report':
+        sys.exit(dedup_report_main(sys.argv[2:]))
+
     # DEBUG: 屏幕信息检测
     app = QtWidgets.QApplication(sys.argv)
     screen = QtWidgets.QDesktopWidget().screenGeometry()
-    print(f"[DEBUG] 主屏幕尺寸：{screen.width()}x{screen.height()}")
+    debug(f"主屏幕尺寸：{screen.width()}x{screen.height()}")
 
     pet = DeskPet()
     pet.show()
 
     # DEBUG: 延迟检查窗口状态
     QtCore.QTimer.singleShot(1000, lambda:
-    print(f"[DEBUG] 当前窗口状态：可见={pet.isVisible()} 激活={pet.isActiveWindow()}"))
+    debug(f"当前窗口状态：可见={pet.isVisible()} 激活={pet.isActiveWindow()}"))
 
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,1010 @@
+"""桌宠性能基准（离屏运行，无需显示器）
+
+用法：
+    python benchmark.py bundle --mod mod/0000_core [--rebuild] [-o result.json]
+    python benchmark.py actions [--root 素材所在目录] [--duration 3000] [-o result.json]
+    python benchmark.py render [--root 素材所在目录] [--backends raster opengl] [-o result.json]
+    python benchmark.py clones [--root 素材所在目录] [--counts 1 2 4 8 12] [-o result.json]
+    python benchmark.py zip --archive mod/0000_core/file/expression.zlps [--repeat 3] [-o result.json]
+    python benchmark.py manifest [--mod mod] [--repeat 3] [-o result.json]
+    python benchmark.py lps [--source mod目录 | --mods 300] [-o result.json]
+    python benchmark.py chat [--requests 30] [--delay-ms 50] [--fail-every 0] [--tokens 200] [-o result.json]
+    python benchmark.py compare baseline.json result.json [--tolerance 0.1]
+
+bundle：对比 PNG 解码路径与预解码精灵包路径的冷启动、动作切换耗时
+actions：驱动真实的 DeskPet 依次执行每个动作，记录冷/热加载耗时、
+         每次 updateAnimation 的耗时分位数、峰值RSS与像素图内存
+render：分别用各绘制后端播放待机动画，记录每帧 updateAnimation 与绘制耗时
+        （请求的后端未生效、回退到 raster 时该项标记为 skipped，不记录耗时）
+clones：同时播放待机动画的分身数量递增时，进程CPU占用、全局时钟唤醒次数与每个分身的内存
+zip：同一批帧分别从压缩包（按需随机读取成员）与解压后的目录加载，对比首帧/全部帧耗时与读取量
+manifest：mod 清单的首次扫描、再次启动校验耗时，以及按清单取帧与每次扫描目录取帧的耗时对比
+lps：解析大量 .lps 文件（默认用 vup.lps 生成的模拟 mod 集），对比无缓存解析、写缓存、命中缓存的耗时
+chat：对本地替身接口依次发送聊天请求，对比每条消息新建客户端（旧做法）与常驻聊天服务的延迟和新建连接数
+      （本地明文HTTP，不含真实接口的TLS握手，实际差距更大）；再经聊天窗口发送流式请求，
+      记录首字延迟、每秒token数，以及收到的分段数与聊天记录实际刷新次数；
+      最后模拟长会话，记录带聊天记忆的请求大小与延迟（对照完整对话记录的大小）
+compare：对比两次结果，耗时/内存类指标变差超过容差时返回非零退出码
+（“冷”指清空进程内帧缓存；操作系统的文件缓存不在控制范围内）
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+
+def scratch_dir():
+    """新建临时目录，进程退出时删除（解压的素材、生成的模拟 mod 等不留在磁盘上）"""
+    path = tempfile.mkdtemp(prefix='deskpet_bench_')
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+# mod 清单与 lps 缓存在导入 PET 时确定路径，基准期间写到临时目录，不碰用户主目录下的缓存
+_STATE_DIR = Path(scratch_dir())
+os.environ['DESKPET_MANIFEST'] = str(_STATE_DIR / 'manifest.json')
+os.environ['DESKPET_LPS_CACHE'] = str(_STATE_DIR / 'lps.cache')
+
+from PyQt5 import QtWidgets, QtCore
+
+import PET
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def find_animations(root):
+    """列出 root 下所有含PNG帧的目录"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort(key=PET.natural_key)
+        if any(n.lower().endswith('.png') for n in filenames):
+            found.append(dirpath)
+    return found
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'mean_ms': statistics.fmean(values) if values else 0.0,
+        'p50_ms': percentile(values, 50),
+        'p95_ms': percentile(values, 95),
+        'max_ms': max(values) if values else 0.0,
+    }
+
+
+def timed_load(path):
+    """通过 FrameLoader 异步加载一个动画，返回 (首帧耗时ms, 全部帧耗时ms)"""
+    loader = PET.FrameLoader()
+    loop = QtCore.QEventLoop()
+    marks = {}
+    start = time.perf_counter()
+
+    def on_frame(index, pixmap, duration):
+        marks.setdefault('first', (time.perf_counter() - start) * 1000)
+
+    def on_done(*args):
+        marks['all'] = (time.perf_counter() - start) * 1000
+        loop.quit()
+
+    loader.frameReady.connect(on_frame)
+    loader.loaded.connect(on_done)
+    loader.failed.connect(on_done)
+    loader.load(path)
+    if 'all' not in marks:
+        loop.exec_()
+    loader.deleteLater()
+    return marks.get('first', marks['all']), marks['all']
+
+
+def run_load_pass(animations):
+    """清空缓存后依次加载全部动画：冷启动 = 第一个动画首帧，切换延迟 = 每个动画首帧"""
+    PET.FRAME_CACHE.clear()
+    PET.SCALED_CACHE.clear()
+    first_frames = []
+    full_loads = []
+    start = time.perf_counter()
+    for path in animations:
+        first, full = timed_load(path)
+        first_frames.append(first)
+        full_loads.append(full)
+    return {
+        'cold_start_first_frame_ms': first_frames[0] if first_frames else 0.0,
+        'total_ms': (time.perf_counter() - start) * 1000,
+        'switch_first_frame': summarize(first_frames),
+        'switch_full_load': summarize(full_loads),
+    }
+
+
+def bench_bundle(args):
+    root = args.mod.rstrip('/\\')
+    bundle_path = args.bundle or root + PET.SpriteBundle.SUFFIX
+    result = {'mod': root, 'bundle': bundle_path}
+
+    if args.rebuild or not os.path.exists(bundle_path):
+        start = time.perf_counter()
+        result['compile'] = PET.SpriteBundle.compile(root, bundle_path)
+        result['compile']['seconds'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bundle = PET.SpriteBundle(bundle_path, root)
+    result['bundle_open_ms'] = (time.perf_counter() - start) * 1000
+
+    animations = find_animations(root)
+    result['animations'] = len(animations)
+
+    PET.SPRITE_BUNDLES.enabled = False
+    result['png'] = [run_load_pass(animations) for _ in range(args.repeat)]
+
+    PET.SPRITE_BUNDLES.enabled = True
+    PET.SPRITE_BUNDLES.bundles = [bundle]
+    result['bundle_path'] = [run_load_pass(animations) for _ in range(args.repeat)]
+    return result
+
+
+def peak_rss_bytes():
+    """进程峰值常驻内存（字节），无法获取时返回None"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+
+def current_rss_bytes():
+    """当前常驻内存（字节），无法获取时返回None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def pixmap_bytes(pets):
+    """各宠物当前持有的原始帧与合成帧占用的像素内存（共享的帧只计一次）"""
+    seen = {}
+    for pet in pets:
+        for frame in list(pet.images) + list(pet.scaledFrames or []):
+            if frame is not None:
+                seen.setdefault(frame.cacheKey(), PET.FrameCache.frame_bytes(frame))
+    return {
+        'live_bytes': sum(seen.values()),
+        'frame_cache_bytes': PET.FRAME_CACHE.total_bytes,
+        'scaled_cache_bytes': PET.SCALED_CACHE.total_bytes,
+    }
+
+
+def wait_until(predicate, timeout_ms):
+    """运行事件循环直到条件成立或超时，返回条件是否成立"""
+    deadline = time.perf_counter() + timeout_ms / 1000
+    loop = QtCore.QEventLoop()
+    timer = QtCore.QTimer()
+    timer.setInterval(2)
+
+    def check():
+        if predicate() or time.perf_counter() >= deadline:
+            loop.quit()
+
+    timer.timeout.connect(check)
+    timer.start()
+    if not predicate():
+        loop.exec_()
+    timer.stop()
+    return bool(predicate())
+
+
+def run_events(duration_ms):
+    wait_until(lambda: False, duration_ms)
+
+
+class TickProbe:
+    """包装 DeskPet.updateAnimation，记录每次调用耗时与每个宠物的首帧时间"""
+
+    def __init__(self):
+        self.ticks = []
+        self.first = {}
+        self._original = PET.DeskPet.updateAnimation
+        probe = self
+
+        def updateAnimation(pet, *args):
+            start = time.perf_counter()
+            probe._original(pet, *args)
+            end = time.perf_counter()
+            probe.ticks.append((end - start) * 1000)
+            if pet.images:
+                probe.first.setdefault(id(pet), end)
+
+        PET.DeskPet.updateAnimation = updateAnimation
+
+    def reset(self):
+        self.ticks = []
+        self.first = {}
+
+    def firstFrame(self, pet):
+        return self.first.get(id(pet))
+
+    def restore(self):
+        PET.DeskPet.updateAnimation = self._original
+
+
+class MethodTimer:
+    """临时替换类上的方法，记录每次调用耗时"""
+
+    def __init__(self, cls, name):
+        self.cls = cls
+        self.name = name
+        self.times = []
+        self._original = getattr(cls, name)
+        timer = self
+
+        def timed(obj, *args):
+            start = time.perf_counter()
+            result = timer._original(obj, *args)
+            timer.times.append((time.perf_counter() - start) * 1000)
+            return result
+
+        setattr(cls, name, timed)
+
+    def restore(self):
+        setattr(self.cls, self.name, self._original)
+
+
+# (动作名, 开始方法, 中断方法)；没有中断方法的动作播放完自行回到待机
+ACTION_SCENARIOS = [
+    ('idle', 'startIdle', None),
+    ('study', 'transform', 'stopLearning'),
+    ('work', 'pipi', 'stopWork'),
+    ('exercise', 'exercise', 'stopExercise'),
+    ('eat', 'eating', None),
+    ('sleep', 'sleep', 'WakeUp'),
+]
+
+
+def settle(pet, timeout_ms):
+    """等待前台加载与预加载全部结束，避免上一个动作的解码任务干扰下一次测量"""
+    return wait_until(lambda: pet.imagesComplete and not pet.frameLoader.isLoading()
+                      and pet.engine.preloader.current is None, timeout_ms)
+
+
+def clear_caches():
+    PET.FRAME_CACHE.clear()
+    PET.SCALED_CACHE.clear()
+
+
+def ms_since(start, end):
+    return (end - start) * 1000 if end is not None else None
+
+
+def measure_action(pet, probe, method, stop, args):
+    """执行一次动作：首帧/加载完成耗时、运行期间的tick耗时、中断（或自然结束）回到待机的耗时"""
+    finished = []
+
+    def onFinished(name):
+        finished.append(time.perf_counter())
+
+    pet.engine.actionFinished.connect(onFinished)
+    probe.reset()
+    skipped = pet.scheduler.skippedFrames
+    start = time.perf_counter()
+    getattr(pet, method)()
+    wait_until(lambda: probe.firstFrame(pet) is not None, args.timeout)
+    first = probe.firstFrame(pet)
+    wait_until(lambda: pet.imagesComplete, args.timeout)
+    loaded = time.perf_counter() if pet.imagesComplete else None
+    run_events(args.duration)
+    ticks = probe.ticks
+    result = {
+        'first_frame_ms': ms_since(start, first),
+        'loaded_ms': ms_since(start, loaded),
+        'ticks': summarize(ticks),
+        'skipped_frames': pet.scheduler.skippedFrames - skipped,
+    }
+    if stop is not None:
+        start = time.perf_counter()
+        getattr(pet, stop)()
+    back = wait_until(lambda: pet.engine.action == 'idle', args.timeout)
+    # 中断的动作从调用中断方法起计时；自然结束的动作从开始播放起计时
+    back_at = finished[0] if finished and stop is None else time.perf_counter()
+    result['back_to_idle_ms'] = ms_since(start, back_at) if back and method != 'startIdle' else None
+    pet.engine.actionFinished.disconnect(onFinished)
+    settle(pet, args.timeout)
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    result['pixmaps'] = pixmap_bytes([pet])
+    return result
+
+
+def bench_actions(args):
+    """驱动真实的 DeskPet 依次执行每个动作"""
+    if args.root:
+        os.chdir(args.root)
+    errors = []
+
+    def record(kind):
+        def box(parent, title, text, *rest, **kwargs):
+            errors.append({'kind': kind, 'title': title, 'text': text})
+            return QtWidgets.QMessageBox.Ok
+        return box
+
+    # 离屏运行时模态对话框会阻塞基准，改为记录到结果中
+    QtWidgets.QMessageBox.critical = record('critical')
+    QtWidgets.QMessageBox.warning = record('warning')
+    # 不覆盖用户真实的好感度配置
+    PET.FavorabilityManager.CONFIG_PATH = Path(scratch_dir()) / 'deskpet_config.json'
+
+    probe = TickProbe()
+    result = {
+        'meta': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'qt': QtCore.QT_VERSION_STR,
+            'pyqt': QtCore.PYQT_VERSION_STR,
+            'numpy': PET.np is not None,
+            'cwd': os.getcwd(),
+            'duration_ms': args.duration,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'actions': {},
+    }
+    failed = []
+
+    # 启动：构造 DeskPet 即播放启动动画，结束后进入待机
+    clear_caches()
+    start = time.perf_counter()
+    pet = PET.DeskPet()
+    pet.engine.actionFailed.connect(failed.append)
+    pet.show()
+    wait_until(lambda: probe.firstFrame(pet) is not None, args.timeout)
+    first = probe.firstFrame(pet)
+    back = wait_until(lambda: pet.engine.action == 'idle', args.timeout)
+    back_at = time.perf_counter()
+    settle(pet, args.timeout)
+    result['actions']['startup'] = {
+        'cold': {
+            'first_frame_ms': ms_since(start, first),
+            'ticks': summarize(probe.ticks),
+            'back_to_idle_ms': ms_since(start, back_at) if back else None,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'pixmaps': pixmap_bytes([pet]),
+        },
+    }
+
+    for name, method, stop in ACTION_SCENARIOS:
+        entry = {}
+        for phase in ('cold', 'warm'):
+            if phase == 'cold':
+                clear_caches()
+            entry[phase] = measure_action(pet, probe, method, stop, args)
+        result['actions'][name] = entry
+
+    # 分身：创建一个新的 DeskPet 到其首帧显示（峰值早已被冷加载推高，增量按当前常驻内存计）
+    rss_before = current_rss_bytes()
+    probe.reset()
+    start = time.perf_counter()
+    pet.clonePet()
+    clone = pet.childPets[-1] if pet.childPets else None
+    if clone is not None:
+        wait_until(lambda: probe.firstFrame(clone) is not None, args.timeout)
+        run_events(args.duration)
+        result['actions']['clone'] = {
+            'first_frame_ms': ms_since(start, probe.firstFrame(clone)),
+            'ticks': summarize(probe.ticks),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'rss_delta_bytes': (current_rss_bytes() - rss_before) if rss_before is not None else None,
+            'pixmaps': pixmap_bytes([pet, clone]),
+        }
+        pet.childPets.remove(clone)
+        clone.close()
+        clone.deleteLater()
+
+    # 退出：播放退出动画直到窗口关闭
+    probe.reset()
+    start = time.perf_counter()
+    pet.gracefulExit()
+    # 只等窗口关闭：退出动画一帧都没出时不能先耗掉整个超时再计入 closed_ms
+    closed = wait_until(lambda: not pet.isVisible(), args.timeout)
+    closed_at = time.perf_counter()
+    first = probe.firstFrame(pet)
+    result['actions']['shutdown'] = {
+        'first_frame_ms': ms_since(start, first),
+        'closed_ms': ms_since(start, closed_at) if closed and first is not None else None,
+        'failed': None if first is not None else 'no shutdown frame',
+        'ticks': summarize(probe.ticks),
+    }
+
+    probe.restore()
+    result['meta']['bundles'] = len(PET.SPRITE_BUNDLES.bundles or [])
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    result['frame_cache'] = PET.FRAME_CACHE.stats()
+    result['scaled_cache'] = PET.SCALED_CACHE.stats()
+    result['frame_store'] = PET.FRAME_STORE.stats()
+    result['failed_actions'] = failed
+    result['errors'] = errors
+    return result
+
+
+def bench_render(args):
+    """各绘制后端播放热缓存的待机动画：每帧 updateAnimation 耗时与实际绘制耗时"""
+    if args.root:
+        os.chdir(args.root)
+    QtWidgets.QMessageBox.critical = lambda *a, **k: QtWidgets.QMessageBox.Ok
+    PET.FavorabilityManager.CONFIG_PATH = Path(scratch_dir()) / 'deskpet_config.json'
+    result = {
+        'meta': {
+            'platform': platform.platform(),
+            'qt': QtCore.QT_VERSION_STR,
+            'software_gl': QtCore.QCoreApplication.testAttribute(QtCore.Qt.AA_UseSoftwareOpenGL),
+            'opengl': PET.probe_opengl(),
+            'duration_ms': args.duration,
+        },
+        'backends': {},
+    }
+    for backend in args.backends:
+        PET.RENDER_BACKEND = backend
+        probe = TickProbe()  # 须在创建宠物前替换，调度器连接的是创建时的方法
+        pet = PET.DeskPet()
+        pet.show()
+        wait_until(lambda: pet.engine.action == 'idle', args.timeout)
+        settle(pet, args.timeout)
+        renderer = type(pet.renderer)
+        paint = MethodTimer(renderer, 'paintGL' if renderer.backend == 'opengl' else 'paintEvent')
+        probe.reset()
+        run_events(args.duration)
+        probe.restore()
+        paint.restore()
+        active = pet.renderer.backend  # 创建失败或运行中出错时已回退到 raster
+        if backend != 'auto' and (renderer.backend != backend or active != backend):
+            # 实际跑的不是所请求的后端，记录下来的耗时没有意义，不写入结果以免被 compare 当成该后端的数据
+            print(f"[WARNING] 绘制后端 {backend} 不可用（实际为 {active}），跳过")
+            result['backends'][backend] = {'skipped': 'requested backend not active', 'backend': active}
+        else:
+            result['backends'][backend] = {
+                'backend': active,
+                'update': summarize(probe.ticks),
+                'paint': summarize(paint.times),
+                'tick_total_mean_ms': (sum(probe.ticks) + sum(paint.times)) / max(1, len(probe.ticks)),
+                'skipped_frames': pet.scheduler.skippedFrames,
+            }
+        pet.close()
+        pet.deleteLater()
+        run_events(100)
+    return result
+
+
+def bench_clones(args):
+    """分身数量递增时的CPU与内存开销（共用一个动画时钟，热缓存的待机循环）"""
+    if args.root:
+        os.chdir(args.root)
+    QtWidgets.QMessageBox.critical = lambda *a, **k: QtWidgets.QMessageBox.Ok
+    PET.FavorabilityManager.CONFIG_PATH = Path(scratch_dir()) / 'deskpet_config.json'
+    PET.SWARM_MODE = args.swarm
+    clock = PET.AnimationClock.instance()
+    pets = []
+    result = {'meta': {'platform': platform.platform(), 'duration_ms': args.duration, 'swarm': args.swarm},
+              'runs': []}
+    base_rss = None
+    for count in sorted(args.counts):
+        while len(pets) < count:
+            if pets:
+                pets.append(pets[0].spawnClone())
+            else:
+                pets.append(PET.DeskPet())
+                pets[0].show()
+        for pet in pets:
+            wait_until(lambda: pet.engine.action == 'idle', args.timeout)
+            settle(pet, args.timeout)
+        run_events(200)
+        rss = current_rss_bytes()
+        if base_rss is None:
+            base_rss = rss
+        wakeups, advanced = clock.wakeups, clock.advanced
+        cpu = time.process_time()
+        start = time.perf_counter()
+        run_events(args.duration)
+        seconds = time.perf_counter() - start
+        cpu_ms = (time.process_time() - cpu) * 1000
+        result['runs'].append({
+            'pets': count,
+            'cpu_ms_per_s': cpu_ms / seconds,
+            'cpu_ms_per_s_per_pet': cpu_ms / seconds / count,
+            'clock_wakeups_per_s': (clock.wakeups - wakeups) / seconds,
+            'pet_ticks_per_s': (clock.advanced - advanced) / seconds,
+            'rss_bytes': rss,
+            'rss_per_clone_bytes': (rss - base_rss) / (count - 1) if rss and count > 1 else None,
+            'pixmaps': pixmap_bytes(pets),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'top_level_windows': sum(1 for w in QtWidgets.QApplication.topLevelWidgets() if w.isVisible()),
+        })
+    for pet in pets:
+        pet.close()
+    return result
+
+
+def bench_zip(args):
+    """压缩包帧来源 vs 目录帧来源"""
+    archive = os.path.abspath(args.archive)
+    start = time.perf_counter()
+    source = PET.ZipSource(archive)
+    result = {'archive': archive, 'index_ms': (time.perf_counter() - start) * 1000,
+              'archive_bytes': os.path.getsize(archive)}
+    PET.ASSET_SOURCES.archives[archive] = source
+    folders = sorted(source.index, key=PET.natural_key)
+    extracted = scratch_dir()
+    source.zip.extractall(extracted)
+
+    result['zip'] = [run_load_pass([f'{archive}/{folder}' for folder in folders]) for _ in range(args.repeat)]
+    result['directory'] = [run_load_pass([os.path.join(extracted, folder) for folder in folders])
+                           for _ in range(args.repeat)]
+    # 只播放一个动画时实际读取的成员数
+    source.reads = source.bytesRead = 0
+    PET.FRAME_CACHE.clear()
+    timed_load(f'{archive}/{folders[0]}')
+    result['single_animation'] = dict(source.stats(), folder=folders[0])
+    return result
+
+
+def bench_manifest(args):
+    """mod 清单：首次扫描 / 再次启动（只 stat 目录）/ 取帧"""
+    root = os.path.abspath(args.mod)
+    result = {'mod': root, 'runs': []}
+    for _ in range(args.repeat):
+        path = os.path.join(scratch_dir(), 'manifest.json')
+        run = {}
+        manifest = PET.ModManifest(root, path)
+        start = time.perf_counter()
+        manifest.refresh()
+        run['cold_scan_ms'] = (time.perf_counter() - start) * 1000
+        run['stats'] = manifest.stats()
+
+        manifest = PET.ModManifest(root, path)
+        start = time.perf_counter()
+        manifest.refresh()
+        run['warm_refresh_ms'] = (time.perf_counter() - start) * 1000
+        run['warm_rescanned'] = manifest.rescanned
+
+        folders = [os.path.join(root, *rel.split('/')) for rel in manifest.paths.values()]
+        start = time.perf_counter()
+        for folder in folders:
+            manifest.frames(folder)
+        run['lookup_ms_per_animation'] = (time.perf_counter() - start) * 1000 / max(1, len(folders))
+        start = time.perf_counter()
+        for folder in folders:
+            PET.DirectorySource().listFrames(folder)
+        run['listdir_ms_per_animation'] = (time.perf_counter() - start) * 1000 / max(1, len(folders))
+        result['runs'].append(run)
+    return result
+
+
+def make_lps_mods(source, count, target):
+    """把 source 复制成 count 个模拟 mod（每个 mod 的名字、数值略有不同，内容哈希各不相同）"""
+    with open(source, encoding='utf-8-sig') as f:
+        text = f.read()
+    for i in range(count):
+        folder = os.path.join(target, f'{i:04d}_mod', 'pet')
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'vup.lps'), 'w', encoding='utf-8') as f:
+            f.write(text.replace('pet#vup:|', f'pet#vup{i}:|', 1))
+            f.write(f'duration:|state#{i}:|\n')
+
+
+def bench_lps(args):
+    """LPS 解析：无缓存 / 首次写缓存 / 再次启动命中缓存 / 修改时间变化（内容哈希命中）"""
+    root = args.source
+    if root is None:
+        root = scratch_dir()
+        source = next((p for p in PET.PET_LPS_PATHS if p and os.path.isfile(p)), None)
+        if source is None:
+            raise SystemExit(f"找不到 vup.lps：{PET.PET_LPS_PATHS}")
+        make_lps_mods(source, args.mods, root)
+    files = [os.path.join(d, n) for d, _, names in os.walk(root) for n in names if n.lower().endswith('.lps')]
+    result = {'root': root, 'files': len(files), 'bytes': sum(os.path.getsize(p) for p in files), 'runs': []}
+    for _ in range(args.repeat):
+        cache_path = os.path.join(scratch_dir(), 'lps.cache')
+        run = {}
+        start = time.perf_counter()
+        parsed = PET.load_mod_definitions(root, cache=None)
+        run['parse_ms'] = (time.perf_counter() - start) * 1000
+        run['lines'] = sum(len(lines) for lines in parsed.values())
+
+        start = time.perf_counter()
+        PET.load_mod_definitions(root, cache=PET.LpsCache(cache_path))
+        run['parse_and_save_cache_ms'] = (time.perf_counter() - start) * 1000
+        run['cache_bytes'] = os.path.getsize(cache_path)
+
+        # 新的 LpsCache 实例相当于重新启动：从磁盘读缓存
+        cache = PET.LpsCache(cache_path)
+        start = time.perf_counter()
+        cached = PET.load_mod_definitions(root, cache=cache)
+        run['warm_cache_ms'] = (time.perf_counter() - start) * 1000
+        run['warm_cache_hits'] = cache.hits
+        assert cached == parsed
+
+        start = time.perf_counter()
+        for lines in cached.values():
+            PET.PetDefinition(lines)
+        run['typed_records_ms'] = (time.perf_counter() - start) * 1000
+
+        for path in files:
+            os.utime(path, None)
+        cache = PET.LpsCache(cache_path)
+        start = time.perf_counter()
+        PET.load_mod_definitions(root, cache=cache)
+        run['touched_cache_ms'] = (time.perf_counter() - start) * 1000
+        run['touched_cache_hits'] = cache.hits
+        run['parse_mb_per_s'] = result['bytes'] / 1e6 / (run['parse_ms'] / 1000)
+        result['runs'].append(run)
+    return result
+
+
+class ChatStandIn:
+    """本地替身聊天接口：兼容 POST .../chat/completions，固定延迟后返回回复；
+    请求 stream=true 时以 SSE 分段返回，每段间隔 token_ms；fail_every > 0 时每 N 个请求返回一次 503，用于演练重试"""
+
+    def __init__(self, delay_ms=50, fail_every=0, reply='喵~', tokens=1, token_ms=0):
+        self.delay_ms = delay_ms
+        self.fail_every = fail_every
+        self.reply = reply
+        self.tokens = tokens
+        self.token_ms = token_ms
+        self.connections = 0
+        self.requests = 0
+        self.last_request_bytes = 0
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # 保持连接，客户端可复用
+            disable_nagle_algorithm = True  # 响应头与正文分两次写，避免与延迟确认叠加出 40ms 等待
+
+            def setup(self):
+                super().setup()
+                with standin._lock:
+                    standin.connections += 1
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                body = json.loads(raw or b'{}')
+                with standin._lock:
+                    standin.last_request_bytes = len(raw)
+                    standin.requests += 1
+                    count = standin.requests
+                time.sleep(standin.delay_ms / 1000)
+                if standin.fail_every and count % standin.fail_every == 0:
+                    self._send(503, {'error': {'message': 'stand-in overloaded', 'type': 'server_error'}})
+                elif body.get('stream'):
+                    try:
+                        self._stream()
+                    except (BrokenPipeError, ConnectionResetError):
+                        self.close_connection = True  # 客户端取消了请求
+                else:
+                    self._send(200, standin.completion())
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i in range(standin.tokens):
+                    if i:
+                        time.sleep(standin.token_ms / 1000)
+                    self._event(standin.chunk(standin.reply))
+                self._event(standin.chunk(None, usage=standin.tokens))
+                self._event('[DONE]')
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _event(self, payload):
+                data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode('utf-8')
+                self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+
+    def completion(self):
+        return {
+            'id': f'standin-{self.requests}', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': 'standin', 'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': self.reply}}],
+        }
+
+    def chunk(self, content, usage=None):
+        """一个流式分段；content 为 None 时是只带用量的最后一段"""
+        payload = {'id': f'standin-{self.requests}', 'object': 'chat.completion.chunk',
+                   'created': int(time.time()), 'model': 'standin', 'choices': []}
+        if content is not None:
+            payload['choices'] = [{'index': 0, 'delta': {'content': content}, 'finish_reason': None}]
+        if usage is not None:
+            payload['usage'] = {'prompt_tokens': 1, 'completion_tokens': usage, 'total_tokens': usage + 1}
+        return payload
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_chat(args):
+    """聊天请求延迟：每条消息新建 OpenAI 客户端 / 常驻 ChatService（复用连接，串行队列）"""
+    standin = ChatStandIn(args.delay_ms, args.fail_every)
+    messages = [{'role': 'system', 'content': '你是友好的猫咪小橘。'}, {'role': 'user', 'content': '你好'}]
+    result = {'requests': args.requests, 'delay_ms': args.delay_ms, 'fail_every': args.fail_every}
+
+    latencies = []
+    connections = standin.connections
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        client = PET.OpenAI(api_key='standin', base_url=standin.url)
+        client.chat.completions.create(model='standin', messages=messages)
+        latencies.append((time.perf_counter() - start) * 1000)
+        client.close()
+    result['per_message_client'] = dict(summarize(latencies), connections=standin.connections - connections)
+
+    service = PET.ChatService(base_url=standin.url, model='standin', api_key='standin')
+    service.BACKOFF_S = 0.05
+    replies = {}
+    service.finished.connect(lambda request_id, text: replies.setdefault(request_id, text))
+    service.failed.connect(lambda request_id, message: replies.setdefault(request_id, None))
+    latencies = []
+    connections = standin.connections
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        request_id = service.submit(messages, timeout=args.timeout, stream=False)
+        wait_until(lambda: request_id in replies, args.timeout * 1000 * (service.RETRIES + 1))
+        latencies.append((time.perf_counter() - start) * 1000)
+    result['pooled_service'] = dict(summarize(latencies), connections=standin.connections - connections,
+                                    failed=sum(1 for text in replies.values() if text is None),
+                                    stats=service.stats())
+
+    # 取消：排队中的请求被取消后不会发送，也不会阻塞之后的请求
+    sent = standin.requests
+    dropped = service.submit(messages, stream=False)
+    service.cancel(dropped)
+    start = time.perf_counter()
+    request_id = service.submit(messages, timeout=args.timeout, stream=False)
+    wait_until(lambda: request_id in replies, args.timeout * 1000)
+    result['after_cancel'] = {'latency_ms': (time.perf_counter() - start) * 1000,
+                              'sent': standin.requests - sent, 'cancelled_replied': dropped in replies}
+
+    # 流式：经由聊天窗口显示，统计首字延迟、生成速度与聊天记录的刷新次数
+    standin.fail_every = 0
+    standin.tokens = args.tokens
+    standin.token_ms = args.token_ms
+    PET.FavorabilityManager.CONFIG_PATH = Path(scratch_dir()) / 'config.json'
+
+    class Owner:
+        favorability = 50
+        chatMemory = PET.ConversationMemory()
+
+    window = PET.AIPetChatWindow(Owner(), chat=service)
+    deltas = []
+    service.delta.connect(lambda request_id, text: deltas.append(text))
+    runs = []
+    for _ in range(args.stream_requests):
+        deltas.clear()
+        window.stream_updates = 0
+        window.user_entry.setText('讲个长一点的故事')
+        start = time.perf_counter()
+        window.send_message()
+        request_id = window.request_id
+        wait_until(lambda: window.request_id is None, args.timeout * 1000 + args.tokens * args.token_ms)
+        timing = service.timing(request_id) or {}
+        runs.append({'ttft_ms': timing.get('ttft_ms'), 'total_ms': (time.perf_counter() - start) * 1000,
+                     'tokens': timing.get('tokens'), 'tokens_per_s': timing.get('tokens_per_s'),
+                     'deltas': len(deltas), 'text_updates': window.stream_updates})
+    window.close()
+    result['streaming'] = {
+        'tokens': args.tokens, 'token_ms': args.token_ms, 'runs': runs,
+        'ttft': summarize([r['ttft_ms'] for r in runs if r['ttft_ms'] is not None]),
+        'total': summarize([r['total_ms'] for r in runs]),
+    }
+
+    # 长会话：带记忆的请求大小与延迟应保持平稳（对照：每次发送完整对话记录）
+    standin.reply = '喵~今天也要开心哦，' * 6
+    standin.tokens = 1
+    memory = PET.ConversationMemory(args.context)
+    transcript = []
+    system_prompt = '你是友好的猫咪小橘，会积极回应主人，语气温和。'
+    turns = []
+    for turn in range(args.turns):
+        user_input = f'第{turn}句：今天过得怎么样？给我讲讲你在桌面上看到了什么。'
+        start = time.perf_counter()
+        messages = memory.messages(system_prompt, user_input)
+        build_us = (time.perf_counter() - start) * 1e6
+        replies.clear()
+        request_id = service.submit(messages, timeout=args.timeout, stream=False)
+        wait_until(lambda: request_id in replies, args.timeout * 1000)
+        latency = (time.perf_counter() - start) * 1000
+        reply = replies.get(request_id) or ''
+        memory.record(user_input, reply)
+        transcript += [{'role': 'user', 'content': user_input}, {'role': 'assistant', 'content': reply}]
+        full = [{'role': 'system', 'content': system_prompt}] + transcript
+        turns.append({'request_bytes': standin.last_request_bytes, 'latency_ms': latency, 'build_us': build_us,
+                      'estimated_tokens': sum(PET.estimate_tokens(m['content']) for m in messages),
+                      'full_transcript_bytes': len(json.dumps(full, ensure_ascii=False).encode('utf-8'))})
+    tail = turns[-10:]
+    result['memory'] = {
+        'turns': args.turns, 'context_tokens': args.context, 'stats': memory.stats(),
+        'request_bytes_first': turns[0]['request_bytes'] if turns else 0,
+        'request_bytes_max': max((t['request_bytes'] for t in turns), default=0),
+        'request_bytes_last': turns[-1]['request_bytes'] if turns else 0,
+        'full_transcript_bytes_last': turns[-1]['full_transcript_bytes'] if turns else 0,
+        'estimated_tokens_max': max((t['estimated_tokens'] for t in turns), default=0),
+        'build_us_mean': statistics.fmean(t['build_us'] for t in turns) if turns else 0.0,
+        'latency_first10': summarize([t['latency_ms'] for t in turns[:10]]),
+        'latency_last10': summarize([t['latency_ms'] for t in tail]),
+    }
+    service.cancelAll()
+    standin.close()
+    return result
+
+
+def flatten(value, prefix=''):
+    """把嵌套结果展开为 {'a.b.c': 数值}"""
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(flatten(item, f"{prefix}{key}."))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+
+def compare_results(args):
+    """对比两次结果：耗时(_ms)与内存(_bytes)指标超出容差即视为回退"""
+    with open(args.baseline, encoding='utf-8') as f:
+        old = flatten(json.load(f))
+    with open(args.result, encoding='utf-8') as f:
+        new = flatten(json.load(f))
+    regressions = {}
+    improvements = {}
+    for key in sorted(old.keys() & new.keys()):
+        if not key.endswith(('_ms', '_bytes')) or old[key] <= 0:
+            continue
+        change = new[key] / old[key] - 1
+        if change > args.tolerance:
+            regressions[key] = {'baseline': old[key], 'result': new[key], 'change': change}
+        elif change < -args.tolerance:
+            improvements[key] = {'baseline': old[key], 'result': new[key], 'change': change}
+    return {'tolerance': args.tolerance, 'regressions': regressions, 'improvements': improvements}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='桌宠性能基准')
+    sub = parser.add_subparsers(dest='suite', required=True)
+
+    p_bundle = sub.add_parser('bundle', help='PNG 与精灵包加载耗时对比')
+    p_bundle.add_argument('--mod', default=os.path.join('mod', '0000_core'))
+    p_bundle.add_argument('--bundle', help='精灵包路径，默认 <mod>.petbundle')
+    p_bundle.add_argument('--rebuild', action='store_true', help='重新编译精灵包')
+    p_bundle.add_argument('--repeat', type=int, default=3)
+    p_bundle.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_actions = sub.add_parser('actions', help='驱动 DeskPet 执行每个动作')
+    p_actions.add_argument('--root', help='运行目录（动画路径相对于该目录），默认当前目录')
+    p_actions.add_argument('--duration', type=int, default=3000, help='每个动作持续播放的毫秒数')
+    p_actions.add_argument('--timeout', type=int, default=10000, help='等待加载/切换的超时毫秒数')
+    p_actions.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_render = sub.add_parser('render', help='对比各绘制后端的每帧耗时')
+    p_render.add_argument('--root', help='运行目录（动画路径相对于该目录），默认当前目录')
+    p_render.add_argument('--backends', nargs='+', default=['raster', 'opengl'],
+                          choices=sorted(PET.RENDER_BACKENDS))
+    p_render.add_argument('--duration', type=int, default=5000, help='每个后端播放的毫秒数')
+    p_render.add_argument('--timeout', type=int, default=10000, help='等待加载的超时毫秒数')
+    p_render.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_clones = sub.add_parser('clones', help='宠物数量递增时的CPU开销')
+    p_clones.add_argument('--root', help='运行目录（动画路径相对于该目录），默认当前目录')
+    p_clones.add_argument('--counts', type=int, nargs='+', default=[1, 2, 4, 8, 12])
+    p_clones.add_argument('--duration', type=int, default=5000, help='每种数量播放的毫秒数')
+    p_clones.add_argument('--timeout', type=int, default=10000, help='等待加载的超时毫秒数')
+    p_clones.add_argument('--swarm', action='store_true', help='群体模式：所有宠物共用一个窗口')
+    p_clones.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_zip = sub.add_parser('zip', help='压缩包与目录帧来源对比')
+    p_zip.add_argument('--archive', default=os.path.join('mod', '0000_core', 'file', 'expression.zlps'))
+    p_zip.add_argument('--repeat', type=int, default=3)
+    p_zip.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_manifest = sub.add_parser('manifest', help='mod 清单扫描与取帧耗时')
+    p_manifest.add_argument('--mod', default=PET.MOD_DIR)
+    p_manifest.add_argument('--repeat', type=int, default=3)
+    p_manifest.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_lps = sub.add_parser('lps', help='LPS 解析与缓存耗时')
+    p_lps.add_argument('--source', help='要解析的 mod 目录；缺省时用 vup.lps 生成模拟 mod 集')
+    p_lps.add_argument('--mods', type=int, default=300, help='模拟 mod 数量')
+    p_lps.add_argument('--repeat', type=int, default=3)
+    p_lps.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_chat = sub.add_parser('chat', help='聊天请求延迟（本地替身接口）')
+    p_chat.add_argument('--requests', type=int, default=30)
+    p_chat.add_argument('--delay-ms', type=int, default=50, help='替身接口每个请求的处理时间')
+    p_chat.add_argument('--fail-every', type=int, default=0, help='每 N 个请求返回一次 503（0 表示不失败）')
+    p_chat.add_argument('--timeout', type=float, default=10, help='单次请求超时（秒）')
+    p_chat.add_argument('--stream-requests', type=int, default=5, help='流式请求次数')
+    p_chat.add_argument('--tokens', type=int, default=200, help='流式回复的分段数')
+    p_chat.add_argument('--token-ms', type=float, default=5, help='流式分段间隔（毫秒）')
+    p_chat.add_argument('--turns', type=int, default=100, help='长会话的轮数')
+    p_chat.add_argument('--context', type=int, default=PET.CHAT_CONTEXT_TOKENS, help='聊天记忆的上下文预算')
+    p_chat.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    p_compare = sub.add_parser('compare', help='对比两次结果')
+    p_compare.add_argument('baseline')
+    p_compare.add_argument('result')
+    p_compare.add_argument('--tolerance', type=float, default=0.1, help='允许的变差比例')
+    p_compare.add_argument('-o', '--output', help='结果写入JSON文件')
+
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    status = 0
+    if args.suite == 'compare':
+        result = compare_results(args)
+        status = 1 if result['regressions'] else 0
+    else:
+        _ = QtWidgets.QApplication(sys.argv[:1])  # 保持应用对象到基准结束
+        # 宠物的 [DEBUG] 输出转到 stderr，stdout 只输出JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            suites = {'bundle': bench_bundle, 'actions': bench_actions, 'render': bench_render,
+                      'clones': bench_clones, 'zip': bench_zip, 'manifest': bench_manifest,
+                      'lps': bench_lps, 'chat': bench_chat}
+            result = suites[args.suite](args)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())